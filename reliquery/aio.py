@@ -0,0 +1,410 @@
+"""
+Asyncio access to storages and relics.
+
+Requests run on the bounded thread pool of the wrapped storage, and a
+semaphore per event loop caps how many are in flight at once. S3 reads and
+writes use aiobotocore directly when it is installed.
+"""
+import asyncio
+import json
+import weakref
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .relic import Relic
+from .storage import (
+    DATA_TYPES,
+    S3Storage,
+    Storage,
+    StorageItemDoesNotExist,
+    StoragePath,
+    _run_in_pool,
+)
+
+aiobotocore_supported = True
+
+try:
+    from aiobotocore.session import get_session
+    from aiobotocore.config import AioConfig
+    from botocore import UNSIGNED
+except ModuleNotFoundError:
+    aiobotocore_supported = False
+
+
+class AsyncStorage:
+    """
+    Awaitable counterparts of the Storage methods, prefixed with a.
+
+    Parameters
+    ----------
+
+    storage : Storage
+        storage the requests are made against
+    max_concurrency : int
+        maximum number of requests in flight on one event loop
+    """
+
+    def __init__(self, storage: Storage, max_concurrency: int = 64) -> None:
+        self.storage = storage
+        self.name = storage.name
+        self.max_concurrency = max_concurrency if storage.thread_safe else 1
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_event_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _run(self, fn, *args, **kwargs) -> Any:
+        def call(_):
+            return fn(*args, **kwargs)
+
+        async with self._semaphore():
+            return await asyncio.get_event_loop().run_in_executor(
+                self.storage._executor(), _run_in_pool, call, None
+            )
+
+    async def aput_file(self, path: StoragePath, file_path: str) -> None:
+        await self._run(self.storage.put_file, path, file_path)
+
+    async def aput_binary_obj(self, path: StoragePath, buffer: BytesIO) -> None:
+        await self._run(self.storage.put_binary_obj, path, buffer)
+
+    async def aget_binary_obj(self, path: StoragePath) -> BytesIO:
+        """
+        Unlike get_binary_obj the object is always read in full, off the event
+        loop, and returned as a BytesIO.
+        """
+        return await self._run(self.storage.read_bytes, path)
+
+    async def aput_text(self, path: StoragePath, text: str) -> None:
+        await self._run(self.storage.put_text, path, text)
+
+    async def aget_text(self, path: StoragePath) -> str:
+        return await self._run(self.storage.get_text, path)
+
+    async def alist_keys(self, path: StoragePath) -> List[str]:
+        return await self._run(self.storage.list_keys, path)
+
+    async def aput_metadata(self, path: StoragePath, metadata: Dict) -> None:
+        await self._run(self.storage.put_metadata, path, metadata)
+
+    async def aremove_metadata(self, path: StoragePath) -> None:
+        await self._run(self.storage.remove_metadata, path)
+
+    async def aget_metadata(self, path: StoragePath, root_key: str) -> Dict:
+        return await self._run(self.storage.get_metadata, path, root_key)
+
+    async def aput_tags(self, path: StoragePath, tags: Dict) -> None:
+        await self._run(self.storage.put_tags, path, tags)
+
+    async def aget_tags(self, path: StoragePath) -> Dict:
+        return await self._run(self.storage.get_tags, path)
+
+    async def aget_all_relic_data(self) -> List[Dict]:
+        return await self._run(self.storage.get_all_relic_data)
+
+    async def aremove_obj(self, path: StoragePath) -> None:
+        await self._run(self.storage.remove_obj, path)
+
+    async def aremove_relic(self, path: StoragePath) -> None:
+        await self._run(self.storage.remove_relic, path)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class _LoopClient:
+    """
+    The aiobotocore client of one event loop. It is closed when the loop is
+    collected without aclose having been awaited on it.
+    """
+
+    __slots__ = ("opening", "context", "client")
+
+    def __init__(self) -> None:
+        self.opening = None
+        self.context = None
+        self.client = None
+
+    def close(self) -> None:
+        if self.context is None:
+            return
+
+        closing = self.context.__aexit__(None, None, None)
+        self.context, self.client = None, None
+
+        # The loop the client was opened on is gone, its connections are
+        # closed from the running loop or from a loop of their own
+        running = asyncio._get_running_loop()
+        if running is not None:
+            running.create_task(closing)
+            return
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(closing)
+        finally:
+            loop.close()
+
+
+class S3AsyncStorage(AsyncStorage):
+    """
+    AsyncStorage making object requests with aiobotocore. Every other request
+    runs on the storage's thread pool.
+    """
+
+    def __init__(self, storage: S3Storage, max_concurrency: int = 64) -> None:
+        super().__init__(storage, max_concurrency)
+        self._clients = weakref.WeakKeyDictionary()
+
+    async def _open_client(self):
+        config = None if self.storage.signed else AioConfig(signature_version=UNSIGNED)
+        context = get_session().create_client("s3", config=config)
+        return context, await context.__aenter__()
+
+    async def _client(self):
+        # One client per event loop, opened by whichever request comes first
+        loop = asyncio.get_event_loop()
+        state = self._clients.get(loop)
+        if state is None:
+            state = self._clients[loop] = _LoopClient()
+            state.opening = asyncio.ensure_future(self._open_client())
+            weakref.finalize(loop, state.close)
+
+        if state.client is None:
+            state.context, state.client = await state.opening
+            state.opening = None
+        return state.client
+
+    async def aget_binary_obj(self, path: StoragePath) -> BytesIO:
+        client = await self._client()
+        async with self._semaphore():
+            try:
+                response = await client.get_object(
+                    Bucket=self.storage.s3_bucket, Key=self.storage._join_path(path)
+                )
+            except client.exceptions.NoSuchKey:
+                raise StorageItemDoesNotExist
+
+            async with response["Body"] as body:
+                return BytesIO(await body.read())
+
+    async def aput_binary_obj(self, path: StoragePath, buffer: BytesIO) -> None:
+        client = await self._client()
+        async with self._semaphore():
+            await client.put_object(
+                Bucket=self.storage.s3_bucket,
+                Key=self.storage._join_path(path),
+                Body=buffer.read(),
+            )
+
+    async def aget_text(self, path: StoragePath, encoding: str = "utf-8") -> str:
+        return (await self.aget_binary_obj(path)).read().decode(encoding)
+
+    async def aput_text(
+        self, path: StoragePath, text: str, encoding: str = "utf-8"
+    ) -> None:
+        await self.aput_binary_obj(path, BytesIO(text.encode(encoding)))
+
+    async def alist_keys(self, path: StoragePath) -> List[str]:
+        client = await self._client()
+        prefix = self.storage._join_path(path)
+        keys = []
+        async with self._semaphore():
+            paginator = client.get_paginator("list_objects_v2")
+            async for page in paginator.paginate(
+                Bucket=self.storage.s3_bucket, Prefix=prefix
+            ):
+                keys.extend(
+                    c["Key"][len(prefix) + 1 :] for c in page.get("Contents", [])
+                )
+
+        return keys
+
+    async def aremove_obj(self, path: StoragePath) -> None:
+        client = await self._client()
+        async with self._semaphore():
+            await client.delete_object(
+                Bucket=self.storage.s3_bucket, Key=self.storage._join_path(path)
+            )
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_event_loop()
+        if loop in self._clients:
+            await self._client()
+            state = self._clients.pop(loop, None)
+            if state is not None and state.context is not None:
+                context, state.context, state.client = state.context, None, None
+                await context.__aexit__(None, None, None)
+
+
+def async_storage(storage: Storage, max_concurrency: int = 64) -> AsyncStorage:
+    """
+    Wraps a storage in the AsyncStorage best suited to it.
+    """
+    if aiobotocore_supported and isinstance(storage, S3Storage):
+        return S3AsyncStorage(storage, max_concurrency)
+
+    return AsyncStorage(storage, max_concurrency)
+
+
+class AsyncRelic:
+    """
+    Awaitable counterparts of the Relic methods, prefixed with a. Reads go
+    straight to the AsyncStorage, writes run the Relic method off the event
+    loop so manifests and catalogs are kept up to date.
+
+    Parameters
+    ----------
+
+    relic : Relic
+        relic to access, see AsyncRelic.open to create one without blocking
+    storage : AsyncStorage
+        defaults to async_storage(relic.storage)
+    """
+
+    def __init__(self, relic: Relic, storage: Optional[AsyncStorage] = None) -> None:
+        self.relic = relic
+        self.name = relic.name
+        self.relic_type = relic.relic_type
+        self.storage = storage if storage is not None else async_storage(relic.storage)
+
+    @classmethod
+    async def open(
+        cls,
+        name: str,
+        relic_type: str,
+        storage: Storage,
+        check_exists: bool = True,
+    ) -> "AsyncRelic":
+        relic = Relic(name, relic_type, storage=storage, check_exists=False)
+        async_relic = cls(relic)
+        if check_exists:
+            await async_relic.storage._run(relic._ensure_exists)
+
+        return async_relic
+
+    def _path(self, data_type: str, name: str) -> StoragePath:
+        Relic.assert_valid_id(name)
+        return [self.relic_type, self.name, data_type, name]
+
+    async def _read_manifest(self) -> Optional[Dict]:
+        try:
+            return json.loads(await self.storage.aget_text(self.relic._manifest_path()))
+        except StorageItemDoesNotExist:
+            return None
+
+    async def _list_artifacts(self, data_type: str) -> List[str]:
+        manifest = await self._read_manifest()
+        if manifest is None:
+            return await self.storage.alist_keys(
+                [self.relic_type, self.name, data_type]
+            )
+
+        return list(manifest["metadata"].get(data_type, {}))
+
+    async def adescribe(self) -> Dict:
+        manifest = await self._read_manifest()
+        if manifest is None:
+            return await self.storage.aget_metadata(
+                [self.relic_type, self.name, "metadata"], self.name
+            )
+
+        return {
+            self.name: {
+                data_type: list(manifest["metadata"].get(data_type, {}).values())
+                for data_type in DATA_TYPES
+            }
+        }
+
+    async def alist_arrays(self) -> List[str]:
+        return await self._list_artifacts("arrays")
+
+    async def alist_html(self) -> List[str]:
+        return await self._list_artifacts("html")
+
+    async def alist_text(self) -> List[str]:
+        return await self._list_artifacts("text")
+
+    async def alist_images(self) -> List[str]:
+        return await self._list_artifacts("images")
+
+    async def alist_json(self) -> List[str]:
+        return await self._list_artifacts("json")
+
+    async def alist_pandasdf(self) -> List[str]:
+        return await self._list_artifacts("pandasdf")
+
+    async def alist_files(self) -> List[str]:
+        return await self._list_artifacts("files")
+
+    async def alist_notebooks(self) -> List[str]:
+        return await self._list_artifacts("notebooks")
+
+    async def alist_tags(self) -> Dict:
+        return await self.storage.aget_tags([self.relic_type, self.name, "tags"])
+
+    async def aget_array(self, name: str) -> np.ndarray:
+        buffer = await self.storage.aget_binary_obj(self._path("arrays", name))
+        return np.load(buffer, allow_pickle=False)
+
+    async def aget_html(self, name: str) -> str:
+        buffer = await self.storage.aget_binary_obj(self._path("html", name))
+        return buffer.read().decode("utf-8")
+
+    async def aget_text(self, name: str) -> str:
+        return await self.storage.aget_text(self._path("text", name))
+
+    async def aget_image(self, name: str) -> BytesIO:
+        return await self.storage.aget_binary_obj(self._path("images", name))
+
+    async def aget_json(self, name: str) -> Dict:
+        return json.loads(await self.storage.aget_text(self._path("json", name)))
+
+    async def aget_pandasdf(self, name: str) -> pd.DataFrame:
+        return pd.read_json(await self.storage.aget_text(self._path("pandasdf", name)))
+
+    async def aget_file(self, name: str) -> BytesIO:
+        return await self.storage.aget_binary_obj(self._path("files", name))
+
+    async def aget_notebook(self, name: str) -> BytesIO:
+        return await self.storage.aget_binary_obj(self._path("notebooks", name))
+
+    async def aget_notebook_html(self, name: str) -> str:
+        return await self.storage.aget_text(self._path("notebooks-html", name))
+
+    async def aadd_array(self, name: str, array: np.ndarray) -> None:
+        await self.storage._run(self.relic.add_array, name, array)
+
+    async def aadd_html_string(self, name: str, html_str: str) -> None:
+        await self.storage._run(self.relic.add_html_string, name, html_str)
+
+    async def aadd_html_from_path(self, name: str, html_path: str) -> None:
+        await self.storage._run(self.relic.add_html_from_path, name, html_path)
+
+    async def aadd_text(self, name: str, text: str) -> None:
+        await self.storage._run(self.relic.add_text, name, text)
+
+    async def aadd_image(self, name: str, image_bytes: BytesIO) -> None:
+        await self.storage._run(self.relic.add_image, name, image_bytes)
+
+    async def aadd_json(self, name: str, json_data: Dict) -> None:
+        await self.storage._run(self.relic.add_json, name, json_data)
+
+    async def aadd_pandasdf(self, name: str, pandas_data: pd.DataFrame) -> None:
+        await self.storage._run(self.relic.add_pandasdf, name, pandas_data)
+
+    async def aadd_files_from_path(self, name: str, path: str) -> None:
+        await self.storage._run(self.relic.add_files_from_path, name, path)
+
+    async def aadd_notebook_from_path(self, name: str, path: str) -> None:
+        await self.storage._run(self.relic.add_notebook_from_path, name, path)
+
+    async def aadd_tag(self, tags: Dict) -> None:
+        await self.storage._run(self.relic.add_tag, tags)
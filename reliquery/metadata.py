@@ -1,18 +1,145 @@
 import sqlite3
+from contextlib import contextmanager
 from sqlite3 import Error
 from sqlite3.dbapi2 import Connection
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional
 import datetime as dt
 import logging
+import math
+import os
+import threading
+import weakref
+
+fts5_supported = True
+
+try:
+    _conn = sqlite3.connect(":memory:")
+    _conn.execute("CREATE VIRTUAL TABLE fts5_check USING fts5(content)")
+    _conn.close()
+except Error:
+    fts5_supported = False
 
 
 dt_format = "%m/%d/%Y %H:%M:%S"
 
+# Formats tried, in order, when reading a string tag value as a datetime
+tag_dt_formats = [
+    "%Y-%m-%d",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    dt_format,
+]
+
+epoch = dt.datetime(1970, 1, 1)
+
+
+def to_epoch_us(value: dt.datetime) -> int:
+    """
+    Microseconds since the unix epoch, naive datetimes are taken as UTC.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(dt.timezone.utc).replace(tzinfo=None)
+
+    return (value - epoch) // dt.timedelta(microseconds=1)
+
+
+def parse_timestamp(value) -> Optional[int]:
+    """
+    Reads a timestamp as epoch microseconds. Legacy timestamps are strings in
+    dt_format and are converted when they are read.
+    """
+    if value is None or isinstance(value, int):
+        return value
+
+    if isinstance(value, dt.datetime):
+        return to_epoch_us(value)
+
+    if isinstance(value, float):
+        return int(value)
+
+    try:
+        return int(value)
+    except ValueError:
+        pass
+
+    for format in tag_dt_formats:
+        try:
+            return to_epoch_us(dt.datetime.strptime(value, format))
+        except ValueError:
+            pass
+
+    raise ValueError(f"Unrecognized timestamp {value!r}")
+
+
+def format_timestamp(value: int) -> str:
+    """
+    Formats epoch microseconds as a dt_format string.
+    """
+    return (epoch + dt.timedelta(microseconds=value)).strftime(dt_format)
+
+
+def typed_tag_value(value) -> Tuple[Optional[float], Optional[int]]:
+    """
+    Reads a tag value as a number or as a datetime so it can be range queried.
+
+    returns: (number, epoch microseconds), either or both None
+    """
+    if isinstance(value, bool):
+        return None, None
+
+    if isinstance(value, (int, float)):
+        return (float(value), None) if math.isfinite(value) else (None, None)
+
+    if isinstance(value, dt.datetime):
+        return None, to_epoch_us(value)
+
+    if isinstance(value, str):
+        try:
+            number = float(value)
+            if math.isfinite(number):
+                return number, None
+        except ValueError:
+            pass
+
+        for format in tag_dt_formats:
+            try:
+                return None, to_epoch_us(dt.datetime.strptime(value, format))
+            except ValueError:
+                pass
+
+    return None, None
+
+
+def range_bound(value):
+    """
+    Reads a tag range bound the way tag values are read. Dates and strings
+    holding a timestamp become datetimes, numeric strings become numbers.
+    """
+    if isinstance(value, dt.date) and not isinstance(value, dt.datetime):
+        return dt.datetime.combine(value, dt.time())
+
+    if isinstance(value, str):
+        number, time = typed_tag_value(value)
+        if number is not None:
+            return number
+        if time is None:
+            raise ValueError(f"Unrecognized range bound {value!r}")
+        return epoch + dt.timedelta(microseconds=time)
+
+    return value
+
 
 class Data:
+    __slots__ = ()
+
     def get_dict(self) -> Dict:
         raise NotImplementedError
 
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.get_dict()})"
+
     @classmethod
     def parse_dict(self, dict: Dict):
         raise NotImplementedError
@@ -23,19 +150,30 @@ class Data:
 
 
 class RelicData(Data):
+    __slots__ = (
+        "relic_name",
+        "relic_type",
+        "storage_name",
+        "id",
+        "last_modified",
+        "marker",
+    )
+
     def __init__(
         self,
         relic_name: str,
         relic_type: str,
         storage_name: str,
         id: int = None,
-        last_modified: str = None,
+        last_modified: int = None,
+        marker: str = None,
     ) -> None:
         self.relic_name = relic_name
         self.relic_type = relic_type
         self.storage_name = storage_name
         self.id = id
-        self.last_modified = last_modified
+        self.last_modified = parse_timestamp(last_modified)
+        self.marker = marker
 
     def get_dict(self) -> Dict:
         return {
@@ -44,6 +182,7 @@ class RelicData(Data):
             "relic_type": self.relic_type,
             "storage_name": self.storage_name,
             "last_modified": self.last_modified,
+            "marker": self.marker,
         }
 
     @classmethod
@@ -54,6 +193,7 @@ class RelicData(Data):
             storage_name=dict["storage_name"],
             id=dict["id"] if "id" in dict else None,
             last_modified=dict["last_modified"] if "last_modified" in dict else None,
+            marker=dict["marker"] if "marker" in dict else None,
         )
 
     @classmethod
@@ -64,6 +204,7 @@ class RelicData(Data):
             "relic_type": result[2],
             "storage_name": result[3],
             "last_modified": result[4],
+            "marker": result[5],
         }
 
     @classmethod
@@ -72,6 +213,8 @@ class RelicData(Data):
 
 
 class RelicTag(Data):
+    __slots__ = ("id", "relic", "tags", "date_created")
+
     def __init__(
         self,
         relic: RelicData,
@@ -107,6 +250,13 @@ class RelicTag(Data):
 
 
 class Metadata(Data):
+    """
+    Metadata of a single artifact. last_modified is held as epoch
+    microseconds, the dict stored alongside the artifact keeps dt_format.
+    """
+
+    __slots__ = ("id", "name", "data_type", "relic", "size", "shape", "last_modified")
+
     def __init__(
         self,
         name: str,
@@ -115,7 +265,7 @@ class Metadata(Data):
         size: float = None,
         shape: str = None,
         id: int = None,
-        last_modified: str = None,
+        last_modified: int = None,
     ) -> None:
         self.id = id
         self.name = name
@@ -124,9 +274,9 @@ class Metadata(Data):
         self.size = size
         self.shape = shape
         self.last_modified = (
-            last_modified
+            parse_timestamp(last_modified)
             if last_modified is not None
-            else dt.datetime.utcnow().strftime(dt_format)
+            else to_epoch_us(dt.datetime.utcnow())
         )
 
     def get_dict(self) -> Dict:
@@ -138,7 +288,7 @@ class Metadata(Data):
             "relic_type": self.relic.relic_type,
             "size": self.size,
             "shape": self.shape,
-            "last_modified": self.last_modified,
+            "last_modified": format_timestamp(self.last_modified),
         }
 
     @classmethod
@@ -172,7 +322,34 @@ class Metadata(Data):
         }
 
 
+class _ThreadConnection:
+    """
+    Holds the connection of one thread in its thread locals, which are dropped
+    when the thread exits.
+    """
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: Connection) -> None:
+        self.conn = conn
+
+
+def _release_connection(conn: Connection, connections: set, lock) -> None:
+    with lock:
+        connections.discard(conn)
+    conn.close()
+
+
 class MetadataDB:
+    """
+    SQLite index of relics, tags and artifact metadata.
+
+    A file backed database runs in WAL mode with one connection per thread so
+    readers see a consistent snapshot while a sync is writing. The in-memory
+    database shares a single connection between threads. In both cases writes
+    are serialized through one writer lock. The connection of a thread is
+    closed when the thread exits.
+    """
 
     metadata_table = """
     CREATE TABLE IF NOT EXISTS metadata (
@@ -182,7 +359,7 @@ class MetadataDB:
         relic_id integer NOT NULL,
         size real,
         shape text,
-        last_modified text NOT NULL
+        last_modified integer NOT NULL
     )
     """
 
@@ -191,7 +368,9 @@ class MetadataDB:
         id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
         relic_id integer NOT NULL,
         key text NOT NULL,
-        value text NOT NULL
+        value text NOT NULL,
+        num_value real,
+        time_value integer
     )
     """
 
@@ -201,67 +380,331 @@ class MetadataDB:
         relic_name text NOT NULL,
         relic_type text NOT NULL,
         storage_name text NOT NULL,
-        last_modified text NOT NULL
+        last_modified integer NOT NULL,
+        marker text
     )
     """
 
-    def __init__(self) -> None:
-        self.conn = None
+    # What the last sync indexed besides relics and tags
+    index_options_table = """
+    CREATE TABLE IF NOT EXISTS index_options (
+        name text NOT NULL PRIMARY KEY,
+        enabled integer NOT NULL
+    )
+    """
 
-        try:
-            self.conn = self.connect_db()
-        except Error as e:
-            logging.warning(f"Error connecting to database: {e}")
-        finally:
-            if self.conn:
-                try:
-                    cur = self.conn.cursor()
-                    cur.execute(self.metadata_table)
-                    cur.execute(self.relic_tag_table)
-                    cur.execute(self.relic_table)
-                    self.conn.commit()
-                except Error as e:
-                    logging.warning(f"Error creating database tables: {e}")
+    content_index_table = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS content_index USING fts5(
+        relic_id UNINDEXED,
+        data_type UNINDEXED,
+        name UNINDEXED,
+        content
+    )
+    """
 
-    def connect_db(self) -> Connection:
-        return sqlite3.connect(":memory:")
+    content_hash_table = """
+    CREATE TABLE IF NOT EXISTS content_hashes (
+        id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+        relic_id integer NOT NULL,
+        data_type text NOT NULL,
+        name text NOT NULL,
+        content_hash text NOT NULL
+    )
+    """
+
+    # Rollups of metadata sizes kept up to date by the usage_triggers
+    relic_usage_table = """
+    CREATE TABLE IF NOT EXISTS relic_usage (
+        relic_id integer NOT NULL PRIMARY KEY,
+        artifacts integer NOT NULL,
+        bytes real NOT NULL
+    )
+    """
+
+    type_usage_table = """
+    CREATE TABLE IF NOT EXISTS type_usage (
+        storage_name text NOT NULL,
+        relic_type text NOT NULL,
+        data_type text NOT NULL,
+        artifacts integer NOT NULL,
+        bytes real NOT NULL,
+        PRIMARY KEY (storage_name, relic_type, data_type)
+    )
+    """
+
+    usage_triggers = [
+        """
+        CREATE TRIGGER IF NOT EXISTS metadata_usage_insert
+        AFTER INSERT ON metadata
+        BEGIN
+            INSERT INTO relic_usage VALUES (NEW.relic_id, 1, IFNULL(NEW.size, 0))
+            ON CONFLICT (relic_id) DO UPDATE SET
+            artifacts = artifacts + 1,
+            bytes = bytes + excluded.bytes;
+
+            INSERT INTO type_usage
+            SELECT storage_name, relic_type, NEW.data_type, 1, IFNULL(NEW.size, 0)
+            FROM relics WHERE id = NEW.relic_id
+            ON CONFLICT (storage_name, relic_type, data_type) DO UPDATE SET
+            artifacts = artifacts + 1,
+            bytes = bytes + excluded.bytes;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS metadata_usage_delete
+        AFTER DELETE ON metadata
+        BEGIN
+            UPDATE relic_usage
+            SET artifacts = artifacts - 1, bytes = bytes - IFNULL(OLD.size, 0)
+            WHERE relic_id = OLD.relic_id;
+
+            UPDATE type_usage
+            SET artifacts = artifacts - 1, bytes = bytes - IFNULL(OLD.size, 0)
+            WHERE data_type = OLD.data_type
+            AND (storage_name, relic_type) IN (
+                SELECT storage_name, relic_type FROM relics WHERE id = OLD.relic_id
+            );
+
+            DELETE FROM relic_usage WHERE artifacts <= 0;
+            DELETE FROM type_usage WHERE artifacts <= 0;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS metadata_usage_update
+        AFTER UPDATE OF size, data_type, relic_id ON metadata
+        BEGIN
+            UPDATE relic_usage
+            SET artifacts = artifacts - 1, bytes = bytes - IFNULL(OLD.size, 0)
+            WHERE relic_id = OLD.relic_id;
+
+            UPDATE type_usage
+            SET artifacts = artifacts - 1, bytes = bytes - IFNULL(OLD.size, 0)
+            WHERE data_type = OLD.data_type
+            AND (storage_name, relic_type) IN (
+                SELECT storage_name, relic_type FROM relics WHERE id = OLD.relic_id
+            );
+
+            INSERT INTO relic_usage VALUES (NEW.relic_id, 1, IFNULL(NEW.size, 0))
+            ON CONFLICT (relic_id) DO UPDATE SET
+            artifacts = artifacts + 1,
+            bytes = bytes + excluded.bytes;
+
+            INSERT INTO type_usage
+            SELECT storage_name, relic_type, NEW.data_type, 1, IFNULL(NEW.size, 0)
+            FROM relics WHERE id = NEW.relic_id
+            ON CONFLICT (storage_name, relic_type, data_type) DO UPDATE SET
+            artifacts = artifacts + 1,
+            bytes = bytes + excluded.bytes;
+
+            DELETE FROM relic_usage WHERE artifacts <= 0;
+            DELETE FROM type_usage WHERE artifacts <= 0;
+        END
+        """,
+    ]
+
+    # Bump whenever a table definition changes. A file backed database with a
+    # different version is treated as a stale cache and rebuilt from scratch.
+    schema_version = 9
+
+    tables = [
+        "metadata",
+        "relic_tags",
+        "relics",
+        "content_index",
+        "content_hashes",
+        "relic_usage",
+        "type_usage",
+        "index_options",
+    ]
+
+    indexes = [
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS relics_name_idx
+        ON relics (relic_name, relic_type, storage_name)
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS relic_tags_key_value_idx
+        ON relic_tags (key, value, relic_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS relic_tags_relic_idx
+        ON relic_tags (relic_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS relic_tags_num_value_idx
+        ON relic_tags (key, num_value)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS relic_tags_time_value_idx
+        ON relic_tags (key, time_value)
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS metadata_name_idx
+        ON metadata (relic_id, data_type, name)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS relics_storage_idx
+        ON relics (storage_name, relic_type)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS metadata_data_type_idx
+        ON metadata (data_type, size)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS metadata_last_modified_idx
+        ON metadata (last_modified)
+        """,
+    ]
+
+    content_hash_index = """
+    CREATE UNIQUE INDEX IF NOT EXISTS content_hashes_name_idx
+    ON content_hashes (relic_id, data_type, name)
+    """
+
+    def __init__(self, db_path: str = ":memory:") -> None:
+        self.db_path = db_path
+        self.in_memory = db_path == ":memory:"
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._connections_lock = threading.Lock()
+        self._connections = set()
+        self._shared_conn = None
 
-    def add_metadata(self, metadata: Metadata) -> None:
         try:
-            cur = self.conn.cursor()
+            if self.in_memory:
+                self._shared_conn = self.connect_db()
+            else:
+                db_dir = os.path.dirname(os.path.abspath(self.db_path))
+                os.makedirs(db_dir, exist_ok=True)
+            self._create_tables()
+        except Error as e:
+            logging.warning(f"Error creating database tables: {e}")
 
-            cur.execute(
-                """
-                SELECT * FROM metadata
-                WHERE name = ?
-                AND
-                data_type = ?
-                AND
-                relic_id = ?
-                LIMIT 1
-                """,
-                (metadata.name, metadata.data_type, metadata.relic.id),
+    @property
+    def conn(self) -> Connection:
+        """
+        The connection of the calling thread, opened on first use.
+        """
+        if self.in_memory:
+            return self._shared_conn
+
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ThreadConnection(self.connect_db())
+            weakref.finalize(
+                holder,
+                _release_connection,
+                holder.conn,
+                self._connections,
+                self._connections_lock,
             )
-            rows = cur.fetchall()
+        return holder.conn
 
-            if len(rows) > 0:
-                self.update_metadata(metadata)
-                return
+    def connect_db(self) -> Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if not self.in_memory:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
 
-            cur.execute(
-                "INSERT into metadata VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (
-                    None,
-                    metadata.name,
-                    metadata.data_type,
-                    metadata.relic.id,
-                    metadata.size,
-                    metadata.shape,
-                    metadata.last_modified,
-                ),
-            )
+        with self._connections_lock:
+            self._connections.add(conn)
+        return conn
 
-            self.conn.commit()
+    def close(self) -> None:
+        """
+        Closes the connections of every thread. Queries other threads are
+        still running fail, so only close once they are done. Threads using
+        the database afterwards open new connections.
+        """
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+        self._shared_conn = None
+
+    def _create_tables(self) -> None:
+        with self._transaction() as cur:
+            version = cur.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.schema_version:
+                for table in self.tables:
+                    cur.execute(f"DROP TABLE IF EXISTS {table}")
+
+            cur.execute(self.metadata_table)
+            cur.execute(self.relic_tag_table)
+            cur.execute(self.relic_table)
+            cur.execute(self.relic_usage_table)
+            cur.execute(self.type_usage_table)
+            cur.execute(self.index_options_table)
+            for index in self.indexes:
+                cur.execute(index)
+            for trigger in self.usage_triggers:
+                cur.execute(trigger)
+            if fts5_supported:
+                cur.execute(self.content_index_table)
+                cur.execute(self.content_hash_table)
+                cur.execute(self.content_hash_index)
+            cur.execute(f"PRAGMA user_version = {self.schema_version}")
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Yields a cursor whose statements are committed together, or rolled
+        back together if any of them fail. Holds the writer lock throughout.
+        """
+        with self._write_lock:
+            conn = self.conn
+            cur = conn.cursor()
+            try:
+                yield cur
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Yields a cursor whose reads all see the same committed state of the
+        database, even while another thread is syncing. The in-memory
+        database has a single shared connection so writers are held off
+        instead.
+        """
+        if self.in_memory:
+            with self._write_lock:
+                yield self.conn.cursor()
+            return
+
+        conn = self.conn
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        try:
+            yield cur
+        finally:
+            conn.rollback()
+
+    def add_metadata(self, metadata: Metadata) -> None:
+        try:
+            with self._transaction() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (relic_id, data_type, name) DO UPDATE SET
+                    size=excluded.size,
+                    shape=excluded.shape,
+                    last_modified=excluded.last_modified
+                    """,
+                    (
+                        None,
+                        metadata.name,
+                        metadata.data_type,
+                        metadata.relic.id,
+                        metadata.size,
+                        metadata.shape,
+                        metadata.last_modified,
+                    ),
+                )
 
         except Error as e:
             logging.warning(f"Error adding metadata: {metadata} | {e.__class__}: {e}")
@@ -305,53 +748,92 @@ class MetadataDB:
                 + f"name={name}, type={data_type} | {e.__class__()}: {e}"
             )
 
-    def get_all_metadata(self) -> List:
+    def get_all_metadata(
+        self,
+        storage: str = None,
+        relic_type: str = None,
+        data_type: str = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Metadata]:
+        """
+        Streams metadata joined with its relic, reading batch_size rows at a
+        time. Results can be narrowed down by storage, relic_type and data_type.
+        """
+        statement = """
+            SELECT m.id, m.name, m.data_type, m.size, m.shape, m.last_modified,
+                rl.id, rl.relic_name, rl.relic_type, rl.storage_name,
+                rl.last_modified, rl.marker
+            FROM metadata m
+            JOIN relics rl ON rl.id = m.relic_id
+            """
+        filters = []
+        params = []
+        for column, value in (
+            ("rl.storage_name", storage),
+            ("rl.relic_type", relic_type),
+            ("m.data_type", data_type),
+        ):
+            if value is not None:
+                filters.append(f"{column} = ?")
+                params.append(value)
+
+        if filters:
+            statement += "WHERE " + " AND ".join(filters)
+
         try:
             cur = self.conn.cursor()
+            cur.execute(statement, params)
 
-            cur.execute("""SELECT * FROM metadata """)
-            rows = cur.fetchall()
-
-            if len(rows) > 0:
+            relics = {}
+            rows = cur.fetchmany(batch_size)
+            while rows:
                 for row in rows:
-                    relic = self.get_relic_data_by_id(row[3])
+                    relic = relics.get(row[6])
+                    if relic is None:
+                        relic = relics[row[6]] = RelicData(
+                            row[7],
+                            row[8],
+                            row[9],
+                            id=row[6],
+                            last_modified=row[10],
+                            marker=row[11],
+                        )
+
                     yield Metadata(
                         name=row[1],
                         data_type=row[2],
                         relic=relic,
-                        size=row[4],
-                        last_modified=row[6],
-                        shape=row[5],
+                        size=row[3],
+                        last_modified=row[5],
+                        shape=row[4],
                         id=row[0],
                     )
-            else:
-                return []
+
+                rows = cur.fetchmany(batch_size)
 
         except Error as e:
             logging.warning("Error getting all metadata | " + f"{e.__class__()}: {e}")
 
     def update_metadata(self, metadata: Metadata) -> None:
         try:
-            cur = self.conn.cursor()
-
-            cur.execute(
-                """
-                UPDATE metadata
-                SET name=?, data_type=?, relic_id=?, size=?, shape=?, last_modified=?
-                WHERE id=?
-                """,
-                (
-                    metadata.name,
-                    metadata.data_type,
-                    metadata.relic.id,
-                    metadata.size,
-                    metadata.shape,
-                    metadata.last_modified,
-                    metadata.id,
-                ),
-            )
-
-            self.conn.commit()
+            with self._transaction() as cur:
+                cur.execute(
+                    """
+                    UPDATE metadata
+                    SET name=?, data_type=?, relic_id=?,
+                    size=?, shape=?, last_modified=?
+                    WHERE id=?
+                    """,
+                    (
+                        metadata.name,
+                        metadata.data_type,
+                        metadata.relic.id,
+                        metadata.size,
+                        metadata.shape,
+                        metadata.last_modified,
+                        metadata.id,
+                    ),
+                )
 
         except Error as e:
             print(e)
@@ -373,63 +855,270 @@ class MetadataDB:
 
         return results
 
+    def iter_query(
+        self, statement: str, params: Tuple = (), batch_size: int = 1000
+    ) -> Iterator[Tuple]:
+        """
+        Yields the rows of a parameterized statement, fetching batch_size rows
+        at a time. Errors are raised rather than logged.
+        """
+        cur = self.conn.cursor()
+        try:
+            cur.execute(statement, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cur.close()
+
+    def query_page(
+        self,
+        statement: str,
+        params: Tuple = (),
+        key: str = "id",
+        after=None,
+        limit: int = 100,
+    ) -> Tuple[List[Tuple], Optional[object]]:
+        """
+        Returns one keyset page of a statement ordered by the key column along
+        with the key to pass as after for the next page, None on the last page.
+        """
+        if not key.isidentifier():
+            raise ValueError(f"Invalid key column {key!r}")
+
+        sql = f"SELECT * FROM ({statement})"
+        args = tuple(params)
+        if after is not None:
+            sql += f" WHERE {key} > ?"
+            args += (after,)
+        sql += f" ORDER BY {key} LIMIT ?"
+        args += (limit,)
+
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql, args)
+            columns = [d[0] for d in cur.description]
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+
+        next_after = rows[-1][columns.index(key)] if len(rows) == limit else None
+        return rows, next_after
+
+    def get_content_hashes(self, relic: RelicData) -> Dict[Tuple[str, str], str]:
+        """
+        Returns the version recorded for every indexed artifact of a relic,
+        its manifest last_modified and size or a hash of its content, keyed by
+        (data_type, name).
+        """
+        if not fts5_supported:
+            return {}
+
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT data_type, name, content_hash FROM content_hashes
+            WHERE relic_id = ?
+            """,
+            (relic.id,),
+        )
+
+        return {(row[0], row[1]): row[2] for row in cur.fetchall()}
+
+    def index_content(
+        self,
+        relic: RelicData,
+        data_type: str,
+        name: str,
+        content: str,
+        content_hash: str,
+    ) -> None:
+        """
+        Adds or replaces the full-text index entry of a single artifact.
+        """
+        if not fts5_supported:
+            return
+
+        try:
+            with self._transaction() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM content_index
+                    WHERE relic_id = ?
+                    AND data_type = ?
+                    AND name = ?
+                    """,
+                    (relic.id, data_type, name),
+                )
+                cur.execute(
+                    "INSERT INTO content_index VALUES (?, ?, ?, ?)",
+                    (relic.id, data_type, name, content),
+                )
+                cur.execute(
+                    """
+                    INSERT INTO content_hashes VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (relic_id, data_type, name) DO UPDATE SET
+                    content_hash=excluded.content_hash
+                    """,
+                    (None, relic.id, data_type, name, content_hash),
+                )
+
+        except Error as e:
+            logging.warning(f"Error indexing content: {name} | {e.__class__}: {e}")
+
+    def remove_content(self, relic: RelicData, data_type: str, name: str) -> None:
+        if not fts5_supported:
+            return
+
+        with self._transaction() as cur:
+            self._delete_content(cur, relic.id, data_type, name)
+
+    def _delete_content(self, cur, relic_id: int, data_type: str, name: str) -> None:
+        cur.execute(
+            """
+            DELETE FROM content_index
+            WHERE relic_id = ?
+            AND data_type = ?
+            AND name = ?
+            """,
+            (relic_id, data_type, name),
+        )
+        cur.execute(
+            """
+            DELETE FROM content_hashes
+            WHERE relic_id = ?
+            AND data_type = ?
+            AND name = ?
+            """,
+            (relic_id, data_type, name),
+        )
+
+    def _delete_relic_rows(self, cur, relic_ids: List[int]) -> None:
+        """
+        Removes the tags, metadata and indexed content belonging to relics.
+        """
+        params = [(i,) for i in relic_ids]
+
+        cur.executemany("DELETE FROM relic_tags WHERE relic_id = ?", params)
+        cur.executemany("DELETE FROM metadata WHERE relic_id = ?", params)
+
+        if fts5_supported:
+            cur.executemany("DELETE FROM content_index WHERE relic_id = ?", params)
+            cur.executemany("DELETE FROM content_hashes WHERE relic_id = ?", params)
+
+    def search(self, text: str, limit: int = 10) -> List[Dict]:
+        """
+        Full-text search over indexed artifact content. Every whitespace
+        separated term in text must appear in an artifact for it to match.
+        Results are ordered by relevance.
+        """
+        if not fts5_supported:
+            logging.warning("Full-text search requires sqlite with FTS5 support")
+            return []
+
+        terms = " ".join('"' + t.replace('"', '""') + '"' for t in text.split())
+        if not terms:
+            return []
+
+        try:
+            cur = self.conn.cursor()
+            cur.execute(
+                """
+                SELECT rl.relic_name, rl.relic_type, rl.storage_name,
+                    ci.data_type, ci.name,
+                    snippet(content_index, 3, '[', ']', '...', 16)
+                FROM content_index ci
+                JOIN relics rl ON rl.id = ci.relic_id
+                WHERE content_index MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (terms, limit),
+            )
+
+            return [
+                {
+                    "storage": row[2],
+                    "type": row[1],
+                    "name": row[0],
+                    "data_type": row[3],
+                    "artifact": row[4],
+                    "snippet": row[5],
+                }
+                for row in cur.fetchall()
+            ]
+
+        except Error as e:
+            logging.warning(f"Error searching content: {e}")
+            return []
+
     def sync_metadata(self, ext: Metadata) -> None:
         int = self.get_metadata_by_name(ext.name, ext.data_type, ext.relic)
 
-        if int is not None:
-            if dt.datetime.strptime(
-                ext.last_modified, dt_format
-            ) > dt.datetime.strptime(int.last_modified, dt_format):
-                self.update_metadata(ext)
-        else:
+        if int is None or ext.last_modified > int.last_modified:
             self.add_metadata(ext)
 
     def sync_tags(self, ext: RelicTag) -> None:
-        if len(self.get_by_relic_tag(ext)) == 0:
-            self.add_relic_tag(ext)
+        if "tags" in ext.tags:
+            ext.tags = ext.tags["tags"]
+
+        current = {
+            (key, value)
+            for tag in self.get_all_tags_from_relic(ext.relic)
+            for key, value in tag["tags"].items()
+        }
+
+        if current != {(key, str(value)) for key, value in ext.tags.items()}:
+            with self._transaction() as cur:
+                cur.execute(
+                    "DELETE FROM relic_tags WHERE relic_id = ?", (ext.relic.id,)
+                )
+                self._insert_tags(cur, ext)
 
     def add_relic_tag(self, relic_tag: RelicTag) -> List[RelicTag]:
 
-        cur = self.conn.cursor()
+        with self._transaction() as cur:
+            self._insert_tags(cur, relic_tag)
+
+        return self.get_by_relic_tag(relic_tag)
+
+    def _insert_tags(self, cur, relic_tag: RelicTag) -> None:
         if "tags" in relic_tag.tags:
             relic_tag.tags = relic_tag.tags["tags"]
         for key, value in relic_tag.tags.items():
             cur.execute(
                 """
-                INSERT INTO relic_tags VALUES (?,?,?,?)
+                INSERT INTO relic_tags VALUES (?,?,?,?,?,?)
+                ON CONFLICT (key, value, relic_id) DO NOTHING
                 """,
                 (
                     None,
                     relic_tag.relic.id,
                     key,
                     value,
-                ),
+                )
+                + typed_tag_value(value),
             )
 
-        self.conn.commit()
-
-        return self.get_by_relic_tag(relic_tag)
-
     def remove_relic_tag(self, relic_tag: RelicTag) -> None:
         try:
-            cur = self.conn.cursor()
-
-            for key, value in relic_tag.tags:
-                cur.execute(
-                    """
-                    DELETE FROM relic_tags
-                    WHERE relic_id = ?
-                    AND key=?
-                    AND value=?
-                    """,
-                    (
-                        relic_tag.relic.id,
-                        key,
-                        value,
-                    ),
-                )
-
-            self.conn.commit()
+            with self._transaction() as cur:
+                for key, value in relic_tag.tags:
+                    cur.execute(
+                        """
+                        DELETE FROM relic_tags
+                        WHERE relic_id = ?
+                        AND key=?
+                        AND value=?
+                        """,
+                        (
+                            relic_tag.relic.id,
+                            key,
+                            value,
+                        ),
+                    )
 
         except Error as e:
             logging.warning(f"Error deleting relic tag: {e}")
@@ -464,7 +1153,7 @@ class MetadataDB:
                 SELECT * FROM relic_tags
                 WHERE relic_id = ?
                 """,
-                (str(relic.id)),
+                (relic.id,),
             )
 
             queries = cur.fetchall()
@@ -495,42 +1184,215 @@ class MetadataDB:
                 )
                 tags.extend(cur.fetchall())
 
-                self.conn.commit()
-
         except Error as e:
             logging.warning(f"Error getting relic tag: {e}")
 
         return [RelicTag.parse_sql_result(i, tag.relic) for i in tags]
 
     def sync_relic_data(self, relic_data: RelicData) -> RelicData:
-        relic = self.get_relic_data_by_name(
+        self._create_relic_data(
+            relic_data.relic_name, relic_data.relic_type, relic_data.storage_name
+        )
+        return self.get_relic_data_by_name(
             relic_data.relic_name, relic_data.relic_type, relic_data.storage_name
         )
 
-        if relic:
-            return relic
-        else:
-            self._create_relic_data(
-                relic_data.relic_name, relic_data.relic_type, relic_data.storage_name
+    def bulk_sync_relics(self, relic_datas: List[RelicData]) -> List[RelicData]:
+        """
+        Inserts any relics not yet in the database in a single transaction.
+        Existing rows are read with one scan of the storages being synced
+        rather than a lookup per relic, so only new relics are written.
+
+        returns: the database rows of the given relics, in the same order
+        """
+        storage_names = list({relic.storage_name for relic in relic_datas})
+        select = "SELECT * FROM relics WHERE storage_name IN ({})".format(
+            ",".join("?" * len(storage_names))
+        )
+
+        def read_rows(cur) -> Dict[Tuple[str, str, str], RelicData]:
+            cur.execute(select, storage_names)
+            return {
+                (row[1], row[2], row[3]): RelicData(
+                    row[1],
+                    row[2],
+                    row[3],
+                    id=row[0],
+                    last_modified=row[4],
+                    marker=row[5],
+                )
+                for row in cur.fetchall()
+            }
+
+        with self._transaction() as cur:
+            rows = read_rows(cur)
+            created = to_epoch_us(dt.datetime.utcnow())
+            missing = [
+                (
+                    None,
+                    relic.relic_name,
+                    relic.relic_type,
+                    relic.storage_name,
+                    created,
+                    None,
+                )
+                for relic in relic_datas
+                if (relic.relic_name, relic.relic_type, relic.storage_name) not in rows
+            ]
+
+            if missing:
+                cur.executemany(
+                    """
+                    INSERT INTO relics VALUES(?,?,?,?,?,?)
+                    ON CONFLICT (relic_name, relic_type, storage_name) DO NOTHING
+                    """,
+                    missing,
+                )
+                rows = read_rows(cur)
+
+        return [
+            rows[(relic.relic_name, relic.relic_type, relic.storage_name)]
+            for relic in relic_datas
+        ]
+
+    def bulk_sync_tags(self, relic_tags: List[RelicTag]) -> None:
+        """
+        Replaces the tags of each given relic in a single transaction.
+        """
+        for relic_tag in relic_tags:
+            if "tags" in relic_tag.tags:
+                relic_tag.tags = relic_tag.tags["tags"]
+
+        with self._transaction() as cur:
+            cur.executemany(
+                "DELETE FROM relic_tags WHERE relic_id = ?",
+                [(relic_tag.relic.id,) for relic_tag in relic_tags],
             )
-            return self.get_relic_data_by_name(
-                relic_data.relic_name, relic_data.relic_type, relic_data.storage_name
+            cur.executemany(
+                """
+                INSERT INTO relic_tags VALUES (?,?,?,?,?,?)
+                ON CONFLICT (key, value, relic_id) DO NOTHING
+                """,
+                [
+                    (None, relic_tag.relic.id, key, value) + typed_tag_value(value)
+                    for relic_tag in relic_tags
+                    for key, value in relic_tag.tags.items()
+                ],
             )
 
-    def remove_old_relic_data(self, list_ids: List[int]) -> int:
+    def bulk_sync_metadata(
+        self, relic_datas: List[RelicData], metadata: List[Metadata]
+    ) -> None:
+        """
+        Replaces the artifact metadata of each given relic in a single
+        transaction.
+        """
+        with self._transaction() as cur:
+            cur.executemany(
+                "DELETE FROM metadata WHERE relic_id = ?",
+                [(relic.id,) for relic in relic_datas],
+            )
+            cur.executemany(
+                """
+                INSERT INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (relic_id, data_type, name) DO UPDATE SET
+                size=excluded.size,
+                shape=excluded.shape,
+                last_modified=excluded.last_modified
+                """,
+                [
+                    (
+                        None,
+                        m.name,
+                        m.data_type,
+                        m.relic.id,
+                        m.size,
+                        m.shape,
+                        m.last_modified,
+                    )
+                    for m in metadata
+                ],
+            )
+
+    def set_index_options(self, content: bool, metadata: bool) -> bool:
+        """
+        Records whether syncs index artifact content and metadata. When that
+        differs from the previous sync, every relic marker is cleared so the
+        next sync reads every relic again, and the index of an option turned
+        off is emptied.
+
+        returns: bool - whether the options changed
+        """
+        options = {"content": int(content), "metadata": int(metadata)}
+        with self._transaction() as cur:
+            previous = dict(cur.execute("SELECT name, enabled FROM index_options"))
+            if previous == options:
+                return False
+
+            cur.execute("UPDATE relics SET marker = NULL")
+            if not metadata:
+                cur.execute("DELETE FROM metadata")
+            if not content and fts5_supported:
+                cur.execute("DELETE FROM content_index")
+                cur.execute("DELETE FROM content_hashes")
+
+            cur.execute("DELETE FROM index_options")
+            cur.executemany(
+                "INSERT INTO index_options (name, enabled) VALUES (?, ?)",
+                options.items(),
+            )
+
+        return True
+
+    def bulk_update_relic_markers(self, relic_datas: List[RelicData]) -> None:
+        """
+        Records the marker of each given relic in a single transaction.
+        """
+        with self._transaction() as cur:
+            cur.executemany(
+                "UPDATE relics SET marker = ? WHERE id = ?",
+                [(relic.marker, relic.id) for relic in relic_datas],
+            )
+
+    def remove_old_relic_data(
+        self, list_ids: List[int], storage_names: List[str] = None
+    ) -> int:
         """
         Checks list of ids against database inorder to find any stale
         relics rows and remove them.
 
         param:
             list_ids: integer - list of ids as integers
+            storage_names: string - only relics of these storages are checked,
+                defaults to every storage in the database
         """
-        cur = self.conn.cursor()
-        stale_ids = [
-            i
-            for i in cur.execute("SELECT id FROM relics;").fetchall()
-            if i[0] not in list_ids
-        ]
+        statement = """
+            SELECT id FROM relics
+            WHERE id NOT IN (SELECT id FROM synced_relic_ids)
+            """
+        params = []
+        if storage_names is not None:
+            statement += "AND storage_name IN ({})".format(
+                ",".join("?" * len(storage_names))
+            )
+            params = list(storage_names)
+
+        with self._transaction() as cur:
+            cur.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS synced_relic_ids (
+                    id integer NOT NULL PRIMARY KEY
+                )
+                """
+            )
+            cur.execute("DELETE FROM synced_relic_ids")
+            cur.executemany(
+                "INSERT OR IGNORE INTO synced_relic_ids VALUES (?)",
+                [(i,) for i in list_ids],
+            )
+            stale_ids = cur.execute(statement, params).fetchall()
+            cur.execute("DELETE FROM synced_relic_ids")
+
         if stale_ids:
             return self.delete_relics_by_ids(stale_ids)
 
@@ -545,17 +1407,20 @@ class MetadataDB:
 
         returns: int - number of rows removed
         """
-        cur = self.conn.cursor()
-        cur.executemany(
-            """
-            DELETE FROM relics
-            WHERE id = (?);
-            """,
-            list_ids,
-        )
-        self.conn.commit()
+        with self._transaction() as cur:
+            # Rows referencing the relics go first, the usage triggers look up
+            # the storage and type of their relic
+            self._delete_relic_rows(cur, [i[0] for i in list_ids])
+            cur.executemany(
+                """
+                DELETE FROM relics
+                WHERE id = (?);
+                """,
+                list_ids,
+            )
+            removed = cur.rowcount
 
-        return cur.rowcount
+        return removed
 
     def get_relic_data_by_name(
         self, relic_name: str, relic_type: str, storage_name: str
@@ -589,21 +1454,21 @@ class MetadataDB:
         self, relic_name: str, relic_type: str, storage_name: str
     ) -> None:
         try:
-            cur = self.conn.cursor()
-            cur.execute(
-                """
-            INSERT INTO relics VALUES(?,?,?,?,?)
-            """,
-                (
-                    None,
-                    relic_name,
-                    relic_type,
-                    storage_name,
-                    dt.datetime.utcnow().strftime(dt_format),
-                ),
-            )
-
-            self.conn.commit()
+            with self._transaction() as cur:
+                cur.execute(
+                    """
+                INSERT INTO relics VALUES(?,?,?,?,?,?)
+                ON CONFLICT (relic_name, relic_type, storage_name) DO NOTHING
+                """,
+                    (
+                        None,
+                        relic_name,
+                        relic_type,
+                        storage_name,
+                        to_epoch_us(dt.datetime.utcnow()),
+                        None,
+                    ),
+                )
 
         except Error as e:
             logging.warning(f"Error creating Relic data: {e}")
@@ -623,7 +1488,7 @@ class MetadataDB:
             return RelicData.parse_dict(RelicData.parse_sql_result(rows[0]))
 
     def get_relics_by_tag(self, key: str, value: str) -> List[Tuple]:
-        # TODO add ability to query using multiple tags
+        # See get_relics_by_tags to query using multiple tags
 
         cur = self.conn.cursor()
         cur.execute(
@@ -638,6 +1503,243 @@ class MetadataDB:
 
         return cur.fetchall()
 
+    def get_relics_by_tags(
+        self,
+        all: Dict = None,
+        any: Dict = None,
+        none: Dict = None,
+        storage_names: List[str] = None,
+        after_id: int = 0,
+        limit: int = None,
+    ) -> List[Tuple]:
+        """
+        Finds relics by a boolean combination of tags in a single query.
+
+        param:
+            all: relics must have every key/value pair
+            any: relics must have at least one of the key/value pairs
+            none: relics must have none of the key/value pairs
+            a value can also be a list of values, each paired with the key,
+                so in all a relic must have one of them for that key
+            storage_names: only relics of these storages are returned
+            after_id: only relics with a greater id are returned, used to page
+                through results by passing the id of the last relic of a page
+            limit: maximum number of relics returned
+
+        returns: (id, relic_name, relic_type, storage_name) ordered by id
+        """
+
+        def tag_pairs(tags: Dict) -> List[Tuple]:
+            return [
+                (key, value)
+                for key, values in tags.items()
+                for value in (
+                    values if isinstance(values, (list, tuple, set)) else [values]
+                )
+            ]
+
+        def tag_filter(tags: Dict) -> Tuple[str, List]:
+            pairs = tag_pairs(tags)
+            clause = " OR ".join(["(key = ? AND value = ?)"] * len(pairs)) or "0"
+            params = [item for pair in pairs for item in pair]
+            return clause, params
+
+        statement = """
+            SELECT rl.id, rl.relic_name, rl.relic_type, rl.storage_name
+            FROM relics rl
+            WHERE rl.id > ?
+            """
+        params = [after_id]
+
+        if all:
+            clause, tag_params = tag_filter(all)
+            statement += f"""
+            AND rl.id IN (
+                SELECT relic_id FROM relic_tags
+                WHERE {clause}
+                GROUP BY relic_id
+                HAVING COUNT(DISTINCT key) = ?
+            )
+            """
+            params.extend(tag_params + [len(all)])
+
+        if any:
+            clause, tag_params = tag_filter(any)
+            statement += f"""
+            AND rl.id IN (SELECT relic_id FROM relic_tags WHERE {clause})
+            """
+            params.extend(tag_params)
+
+        if none:
+            clause, tag_params = tag_filter(none)
+            statement += f"""
+            AND rl.id NOT IN (SELECT relic_id FROM relic_tags WHERE {clause})
+            """
+            params.extend(tag_params)
+
+        if storage_names is not None:
+            statement += "AND rl.storage_name IN ({})\n".format(
+                ",".join("?" * len(storage_names))
+            )
+            params.extend(storage_names)
+
+        statement += "ORDER BY rl.id\n"
+        if limit is not None:
+            statement += "LIMIT ?"
+            params.append(limit)
+
+        cur = self.conn.cursor()
+        cur.execute(statement, params)
+
+        return cur.fetchall()
+
+    def get_relics_by_tag_range(
+        self,
+        key: str,
+        lo=None,
+        hi=None,
+        storage_names: List[str] = None,
+        limit: int = None,
+        descending: bool = False,
+    ) -> List[Tuple]:
+        """
+        Finds relics whose tag value lies between lo and hi, both inclusive and
+        optional, ordered by that value. Numbers are compared with the numeric
+        tag values and datetimes with the datetime tag values. Without bounds
+        the numeric values are used unless the key only has datetime values.
+
+        param:
+            key: tag key
+            lo: lower bound, number, datetime, date or a string of either
+            hi: upper bound, number, datetime, date or a string of either
+            storage_names: only relics of these storages are returned
+            limit: maximum number of relics, i.e. the top-k with descending
+            descending: order from the highest value down
+
+        returns: (id, relic_name, relic_type, storage_name, value)
+        """
+        cur = self.conn.cursor()
+
+        lo, hi = range_bound(lo), range_bound(hi)
+        if isinstance(lo, dt.datetime) or isinstance(hi, dt.datetime):
+            column = "time_value"
+        elif lo is not None or hi is not None:
+            column = "num_value"
+        else:
+            cur.execute(
+                """
+                SELECT
+                    EXISTS (
+                        SELECT 1 FROM relic_tags
+                        WHERE key = ? AND num_value IS NOT NULL
+                    ),
+                    EXISTS (
+                        SELECT 1 FROM relic_tags
+                        WHERE key = ? AND time_value IS NOT NULL
+                    )
+                """,
+                (key, key),
+            )
+            has_numbers, has_times = cur.fetchone()
+            column = "time_value" if has_times and not has_numbers else "num_value"
+
+        def bound(value):
+            if isinstance(value, dt.datetime) != (column == "time_value"):
+                raise ValueError("Cannot mix number and datetime bounds")
+            return parse_timestamp(value) if column == "time_value" else value
+
+        statement = f"""
+            SELECT rl.id, rl.relic_name, rl.relic_type, rl.storage_name, rt.value
+            FROM relic_tags rt
+            JOIN relics rl ON rl.id = rt.relic_id
+            WHERE rt.key = ?
+            AND rt.{column} IS NOT NULL
+            """
+        params = [key]
+
+        if lo is not None:
+            statement += f"AND rt.{column} >= ?\n"
+            params.append(bound(lo))
+
+        if hi is not None:
+            statement += f"AND rt.{column} <= ?\n"
+            params.append(bound(hi))
+
+        if storage_names is not None:
+            statement += "AND rl.storage_name IN ({})\n".format(
+                ",".join("?" * len(storage_names))
+            )
+            params.extend(storage_names)
+
+        statement += f"ORDER BY rt.{column} {'DESC' if descending else 'ASC'}\n"
+        if limit is not None:
+            statement += "LIMIT ?"
+            params.append(limit)
+
+        cur.execute(statement, params)
+
+        return cur.fetchall()
+
+    def get_usage(
+        self, group_by: List[str], storage_names: List[str] = None
+    ) -> List[Dict]:
+        """
+        Sums the artifact count and stored bytes of the rollup tables.
+
+        param:
+            group_by: any of storage, relic_type and data_type, or relic for
+                one row per relic
+            storage_names: only count these storages, defaults to all
+        """
+        columns = {
+            "storage": "storage_name",
+            "relic_type": "relic_type",
+            "data_type": "data_type",
+        }
+
+        params = []
+        where = ""
+        if storage_names is not None:
+            where = "WHERE storage_name IN ({})".format(
+                ",".join("?" * len(storage_names))
+            )
+            params = list(storage_names)
+
+        if group_by == ["relic"]:
+            keys = ["storage", "relic_type", "relic_name"]
+            statement = f"""
+                SELECT storage_name, relic_type, relic_name, artifacts, bytes
+                FROM relic_usage JOIN relics ON relics.id = relic_usage.relic_id
+                {where}
+                ORDER BY bytes DESC
+                """
+        else:
+            unknown = set(group_by) - set(columns)
+            if unknown:
+                raise ValueError(f"Cannot group usage by {sorted(unknown)}")
+
+            keys = list(group_by)
+            selected = "".join(f"{columns[key]}, " for key in keys)
+            grouping = (
+                "GROUP BY " + ", ".join(columns[key] for key in keys) if keys else ""
+            )
+            statement = f"""
+                SELECT {selected}SUM(artifacts), SUM(bytes)
+                FROM type_usage
+                {where}
+                {grouping}
+                ORDER BY SUM(bytes) DESC
+                """
+
+        cur = self.conn.cursor()
+        cur.execute(statement, params)
+
+        return [
+            dict(zip(keys + ["artifacts", "bytes"], row))
+            for row in cur.fetchall()
+            if row[-1] is not None
+        ]
+
     def get_relic_types_by_storage(self, storage: str) -> List[str]:
         cur = self.conn.cursor()
         cur.execute(
@@ -715,16 +1817,19 @@ class MetadataDB:
         ]
 
     def delete_relic(self, relic_name: str, relic_type: str, storage_name: str) -> int:
-        cur = self.conn.cursor()
-        cur.execute(
-            """
-            DELETE FROM relics
-            WHERE relic_name = ?
-            AND relic_type = ?
-            AND storage_name = ?;
-            """,
-            (relic_name, relic_type, storage_name),
-        ),
-        self.conn.commit()
+        relic = self.get_relic_data_by_name(relic_name, relic_type, storage_name)
+
+        with self._transaction() as cur:
+            if relic:
+                self._delete_relic_rows(cur, [relic.id])
+            cur.execute(
+                """
+                DELETE FROM relics
+                WHERE relic_name = ?
+                AND relic_type = ?
+                AND storage_name = ?;
+                """,
+                (relic_name, relic_type, storage_name),
+            ),
 
         return cur.rowcount
@@ -1,8 +1,11 @@
 import logging
 from reliquery.metadata import Metadata, MetadataDB, RelicData, RelicTag
-from typing import List, Dict
-from sys import getsizeof
+from typing import Iterator, List, Dict, Optional, Tuple
 from io import BytesIO
+from html.parser import HTMLParser
+from contextlib import contextmanager
+import hashlib
+import os
 
 import numpy as np
 import json
@@ -11,11 +14,14 @@ import pandas as pd
 import nbconvert
 import nbformat
 
+from . import settings
 from .storage import (
+    DATA_TYPES,
     get_all_available_storages,
     StorageItemDoesNotExist,
     get_storage_by_name,
     Storage,
+    WriteBehindStorage,
 )
 
 from PIL import Image
@@ -23,6 +29,9 @@ from PIL import Image
 
 StoragePath = List[str]
 
+# Artifact folders whose content is added to the full-text search index
+SEARCHABLE_DATA_TYPES = ["text", "html", "json", "notebooks-html"]
+
 
 class InvalidRelicId(Exception):
     pass
@@ -40,10 +49,22 @@ class Relic:
         storage: Storage = None,
         storage_name: str = "default",
         check_exists: bool = True,
+        lazy: bool = True,
+        write_behind: bool = False,
     ):
+        """
+        No request is made until the first write, which creates the relic if
+        it does not exist yet. lazy=False creates it right away instead, and
+        check_exists=False never creates it.
+
+        With write_behind=True writes are queued and uploaded in the
+        background until flush() is called, see batch().
+        """
         self.name = name
         self.relic_type = relic_type
         self.storage_name = storage_name
+        self.lazy = lazy
+        self._exists = not check_exists
 
         if storage is None:
             self.storage = get_storage_by_name(self.storage_name)
@@ -52,7 +73,10 @@ class Relic:
             self.storage = storage
             self.storage_name = storage.name
 
-        if check_exists:
+        if write_behind:
+            self.storage = WriteBehindStorage(self.storage)
+
+        if not self._exists and not lazy:
             self._ensure_exists()
 
     @classmethod
@@ -61,11 +85,45 @@ class Relic:
             raise InvalidRelicId()
 
     def _ensure_exists(self):
-        try:
-            self.storage.get_text([self.relic_type, self.name, "exists"])
-        except StorageItemDoesNotExist:
+        if not self.storage.exists([self.relic_type, self.name, "exists"]):
             logging.info("Creating a Relic")
             self.storage.put_text([self.relic_type, self.name, "exists"], "exists")
+            self.storage.touch_catalog(self.relic_type, self.name)
+
+        self._exists = True
+
+    def _before_write(self):
+        if not self._exists:
+            self._ensure_exists()
+
+    @contextmanager
+    def batch(self) -> Iterator["Relic"]:
+        """
+        Queues the writes made in the block and uploads them from a background
+        thread pool. Repeated writes of an artifact and the manifest updates
+        are coalesced. Everything is flushed when the block exits, raising a
+        WriteBehindError if any write failed.
+        """
+        if isinstance(self.storage, WriteBehindStorage):
+            yield self
+            self.flush()
+            return
+
+        storage = self.storage
+        self.storage = WriteBehindStorage(storage)
+        try:
+            yield self
+        finally:
+            buffered, self.storage = self.storage, storage
+            buffered.close()
+
+    def flush(self) -> None:
+        """
+        Waits for the writes queued by a write_behind relic, raising a
+        WriteBehindError if any of them failed.
+        """
+        if isinstance(self.storage, WriteBehindStorage):
+            self.storage.flush()
 
     # TODO: needs test coverage
     @classmethod
@@ -78,49 +136,71 @@ class Relic:
     ) -> bool:
         if storage is None:
             storage = get_storage_by_name(storage_name)
-        try:
-            storage.get_text([relic_type, name, "exists"])
-        except StorageItemDoesNotExist:
-            return False
 
-        return True
+        return storage.exists([relic_type, name, "exists"])
 
     def _relic_data(self):
         return RelicData(self.name, self.relic_type, self.storage_name)
 
-    def add_array(self, name: str, array: np.ndarray):
-
-        self.assert_valid_id(name)
+    def _array_item(self, name: str, array: np.ndarray) -> Tuple[BytesIO, Metadata]:
+        buffer = BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        buffer.seek(0)
 
-        size = getsizeof(array)
-        shape = str(np.array(array).shape)
         metadata = Metadata(
             name=name,
             data_type="arrays",
             relic=self._relic_data(),
-            size=size,
-            shape=shape,
+            size=buffer.getbuffer().nbytes,
+            shape=str(np.array(array).shape),
         )
 
-        buffer = BytesIO()
-        np.save(buffer, array, allow_pickle=False)
-        buffer.seek(0)
+        return buffer, metadata
+
+    def add_array(self, name: str, array: np.ndarray):
+
+        self.assert_valid_id(name)
+
+        buffer, metadata = self._array_item(name, array)
 
         self.storage.put_binary_obj(
             [self.relic_type, self.name, "arrays", name], buffer
         )
         self._add_metadata(metadata)
 
-    def get_array(self, name: str) -> np.ndarray:
+    def add_arrays(
+        self, arrays: Dict[str, np.ndarray]
+    ) -> Dict[str, Optional[Exception]]:
+        return self._add_many(
+            "arrays", {name: self._array_item(name, a) for name, a in arrays.items()}
+        )
+
+    def get_array(self, name: str, mmap_mode: Optional[str] = None) -> np.ndarray:
+        """
+        mmap_mode is passed to np.load to memory-map the array when the storage
+        holds a local copy of it, i.e. File storage or a cached storage.
+        """
         self.assert_valid_id(name)
 
+        if mmap_mode is not None:
+            local_path = self.storage.get_local_path(
+                [self.relic_type, self.name, "arrays", name]
+            )
+            if local_path is not None:
+                return np.load(local_path, mmap_mode=mmap_mode, allow_pickle=False)
+
         with self.storage.get_binary_obj(
             [self.relic_type, self.name, "arrays", name]
         ) as f:
             return np.load(f, allow_pickle=False)
 
+    def get_arrays(self, names: List[str]) -> Dict:
+        return self._get_many(
+            "arrays", names, lambda f: np.load(f, allow_pickle=False), binary=True
+        )
+
     def list_arrays(self) -> List[np.ndarray]:
-        return self.storage.list_keys([self.relic_type, self.name, "arrays"])
+        return self._list_artifacts("arrays")
 
     def remove_array(self, name: str) -> None:
         self.assert_valid_id(name)
@@ -132,7 +212,12 @@ class Relic:
 
         self.assert_valid_id(name)
 
-        metadata = Metadata(name=name, data_type="html", relic=self._relic_data())
+        metadata = Metadata(
+            name=name,
+            data_type="html",
+            relic=self._relic_data(),
+            size=os.path.getsize(html_path),
+        )
 
         self.storage.put_file([self.relic_type, self.name, "html", name], html_path)
         self._add_metadata(metadata)
@@ -141,14 +226,19 @@ class Relic:
     def add_html_string(self, name: str, html_str: str):
         self.assert_valid_id(name)
 
-        metadata = Metadata(name=name, data_type="html", relic=self._relic_data())
+        metadata = Metadata(
+            name=name,
+            data_type="html",
+            relic=self._relic_data(),
+            size=len(html_str.encode("utf-8")),
+        )
 
         self.storage.put_text([self.relic_type, self.name, "html", name], html_str)
 
         self._add_metadata(metadata)
 
     def list_html(self) -> List[str]:
-        return self.storage.list_keys([self.relic_type, self.name, "html"])
+        return self._list_artifacts("html")
 
     def get_html(self, name: str) -> str:
         self.assert_valid_id(name)
@@ -164,30 +254,42 @@ class Relic:
         self.storage.remove_obj([self.relic_type, self.name, "html", name])
         self._remove_metadata("html", name)
 
-    def add_text(self, name: str, text: str) -> None:
-
-        self.assert_valid_id(name)
-
-        size = getsizeof(text)
+    def _text_item(self, name: str, text: str) -> Tuple[str, Metadata]:
         metadata = Metadata(
             name=name,
             data_type="text",
             relic=self._relic_data(),
-            size=size,
+            size=len(text.encode("utf-8")),
             shape=len(text),
         )
 
+        return text, metadata
+
+    def add_text(self, name: str, text: str) -> None:
+
+        self.assert_valid_id(name)
+
+        text, metadata = self._text_item(name, text)
+
         self.storage.put_text([self.relic_type, self.name, "text", name], text)
         self._add_metadata(metadata)
 
+    def add_texts(self, texts: Dict[str, str]) -> Dict[str, Optional[Exception]]:
+        return self._add_many(
+            "text", {name: self._text_item(name, t) for name, t in texts.items()}
+        )
+
     def list_text(self) -> List[str]:
-        return self.storage.list_keys([self.relic_type, self.name, "text"])
+        return self._list_artifacts("text")
 
     def get_text(self, name: str) -> str:
         self.assert_valid_id(name)
 
         return self.storage.get_text([self.relic_type, self.name, "text", name])
 
+    def get_texts(self, names: List[str]) -> Dict:
+        return self._get_many("text", names, lambda text: text)
+
     def remove_text(self, name: str) -> None:
         self.assert_valid_id(name)
 
@@ -196,11 +298,14 @@ class Relic:
 
     def _add_metadata(self, metadata: Metadata) -> None:
         self.assert_valid_id(metadata.name)
+        self._before_write()
 
+        entry = metadata.get_dict()
         self.storage.put_metadata(
             [self.relic_type, self.name, "metadata", metadata.data_type, metadata.name],
-            metadata.get_dict(),
+            entry,
         )
+        self._update_manifest([(metadata.data_type, metadata.name, entry)])
 
     def _remove_metadata(self, data_type, name) -> None:
         self.assert_valid_id(self.name)
@@ -208,19 +313,159 @@ class Relic:
         self.storage.remove_metadata(
             [self.relic_type, self.name, "metadata", f"{data_type}", f"{name}"]
         )
+        self._update_manifest([(data_type, name, None)])
 
-    def describe(self) -> Dict:
-        return self.storage.get_metadata(
-            [self.relic_type, self.name, "metadata"], self.name
+    def _get_many(
+        self, data_type: str, names: List[str], parse, binary: bool = False
+    ) -> Dict:
+        """
+        Reads the named artifacts concurrently and parses each one. Returns a
+        dict keyed by name holding the parsed value, or the exception raised
+        reading or parsing that artifact.
+        """
+        for name in names:
+            self.assert_valid_id(name)
+
+        results = self.storage.get_many(
+            [[self.relic_type, self.name, data_type, name] for name in names], binary
+        )
+
+        artifacts = {}
+        for name, result in zip(names, results):
+            if not isinstance(result, Exception):
+                try:
+                    result = parse(result)
+                except Exception as e:
+                    result = e
+            artifacts[name] = result
+
+        return artifacts
+
+    def _add_many(
+        self, data_type: str, items: Dict[str, Tuple[object, Metadata]]
+    ) -> Dict[str, Optional[Exception]]:
+        """
+        Writes the artifacts and their metadata concurrently, then records all
+        of them in the manifest with one update. Returns a dict keyed by name
+        holding None, or the exception raised writing that artifact.
+        """
+        for name in items:
+            self.assert_valid_id(name)
+        self._before_write()
+
+        names = list(items)
+        errors = dict(
+            zip(
+                names,
+                self.storage.put_many(
+                    [
+                        ([self.relic_type, self.name, data_type, name], items[name][0])
+                        for name in names
+                    ]
+                ),
+            )
+        )
+
+        entries = {name: items[name][1].get_dict() for name in names}
+
+        stored = [name for name in names if errors[name] is None]
+        errors.update(
+            zip(
+                stored,
+                self.storage.put_metadata_many(
+                    [
+                        (
+                            [self.relic_type, self.name, "metadata", data_type, name],
+                            entries[name],
+                        )
+                        for name in stored
+                    ]
+                ),
+            )
         )
 
+        self._update_manifest(
+            [(data_type, name, entries[name]) for name in names if errors[name] is None]
+        )
+
+        return errors
+
+    def _manifest_path(self) -> StoragePath:
+        return [self.relic_type, self.name, "manifest"]
+
+    def _read_manifest(self) -> Optional[Dict]:
+        """
+        The manifest holds the metadata of every artifact of the relic in one
+        object, keyed by data type then name. Relics written before manifests
+        existed have none until their next artifact change.
+        """
+        try:
+            return json.loads(self.storage.get_text(self._manifest_path()))
+        except StorageItemDoesNotExist:
+            return None
+
+    def _update_manifest(self, changes: List[Tuple[str, str, Optional[Dict]]]) -> None:
+        """
+        Applies (data_type, name, entry) changes to the manifest in a single
+        conditional write, removing the artifacts whose entry is None.
+        """
+        if not changes:
+            return
+
+        def update(manifest: Optional[Dict]) -> Dict:
+            if manifest is None:
+                described = self.storage.get_metadata(
+                    [self.relic_type, self.name, "metadata"], self.name
+                )[self.name]
+                manifest = {
+                    "metadata": {
+                        t: {m["name"]: m for m in entries}
+                        for t, entries in described.items()
+                    }
+                }
+
+            for data_type, name, entry in changes:
+                entries = manifest["metadata"].setdefault(data_type, {})
+                if entry is None:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = entry
+
+            return manifest
+
+        self.storage.update_manifest(self._manifest_path(), update)
+        self.storage.touch_catalog(self.relic_type, self.name)
+
+    def _list_artifacts(self, data_type: str) -> List[str]:
+        manifest = self._read_manifest()
+        if manifest is None:
+            return self.storage.list_keys([self.relic_type, self.name, data_type])
+
+        return list(manifest["metadata"].get(data_type, {}))
+
+    def describe(self) -> Dict:
+        manifest = self._read_manifest()
+        if manifest is None:
+            return self.storage.get_metadata(
+                [self.relic_type, self.name, "metadata"], self.name
+            )
+
+        return {
+            self.name: {
+                data_type: list(manifest["metadata"].get(data_type, {}).values())
+                for data_type in DATA_TYPES
+            }
+        }
+
     def add_tag(self, tags: Dict) -> None:
+        self._before_write()
         tags_path = [self.relic_type, self.name, "tags"]
 
         curr_tags = self.storage.get_tags(tags_path)
         curr_tags.update(tags)
 
         self.storage.put_tags(tags_path, curr_tags)
+        self.storage.touch_catalog(self.relic_type, self.name)
 
     def list_tags(self) -> Dict:
         return self.storage.get_tags([self.relic_type, self.name, "tags"])
@@ -280,7 +525,7 @@ class Relic:
             new_file.write(content)
 
     def list_images(self) -> List[str]:
-        return self.storage.list_keys([self.relic_type, self.name, "images"])
+        return self._list_artifacts("images")
 
     def remove_image(self, name: str) -> None:
         self.assert_valid_id(name)
@@ -288,23 +533,32 @@ class Relic:
         self.storage.remove_obj([self.relic_type, self.name, "images", name])
         self._remove_metadata("images", name)
 
-    def add_json(self, name: str, json_data: Dict) -> None:
-        self.assert_valid_id(name)
-
+    def _json_item(self, name: str, json_data: Dict) -> Tuple[str, Metadata]:
         json_text = json.dumps(json_data)
-        size = getsizeof(json_data)
         metadata = Metadata(
             name=name,
             data_type="json",
             relic=self._relic_data(),
-            size=size,
+            size=len(json_text.encode("utf-8")),
         )
 
+        return json_text, metadata
+
+    def add_json(self, name: str, json_data: Dict) -> None:
+        self.assert_valid_id(name)
+
+        json_text, metadata = self._json_item(name, json_data)
+
         self.storage.put_text([self.relic_type, self.name, "json", name], json_text)
         self._add_metadata(metadata)
 
+    def add_jsons(self, jsons: Dict[str, Dict]) -> Dict[str, Optional[Exception]]:
+        return self._add_many(
+            "json", {name: self._json_item(name, j) for name, j in jsons.items()}
+        )
+
     def list_json(self) -> List[str]:
-        return self.storage.list_keys([self.relic_type, self.name, "json"])
+        return self._list_artifacts("json")
 
     def get_json(self, name: str) -> Dict:
         self.assert_valid_id(name)
@@ -313,6 +567,9 @@ class Relic:
         my_json = json.loads(json_text)
         return my_json
 
+    def get_jsons(self, names: List[str]) -> Dict:
+        return self._get_many("json", names, json.loads)
+
     def remove_json(self, name: str) -> None:
         self.assert_valid_id(name)
 
@@ -328,13 +585,12 @@ class Relic:
         self.assert_valid_id(name)
 
         json_pandasdf = pandas_data.to_json()
-        pandasdf_size = getsizeof(pandas_data)
 
         metadata = Metadata(
             name=name,
             data_type="pandasdf",
             relic=self._relic_data(),
-            size=pandasdf_size,
+            size=len(json_pandasdf.encode("utf-8")),
         )
 
         self.storage.put_text(
@@ -343,7 +599,7 @@ class Relic:
         self._add_metadata(metadata)
 
     def list_pandasdf(self) -> List[str]:
-        return self.storage.list_keys([self.relic_type, self.name, "pandasdf"])
+        return self._list_artifacts("pandasdf")
 
     def get_pandasdf(self, name: str) -> pd.DataFrame:
         self.assert_valid_id(name)
@@ -354,6 +610,9 @@ class Relic:
         pandas_dataframe = pd.read_json(pandas_json)
         return pandas_dataframe
 
+    def get_pandasdfs(self, names: List[str]) -> Dict:
+        return self._get_many("pandasdf", names, pd.read_json)
+
     def remove_pandasdf(self, name: str) -> None:
         self.assert_valid_id(name)
 
@@ -388,7 +647,7 @@ class Relic:
     # TODO Add file like object
 
     def list_files(self) -> List[str]:
-        return self.storage.list_keys([self.relic_type, self.name, "files"])
+        return self._list_artifacts("files")
 
     def get_file(self, name: str) -> BytesIO:
         self.assert_valid_id(name)
@@ -417,7 +676,6 @@ class Relic:
             self.storage.put_binary_obj(
                 [self.relic_type, self.name, "notebooks", name], buffer
             )
-            self._add_metadata(metadata)
 
             exporter = nbconvert.HTMLExporter()
             exporter.template_name = "classic"
@@ -427,9 +685,10 @@ class Relic:
             self.storage.put_text(
                 [self.relic_type, self.name, "notebooks-html", name], body
             )
+            self._add_metadata(metadata)
 
     def list_notebooks(self) -> List[str]:
-        return self.storage.list_keys([self.relic_type, self.name, "notebooks"])
+        return self._list_artifacts("notebooks")
 
     def get_notebook(self, name: str) -> BytesIO:
         self.assert_valid_id(name)
@@ -460,6 +719,33 @@ class Relic:
         self._remove_metadata("notebooks", name)
 
 
+class _HTMLTextExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag in ("script", "style"):
+            self._skip += 1
+
+    def handle_endtag(self, tag) -> None:
+        if tag in ("script", "style") and self._skip > 0:
+            self._skip -= 1
+
+    def handle_data(self, data) -> None:
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    parser = _HTMLTextExtractor()
+    parser.feed(html)
+    parser.close()
+
+    return " ".join(" ".join(parser.parts).split())
+
+
 class Reliquery:
     """
     Class used to query over available and accessible storage locations and Relics
@@ -472,21 +758,156 @@ class Reliquery:
     metadata_db : MetadataDB
         in memory sqlite db used for querying Relics
 
+    index_content : bool
+        when True text, html, json and rendered notebook artifacts are added
+        to a full-text search index while syncing
+
+    persist : bool
+        when True the metadata db is kept in ~/reliquery/metadata.db so a new
+        Reliquery starts from the cached state and only reconciles changes
+
+    db_path : str
+        explicit location of a persistent metadata db, implies persist
+
+    index_metadata : bool
+        when True the metadata of every artifact (type, size, shape and
+        last_modified) is synced into the metadata table, which takes a
+        describe of every changed relic
+
     """
 
-    def __init__(self, storages: List[Storage] = []) -> None:
+    def __init__(
+        self,
+        storages: List[Storage] = [],
+        index_content: bool = False,
+        persist: bool = False,
+        db_path: str = None,
+        index_metadata: bool = False,
+    ) -> None:
         if len(storages) > 0:
             self.storages = storages
         else:
             self.storages = get_all_available_storages()
 
+        if db_path is None:
+            db_path = (
+                settings.get_metadata_db_path(
+                    os.path.join(os.path.expanduser("~"), "reliquery")
+                )
+                if persist
+                else ":memory:"
+            )
+
+        self.index_content = index_content
+        self.index_metadata = index_metadata
         self.storage_map = {s.name: s for s in self.storages}
-        self.metadata_db = MetadataDB()
+        self.metadata_db = MetadataDB(db_path)
+        self.metadata_db.set_index_options(index_content, index_metadata)
         self._sync_relics()
 
     def query(self, statement: str) -> List:
         return self.metadata_db.query(statement)
 
+    def iter_query(
+        self, statement: str, params: Tuple = (), batch_size: int = 1000
+    ) -> Iterator[Tuple]:
+        """
+        Lazily run a SQL statement against the metadata database. Unlike query,
+        rows are fetched in batches as they are iterated and errors are raised.
+
+        Parameters
+        ----------
+
+        statement : string
+            SQL statement, values should use ? placeholders
+        params : tuple
+            values bound to the placeholders of the statement
+        batch_size : int
+            number of rows fetched from the database at a time
+
+        Returns
+        -------
+        Iterator of tuples
+            rows of the result
+        """
+        return self.metadata_db.iter_query(statement, params, batch_size)
+
+    def query_page(
+        self,
+        statement: str,
+        params: Tuple = (),
+        key: str = "id",
+        after=None,
+        limit: int = 100,
+    ) -> Tuple[List[Tuple], object]:
+        """
+        Fetch one page of a SQL statement using keyset pagination. Pages are
+        ordered by the key column, which must be selected by the statement.
+
+        Parameters
+        ----------
+
+        statement : string
+            SQL statement, values should use ? placeholders
+        params : tuple
+            values bound to the placeholders of the statement
+        key : string
+            unique column the pages are ordered by
+        after : object
+            key value returned with the previous page, None for the first page
+        limit : int
+            maximum number of rows in the page
+
+        Returns
+        -------
+        Tuple of a list of rows and the key for the next page
+            the next key is None when there are no more pages
+        """
+        return self.metadata_db.query_page(statement, params, key, after, limit)
+
+    def usage(self, group_by="storage") -> List[Dict]:
+        """
+        Artifact count and stored bytes of the synced relics, read from rollups
+        kept in the metadata database. Requires index_metadata=True.
+
+        Parameters
+        ----------
+
+        group_by : string or list of strings
+            any of "storage", "relic_type" and "data_type", or "relic" for the
+            usage of every relic
+
+        Returns
+        -------
+        List of dicts
+            the group_by keys along with artifacts and bytes, largest first
+        """
+        if isinstance(group_by, str):
+            group_by = [group_by]
+
+        return self.metadata_db.get_usage(list(group_by), list(self.storage_map))
+
+    def search(self, text: str, limit: int = 10) -> List[Dict]:
+        """
+        Full-text search over the content of text, html, json and notebook
+        artifacts. Requires the Reliquery to be created with index_content=True.
+
+        Parameters
+        ----------
+
+        text : string
+            terms that must all appear in a matching artifact
+        limit : int
+            maximum number of results
+
+        Returns
+        -------
+        List of dicts
+            storage, type and name of the relic along with the data_type,
+            artifact name and a snippet of the matching content
+        """
+        return self.metadata_db.search(text, limit)
+
     def get_relics_by_tag(self, key: str, value: str) -> List[Relic]:
         """
         Query relics for user defined tags added to Relics.
@@ -503,8 +924,118 @@ class Reliquery:
             Reclics associated with the key, values given
         """
         return [
-            Relic(name=data[0], relic_type=data[1], storage=self.storage_map[data[2]])
+            Relic(
+                name=data[0],
+                relic_type=data[1],
+                storage=self.storage_map[data[2]],
+                check_exists=False,
+            )
             for data in self.metadata_db.get_relics_by_tag(key, value)
+            if data[2] in self.storage_map
+        ]
+
+    def get_relics_by_tags(
+        self,
+        all: Dict = None,
+        any: Dict = None,
+        none: Dict = None,
+        page_size: int = 1000,
+    ) -> Iterator[List[Relic]]:
+        """
+        Query relics by a boolean combination of tags. Each page of results is
+        fetched with a single indexed query when it is iterated to.
+
+        Parameters
+        ----------
+
+        all : dict
+            relics must have every one of these tags, a list value means
+            any one of its values for that tag
+        any : dict
+            relics must have at least one of these tags
+        none : dict
+            relics must have none of these tags
+            tag values can be lists, e.g. any={"model": ["resnet", "vit"]}
+        page_size : int
+            maximum number of Relics in each page
+
+        Returns
+        -------
+        Iterator of lists of Relic objects
+            Relics matching the tags, page by page
+        """
+        after_id = 0
+        while True:
+            rows = self.metadata_db.get_relics_by_tags(
+                all=all,
+                any=any,
+                none=none,
+                storage_names=list(self.storage_map),
+                after_id=after_id,
+                limit=page_size,
+            )
+            if not rows:
+                return
+
+            yield [
+                Relic(
+                    name=row[1],
+                    relic_type=row[2],
+                    storage=self.storage_map[row[3]],
+                    check_exists=False,
+                )
+                for row in rows
+            ]
+
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1][0]
+
+    def get_relics_by_tag_range(
+        self,
+        key: str,
+        lo=None,
+        hi=None,
+        limit: int = None,
+        descending: bool = False,
+    ) -> List[Relic]:
+        """
+        Query relics whose numeric or datetime tag value lies between lo and hi.
+        Results are ordered by the tag value, so limit with descending=True
+        gives the top-k relics for a key.
+
+        Parameters
+        ----------
+
+        key : string
+        lo : number, datetime, date or string, optional
+            inclusive lower bound
+        hi : number, datetime, date or string, optional
+            inclusive upper bound
+        limit : int, optional
+            maximum number of Relics
+        descending : bool
+            order from the highest tag value down
+
+        Returns
+        -------
+        List of Relic objects
+        """
+        return [
+            Relic(
+                name=row[1],
+                relic_type=row[2],
+                storage=self.storage_map[row[3]],
+                check_exists=False,
+            )
+            for row in self.metadata_db.get_relics_by_tag_range(
+                key,
+                lo=lo,
+                hi=hi,
+                storage_names=list(self.storage_map),
+                limit=limit,
+                descending=descending,
+            )
         ]
 
     def _sync_relics(self) -> None:
@@ -516,23 +1047,164 @@ class Reliquery:
         list_ids = []
 
         for stor in self.storages:
-            relic_datas = [
-                self.metadata_db.sync_relic_data(RelicData.parse_dict(data))
-                for data in stor.get_all_relic_data()
-            ]
+            listing = stor.get_all_relic_data()
+            relic_datas = self.metadata_db.bulk_sync_relics(
+                [RelicData.parse_dict(data) for data in listing]
+            )
             list_ids.extend([i.id for i in relic_datas])
 
-            if relic_datas:
-                for relic_data in relic_datas:
-                    self.metadata_db.sync_tags(
-                        RelicTag.parse_dict(
-                            stor.get_tags(
-                                [relic_data.relic_type, relic_data.relic_name, "tags"]
-                            ),
-                            relic_data,
+            # Relics whose storage marker has not moved since the last sync
+            # are unchanged, only storages without markers are re-read
+            changed = []
+            for relic_data, data in zip(relic_datas, listing):
+                marker = data.get("marker")
+                if marker is None or marker != relic_data.marker:
+                    relic_data.marker = marker
+                    changed.append(relic_data)
+
+            states = stor._map_concurrent(
+                lambda relic_data: self._read_relic_state(stor, relic_data), changed
+            )
+
+            # Relics that could not be read keep their old marker and are
+            # retried on the next sync
+            synced = [r for r, state in zip(changed, states) if state is not None]
+            states = [state for state in states if state is not None]
+
+            self.metadata_db.bulk_sync_tags([state[0] for state in states])
+            if self.index_metadata:
+                self.metadata_db.bulk_sync_metadata(
+                    synced, [m for state in states for m in state[1]]
+                )
+
+            # Relics whose content could not be indexed are retried as well
+            if self.index_content:
+                synced = [
+                    relic_data
+                    for relic_data in synced
+                    if self._index_relic_content(stor, relic_data)
+                ]
+
+            self.metadata_db.bulk_update_relic_markers(synced)
+
+        self.metadata_db.remove_old_relic_data(list_ids, list(self.storage_map))
+
+    def _read_relic_state(
+        self, stor: Storage, relic_data: RelicData
+    ) -> Optional[Tuple[RelicTag, List[Metadata]]]:
+        """
+        Reads the tags and, when indexing metadata, the artifact metadata of a
+        relic. Runs on the thread pool of the storage.
+        """
+        try:
+            tags = RelicTag.parse_dict(
+                stor.get_tags([relic_data.relic_type, relic_data.relic_name, "tags"]),
+                relic_data,
+            )
+
+            metadata = []
+            if self.index_metadata:
+                described = Relic(
+                    relic_data.relic_name,
+                    relic_data.relic_type,
+                    storage=stor,
+                    check_exists=False,
+                ).describe()
+                metadata = [
+                    Metadata.parse_dict(entry, relic_data)
+                    for entries in described[relic_data.relic_name].values()
+                    for entry in entries
+                ]
+
+        except Exception as e:
+            logging.warning(
+                "Error syncing relic "
+                + f"{relic_data.relic_type}/{relic_data.relic_name} | "
+                + f"{e.__class__}: {e}"
+            )
+            return None
+
+        return tags, metadata
+
+    def _index_relic_content(self, stor: Storage, relic_data: RelicData) -> bool:
+        """
+        Adds the searchable artifacts of a relic to the full-text index and
+        drops the artifacts no longer in storage. Artifacts are versioned by
+        the last_modified and size recorded in the relic manifest, so only the
+        ones changed since the last sync are read. Relics without a manifest
+        are listed and versioned by a hash of their content. Returns False when
+        the relic could not be read.
+        """
+        indexed = self.metadata_db.get_content_hashes(relic_data)
+
+        try:
+            manifest = Relic(
+                relic_data.relic_name,
+                relic_data.relic_type,
+                storage=stor,
+                check_exists=False,
+            )._read_manifest()
+
+            for data_type in SEARCHABLE_DATA_TYPES:
+                if manifest is None:
+                    versions = {
+                        name: None
+                        for name in stor.list_keys(
+                            [relic_data.relic_type, relic_data.relic_name, data_type]
                         )
+                    }
+                else:
+                    versions = {
+                        name: f"{entry.get('last_modified')}:{entry.get('size')}"
+                        for name, entry in manifest["metadata"]
+                        .get(data_type, {})
+                        .items()
+                    }
+
+                for name, version in versions.items():
+                    if (
+                        version is not None
+                        and indexed.get((data_type, name)) == version
+                    ):
+                        del indexed[(data_type, name)]
+                        continue
+
+                    try:
+                        content = stor.get_text(
+                            [
+                                relic_data.relic_type,
+                                relic_data.relic_name,
+                                data_type,
+                                name,
+                            ]
+                        )
+                    except StorageItemDoesNotExist:
+                        continue
+
+                    if version is None:
+                        version = hashlib.sha256(content.encode("utf-8")).hexdigest()
+                    if indexed.pop((data_type, name), None) == version:
+                        continue
+
+                    if data_type in ("html", "notebooks-html"):
+                        content = html_to_text(content)
+
+                    self.metadata_db.index_content(
+                        relic_data, data_type, name, content, version
                     )
-        self.metadata_db.remove_old_relic_data(list_ids)
+
+        except Exception as e:
+            logging.warning(
+                "Error indexing relic "
+                + f"{relic_data.relic_type}/{relic_data.relic_name} | "
+                + f"{e.__class__}: {e}"
+            )
+            return False
+
+        for data_type, name in indexed:
+            self.metadata_db.remove_content(relic_data, data_type, name)
+
+        return True
 
     def get_relic_types_by_storage(self, storage: str) -> List[str]:
         return self.metadata_db.get_relic_types_by_storage(storage)
@@ -556,6 +1228,7 @@ class Reliquery:
 
     def remove_relic(self, relic: Relic) -> int:
         relic.storage.remove_relic([relic.relic_type, relic.name])
+        relic.storage.touch_catalog(relic.relic_type, relic.name, removed=True)
         return self.metadata_db.delete_relic(
             relic.name, relic.relic_type, relic.storage_name
         )
@@ -35,3 +35,7 @@ def get_config(reliquery_dir):
             }
         },
     }
+
+
+def get_metadata_db_path(reliquery_dir):
+    return os.path.join(reliquery_dir, "metadata.db")
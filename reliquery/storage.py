@@ -1,12 +1,23 @@
 # from ast import Mod
+import copy
 import logging
 import os
 import io
 from io import BytesIO, BufferedIOBase
 import shutil
-from typing import Any, List, Dict
-from shutil import copyfile
+import socket
+from typing import Any, Callable, List, Dict, Iterable, Iterator, Optional, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
+import hashlib
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
 
 from . import settings
 
@@ -18,6 +29,7 @@ try:
     import boto3
     from botocore import UNSIGNED
     from botocore.client import Config
+    from botocore.exceptions import ClientError
 except ModuleNotFoundError:
     s3_supported = False
 
@@ -32,6 +44,7 @@ try:
     from googleapiclient.discovery import build
     from google.cloud import storage
     from google.cloud.exceptions import NotFound
+    from google.api_core.exceptions import PreconditionFailed
     from apiclient.http import MediaFileUpload
     from apiclient.http import MediaIoBaseUpload
 except ModuleNotFoundError:
@@ -64,7 +77,31 @@ class MissingDepsException(Exception):
     pass
 
 
+# Set on the threads of a storage's pool while they run a task
+_pool_worker = threading.local()
+_pool_lock = threading.Lock()
+
+
+def _run_in_pool(fn: Callable, item: Any) -> Any:
+    _pool_worker.active = True
+    try:
+        return fn(item)
+    finally:
+        _pool_worker.active = False
+
+
 class Storage:
+    # Size of the thread pool shared by the concurrent requests of a storage
+    max_workers = 16
+
+    # Storages whose client cannot be used from several threads at once set
+    # this to False and have their requests run one at a time
+    thread_safe = True
+
+    # Index of every relic in the storage. Top level names starting with an
+    # underscore are reserved for objects like this one and are not relics.
+    catalog_path = ["_catalog"]
+
     def put_file(self, path: StoragePath, file_path: str) -> None:
         raise NotImplementedError
 
@@ -83,6 +120,92 @@ class Storage:
     def list_keys(self, path: StoragePath) -> List[str]:
         raise NotImplementedError
 
+    def get_text_with_version(self, path: StoragePath) -> Tuple[str, Any]:
+        """
+        Returns the text at path along with an opaque version of the object
+        to pass to put_text_if_match.
+        """
+        raise NotImplementedError
+
+    def put_text_if_match(self, path: StoragePath, text: str, version: Any) -> bool:
+        """
+        Writes text only if the object at path is still at version, or does not
+        exist yet when version is None. Returns False if another writer got
+        there first.
+        """
+        raise NotImplementedError
+
+    def get_version(self, path: StoragePath) -> Any:
+        """
+        Returns an opaque version of the object at path that changes whenever
+        the object is rewritten, without reading its content.
+        """
+        raise NotImplementedError
+
+    def get_local_path(self, path: StoragePath) -> Optional[str]:
+        """
+        Returns a path on the local filesystem holding the object, or None if
+        the storage keeps no local copy.
+        """
+        return None
+
+    def exists(self, path: StoragePath) -> bool:
+        """
+        Tells whether there is an object at path, with a metadata request
+        where the storage supports one.
+        """
+        try:
+            self.get_version(path)
+        except StorageItemDoesNotExist:
+            return False
+        except NotImplementedError:
+            try:
+                self.get_text(path)
+            except StorageItemDoesNotExist:
+                return False
+
+        return True
+
+    def update_manifest(
+        self,
+        path: StoragePath,
+        update: Callable[[Optional[Dict]], Dict],
+        retries: int = 10,
+    ) -> Optional[Dict]:
+        """
+        Applies update to the json object at path with optimistic concurrency.
+        The object is only rewritten if no other writer changed it since it
+        was read, otherwise it is read again and update is reapplied. update
+        is passed None when the object does not exist yet.
+
+        If every attempt conflicts the object is removed, so readers fall back
+        to listing the relic and the next update rebuilds it. The catalog is
+        kept, rebuilding it takes a crawl of the whole storage.
+        """
+        for attempt in range(retries):
+            try:
+                text, version = self.get_text_with_version(path)
+                manifest = json.loads(text)
+            except StorageItemDoesNotExist:
+                manifest, version = None, None
+
+            manifest = update(manifest)
+            if self.put_text_if_match(path, json.dumps(manifest), version):
+                return manifest
+
+            time.sleep(random.uniform(0, 0.01 * 2**attempt))
+
+        logging.warning(f"Gave up updating {'/'.join(path)} after {retries} conflicts")
+        if path == self.catalog_path:
+            return None
+
+        try:
+            self.remove_obj(path)
+        except StorageItemDoesNotExist:
+            pass
+
+        return None
+
     def put_metadata(self, path: StoragePath, metadata: Dict):
         raise NotImplementedError
 
@@ -102,120 +225,848 @@ class Storage:
         raise NotImplementedError
 
     def get_all_relic_data(self) -> List[Dict]:
+        """
+        Returns relic_name, relic_type, storage_name and a marker that moves
+        whenever the relic changes for every relic. Read from the catalog when
+        the storage has a complete one. Otherwise the storage is crawled and
+        the relics found are merged into the catalog, so the next call is a
+        single read.
+        """
+        catalog = self._read_catalog()
+        if catalog is None or catalog.get("partial"):
+            crawled = self._crawl_relic_data()
+            catalog = self._complete_catalog(crawled)
+            if catalog is None:
+                return crawled
+
+        return [
+            {
+                "relic_name": name,
+                "relic_type": relic_type,
+                "storage_name": self.name,
+                "marker": str(last_modified),
+            }
+            for relic_type, names in catalog["relics"].items()
+            for name, last_modified in names.items()
+        ]
+
+    def _crawl_relic_data(self) -> List[Dict]:
+        """
+        Finds every relic by listing the whole storage. Storages that can
+        cheaply tell when a relic changed also return a marker that moves
+        whenever any object of the relic is added, removed or rewritten.
+        """
         raise NotImplementedError
 
+    def _read_catalog(self) -> Optional[Dict]:
+        try:
+            return json.loads(self.get_text(self.catalog_path))
+        except StorageItemDoesNotExist:
+            return None
+
+    def _catalog_from_crawl(self) -> Dict:
+        now = int(time.time() * 1e6)
+        catalog = {"relics": {}}
+        for relic in self._crawl_relic_data():
+            catalog["relics"].setdefault(relic["relic_type"], {})[
+                relic["relic_name"]
+            ] = now
+
+        return catalog
+
+    def _complete_catalog(self, crawled: List[Dict]) -> Optional[Dict]:
+        """
+        Merges the relics of a crawl into the catalog, keeping the ones
+        touch_catalog recorded meanwhile. Returns None if the catalog could
+        not be written, e.g. with read only credentials.
+        """
+        now = int(time.time() * 1e6)
+
+        def update(catalog: Optional[Dict]) -> Dict:
+            catalog = catalog or {"relics": {}}
+            for relic in crawled:
+                catalog["relics"].setdefault(relic["relic_type"], {}).setdefault(
+                    relic["relic_name"], now
+                )
+            catalog.pop("partial", None)
+            return catalog
+
+        try:
+            return self.update_manifest(self.catalog_path, update)
+        except Exception as e:
+            logging.warning(f"Could not write the catalog of {self.name}: {e!r}")
+            return None
+
+    def touch_catalog(
+        self, relic_type: str, relic_name: str, removed: bool = False
+    ) -> None:
+        """
+        Records in the catalog that a relic was created, changed or removed,
+        moving its marker. A storage without a catalog gets a partial one,
+        completed from a crawl by the next get_all_relic_data.
+        """
+
+        def update(catalog: Optional[Dict]) -> Dict:
+            if catalog is None:
+                catalog = {"relics": {}, "partial": True}
+
+            names = catalog["relics"].setdefault(relic_type, {})
+            if removed:
+                names.pop(relic_name, None)
+                if not names:
+                    del catalog["relics"][relic_type]
+            else:
+                names[relic_name] = max(
+                    int(time.time() * 1e6), names.get(relic_name, 0) + 1
+                )
+
+            return catalog
+
+        if self.update_manifest(self.catalog_path, update) is None:
+            logging.warning(
+                f"{relic_type}/{relic_name} may be stale in the catalog of "
+                f"{self.name}, repair it with rebuild_catalog()"
+            )
+
+    def rebuild_catalog(self) -> Dict:
+        """
+        Rebuilds the catalog from a crawl of the storage, for repairing it
+        after relics were written or removed without going through Relic.
+        """
+        catalog = self._catalog_from_crawl()
+        self.put_text(self.catalog_path, json.dumps(catalog))
+
+        return catalog
+
     def remove_obj(self, path: StoragePath) -> None:
         raise NotImplementedError
 
     def remove_relic(self, path: StoragePath) -> None:
         raise NotImplementedError
 
+    def read_bytes(self, path: StoragePath) -> BytesIO:
+        """
+        Reads an object in full and returns it as a BytesIO.
+        """
+        obj = self.get_binary_obj(path)
+        try:
+            return BytesIO(obj.read())
+        finally:
+            obj.close()
+
+    def get_many(self, paths: List[StoragePath], binary: bool = False) -> List:
+        """
+        Reads many objects on the storage's thread pool. Returns, in order, the
+        text of each object, or a BytesIO when binary, or the exception raised
+        reading it.
+        """
+
+        def read(path: StoragePath) -> Any:
+            try:
+                return self.read_bytes(path) if binary else self.get_text(path)
+            except Exception as e:
+                return e
+
+        return self._map_concurrent(read, paths)
+
+    def put_many(self, items: List[Tuple[StoragePath, Any]]) -> List:
+        """
+        Writes many (path, content) pairs on the storage's thread pool. str
+        content is written as text, bytes or a BytesIO as a binary object.
+        Returns, in order, None or the exception raised writing each item.
+        """
+
+        def write(item: Tuple[StoragePath, Any]) -> Optional[Exception]:
+            path, content = item
+            try:
+                if isinstance(content, str):
+                    self.put_text(path, content)
+                else:
+                    if isinstance(content, bytes):
+                        content = BytesIO(content)
+                    self.put_binary_obj(path, content)
+            except Exception as e:
+                return e
+
+        return self._map_concurrent(write, items)
+
+    def put_metadata_many(self, items: List[Tuple[StoragePath, Dict]]) -> List:
+        """
+        Writes many (path, metadata) pairs on the storage's thread pool.
+        Returns, in order, None or the exception raised writing each item.
+        """
+
+        def write(item: Tuple[StoragePath, Dict]) -> Optional[Exception]:
+            try:
+                self.put_metadata(*item)
+            except Exception as e:
+                return e
+
+        return self._map_concurrent(write, items)
+
+    def remove_many(self, paths: List[StoragePath]) -> List:
+        """
+        Removes many objects on the storage's thread pool. Returns, in order,
+        None or the exception raised removing each object.
+        """
+
+        def remove(path: StoragePath) -> Optional[Exception]:
+            try:
+                self.remove_obj(path)
+            except Exception as e:
+                return e
+
+        return self._map_concurrent(remove, paths)
+
+    def _map_concurrent(self, fn: Callable, items: Iterable) -> List:
+        """
+        Calls fn on every item on the storage's shared thread pool and returns
+        the results in order. Calls made from one of the pool's own threads run
+        inline so nested fan-outs cannot exhaust the pool.
+        """
+        items = list(items)
+        if (
+            len(items) < 2
+            or not self.thread_safe
+            or getattr(_pool_worker, "active", False)
+        ):
+            return [fn(item) for item in items]
+
+        return list(self._executor().map(lambda item: _run_in_pool(fn, item), items))
+
+    def _map_concurrent_unordered(self, fn: Callable, items: Iterable) -> Iterator:
+        """
+        Like _map_concurrent, but yields the results as the calls complete, in
+        no particular order.
+        """
+        items = list(items)
+        if (
+            len(items) < 2
+            or not self.thread_safe
+            or getattr(_pool_worker, "active", False)
+        ):
+            for item in items:
+                yield fn(item)
+            return
+
+        futures = [self._executor().submit(_run_in_pool, fn, item) for item in items]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        """
+        The bounded thread pool shared by the concurrent requests of this
+        storage, created on first use.
+        """
+        with _pool_lock:
+            pool = self.__dict__.get("_pool")
+            if pool is None:
+                pool = self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        return pool
+
+    def _gather_metadata(
+        self,
+        path: StoragePath,
+        root_key: str,
+        read: Callable[[StoragePath], Optional[Dict]],
+    ) -> Dict:
+        """
+        Lists every data type folder under path, then reads each metadata
+        entry with read, all on the shared thread pool. Entries read as None
+        are skipped.
+        """
+        listings = self._map_concurrent(
+            lambda data_type: self.list_keys(path + [data_type]), DATA_TYPES
+        )
+        entries = [
+            (data_type, key)
+            for data_type, keys in zip(DATA_TYPES, listings)
+            for key in keys
+        ]
+        docs = self._map_concurrent(lambda entry: read(path + list(entry)), entries)
+
+        data = {root_key: {k: [] for k in DATA_TYPES}}
+        for (data_type, _), doc in zip(entries, docs):
+            if doc is not None:
+                data[root_key][data_type].append(doc)
+
+        return data
+
+    def _relic_data_from_listing(
+        self, listing: Iterable[Tuple[str, Any]]
+    ) -> List[Dict]:
+        """
+        Groups the (key, version) pairs of a storage listing by relic and hashes
+        the versions of each relic's objects into its marker. Keys are relative
+        to the storage prefix, i.e. relic_type/relic_name/...
+        """
+        versions = {}
+        for key, version in listing:
+            parts = key.split("/")
+            if len(parts) < 3 or parts[0].startswith("_"):
+                continue
+
+            versions.setdefault((parts[0], parts[1]), []).append(f"{key}:{version}")
+
+        return [
+            {
+                "relic_name": name,
+                "relic_type": relic_type,
+                "storage_name": self.name,
+                "marker": hashlib.sha1(
+                    "\n".join(sorted(keys)).encode("utf-8")
+                ).hexdigest(),
+            }
+            for (relic_type, name), keys in versions.items()
+        ]
+
+
+# Temporary files of atomic writes, named <target>.<pid>.<thread id>.tmp
+_TEMP_NAME = re.compile(r"\.\d+\.\d+\.tmp$")
+
+
+class _DirectorySyncer:
+    """
+    Group commit of directory fsyncs. The first writer to ask becomes the
+    leader, waits delay seconds for others to queue their directories, then
+    fsyncs each distinct directory once for the whole batch.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._cond = threading.Condition()
+        self._pending = set()
+        self._batches = 0
+        self._synced = 0
+        self._leading = False
+        self._errors = {}
+
+    def sync(self, dirname: str) -> None:
+        with self._cond:
+            self._pending.add(dirname)
+            # The batch the directory is in, taken by the next leader
+            batch = self._batches + 1
+            while self._synced < batch and self._leading:
+                self._cond.wait()
+
+            if self._synced >= batch:
+                error = self._errors.get(batch)
+                if error is not None:
+                    raise error
+                return
+
+            self._leading = True
+
+        time.sleep(self.delay)
+        with self._cond:
+            dirnames, self._pending = self._pending, set()
+            self._batches += 1
+            batch = self._batches
+
+        error = None
+        for d in dirnames:
+            try:
+                fd = os.open(d, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                error = e
+
+        with self._cond:
+            if error is not None:
+                self._errors[batch] = error
+            self._synced = batch
+            self._leading = False
+            self._cond.notify_all()
+
+        if error is not None:
+            raise error
+
+
+# Folders of a relic whose files are spread over hash prefix subfolders in
+# layout 2, along with their metadata folders
+_SHARDED_FOLDERS = DATA_TYPES + ["notebooks-html"]
+
 
 class FileStorage(Storage):
-    def __init__(self, root: str, name: str):
+    """
+    Stores objects as files under root.
+
+    layout 1 keeps the artifacts of a relic in one folder per data type.
+    layout 2 spreads them over 256 subfolders named by a hash prefix of the
+    artifact name, so relics with very many artifacts do not end up with huge
+    directories. The layout of a root is recorded in its _layout object, and
+    the layout argument only applies to new roots. Existing roots are moved to
+    layout 2 with migrate_layout. A layout 1 storage reads the _layout object
+    again at most every layout_check_interval seconds, so storages opened
+    before a migration started switch to layout 2 too.
+
+    write_mode trades safety for speed:
+
+    - fast writes files in place, a crash can leave them torn
+    - atomic writes a temporary file and renames it over the target, so
+      readers see the old or the new content only
+    - durable is atomic and also fsyncs the file and its directory. The
+      directory fsyncs of concurrent writers are batched together after
+      waiting sync_delay seconds.
+    """
+
+    write_modes = ("fast", "atomic", "durable")
+    layouts = (1, 2)
+    layout_path = ["_layout"]
+    layout_check_interval = 1.0
+
+    def __init__(
+        self,
+        root: str,
+        name: str,
+        write_mode: str = "atomic",
+        sync_delay: float = 0.002,
+        layout: int = 1,
+    ):
+        if write_mode not in self.write_modes:
+            raise ValueError(f"write_mode must be one of {self.write_modes}")
+        if layout not in self.layouts:
+            raise ValueError(f"layout must be one of {self.layouts}")
+
         self.root = os.path.expanduser(root)
         self.name = name
+        self.write_mode = write_mode
+        self._syncer = _DirectorySyncer(sync_delay)
+
+        self.layout = 1
+        self._layout_checked = time.monotonic()
+        recorded = self._read_layout()
+        if recorded is not None:
+            self.layout = recorded
+        elif layout == 2:
+            if self._has_relics():
+                raise ValueError(
+                    f"{self.root} already holds relics in layout 1, "
+                    "move them with migrate_layout()"
+                )
+            self._write_layout(2)
+
+    def _read_layout(self) -> Optional[int]:
+        try:
+            with open(self._join_path(self.layout_path), "r") as f:
+                return json.loads(f.read())["version"]
+        except FileNotFoundError:
+            return None
+
+    def _check_layout(self) -> None:
+        # Another storage on the root may have started a migration since
+        if (
+            self.layout == 1
+            and time.monotonic() - self._layout_checked >= self.layout_check_interval
+        ):
+            self._layout_checked = time.monotonic()
+            recorded = self._read_layout()
+            if recorded is not None:
+                self.layout = recorded
+
+    def _write_layout(self, version: int) -> None:
+        self._write(
+            self.layout_path,
+            lambda f: f.write(json.dumps({"version": version})),
+            binary=False,
+            write_mode="durable" if self.write_mode == "durable" else "atomic",
+        )
+        self.layout = version
+
+    def _has_relics(self) -> bool:
+        try:
+            with os.scandir(self.root) as entries:
+                return any(e.is_dir() and not e.name.startswith("_") for e in entries)
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _is_sharded(path: StoragePath) -> bool:
+        return (len(path) == 4 and path[2] in _SHARDED_FOLDERS) or (
+            len(path) == 5 and path[2] == "metadata" and path[3] in _SHARDED_FOLDERS
+        )
+
+    def _write(
+        self,
+        path: StoragePath,
+        write: Callable,
+        binary: bool,
+        write_mode: Optional[str] = None,
+    ) -> None:
+        """
+        Writes the file at path by calling write with the open file, as
+        write_mode, by default the storage's, dictates.
+        """
+        write_mode = write_mode or self.write_mode
+        self._ensure_path(path)
+        joined_path = self._join_path(path)
+        mode = "wb" if binary else "w"
+
+        if write_mode == "fast":
+            with open(joined_path, mode) as f:
+                write(f)
+            return
+
+        tmp_path = f"{joined_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, mode) as f:
+                write(f)
+                if write_mode == "durable":
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, joined_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        if write_mode == "durable" and os.name != "nt":
+            self._syncer.sync(os.path.dirname(joined_path))
 
     def _ensure_path(self, path: StoragePath):
-        if not os.path.exists(self._join_path(path[:-1])):
-            os.makedirs(self._join_path(path[:-1]), exist_ok=True)
+        dirname = os.path.dirname(self._join_path(path))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
 
     def _join_path(self, path: StoragePath) -> str:
+        if self._is_sharded(path):
+            self._check_layout()
+            if self.layout == 2:
+                return self._sharded_path(path)
+
+        return self._flat_path(path)
+
+    def _flat_path(self, path: StoragePath) -> str:
         return os.path.join(*[self.root] + path)
 
+    def _sharded_path(self, path: StoragePath) -> str:
+        shard = hashlib.sha1(path[-1].encode("utf-8")).hexdigest()[:2]
+        return self._flat_path(path[:-1] + [shard, path[-1]])
+
+    def _read_path(self, path: StoragePath) -> str:
+        """
+        The file to read the object at path from. Objects missing from the
+        folder of the storage's layout are read from the other one, which
+        holds them while a migration is running or after one started that
+        this storage has not noticed yet.
+        """
+        joined_path = self._join_path(path)
+        if not self._is_sharded(path) or os.path.exists(joined_path):
+            return joined_path
+
+        other_path = (
+            self._flat_path(path) if self.layout == 2 else self._sharded_path(path)
+        )
+        # Moved between the two checks when neither exists
+        return other_path if os.path.exists(other_path) else joined_path
+
+    def _remove(self, path: StoragePath) -> None:
+        removed = False
+        paths = [self._flat_path(path)]
+        if self._is_sharded(path):
+            paths.append(self._sharded_path(path))
+
+        for p in paths:
+            try:
+                os.remove(p)
+                removed = True
+            except FileNotFoundError:
+                pass
+
+        if not removed:
+            raise StorageItemDoesNotExist
+
+    def migrate_layout(self, version: int = 2) -> int:
+        """
+        Moves the artifacts and metadata of every relic to layout 2 while the
+        storage stays in use. The layout is recorded first, so writes go to
+        the hash prefix folders and reads fall back to the flat folders until
+        every file is moved. Moving starts twice layout_check_interval seconds
+        later, once every storage open on the root writes in layout 2 too.
+
+        Returns the number of files moved.
+        """
+        if version != 2:
+            raise ValueError("Only migrating to layout 2 is supported")
+
+        if self.layout != 2:
+            self._write_layout(2)
+            time.sleep(2 * self.layout_check_interval)
+
+        def migrate_type(relic_type: str) -> int:
+            moved = 0
+            for relic_name in self.list_keys([relic_type]):
+                for folder in _SHARDED_FOLDERS:
+                    for folder_path in (
+                        [relic_type, relic_name, folder],
+                        [relic_type, relic_name, "metadata", folder],
+                    ):
+                        try:
+                            entries = list(os.scandir(self._flat_path(folder_path)))
+                        except (FileNotFoundError, NotADirectoryError):
+                            continue
+
+                        for entry in entries:
+                            if entry.is_file() and not _TEMP_NAME.search(entry.name):
+                                moved += self._move_to_shard(folder_path + [entry.name])
+
+            return moved
+
+        relic_types = [
+            t
+            for t in self.list_keys([])
+            if not t.startswith("_") and os.path.isdir(self._flat_path([t]))
+        ]
+        return sum(self._map_concurrent(migrate_type, relic_types))
+
+    def _move_to_shard(self, path: StoragePath) -> bool:
+        flat_path, sharded_path = self._flat_path(path), self._sharded_path(path)
+        os.makedirs(os.path.dirname(sharded_path), exist_ok=True)
+        moved = True
+        try:
+            # Unlike a rename, never replaces a newer copy written to the shard
+            os.link(flat_path, sharded_path)
+        except FileExistsError:
+            moved = False
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # No hard links on this filesystem
+            if not os.path.exists(sharded_path):
+                os.replace(flat_path, sharded_path)
+                return True
+            moved = False
+
+        try:
+            os.remove(flat_path)
+        except FileNotFoundError:
+            return False
+
+        return moved
+
     def put_file(self, path: StoragePath, file_path: str) -> None:
-        self._ensure_path(path)
-        copyfile(file_path, self._join_path(path))
+        def write(f):
+            with open(file_path, "rb") as src:
+                shutil.copyfileobj(src, f)
+
+        self._write(path, write, binary=True)
 
     def put_binary_obj(self, path: StoragePath, buffer: BytesIO) -> None:
-        self._ensure_path(path)
-        with open(self._join_path(path), "wb") as f:
-            f.write(buffer.getbuffer())
+        self._write(path, lambda f: f.write(buffer.getbuffer()), binary=True)
 
     def get_binary_obj(self, path: StoragePath) -> BytesIO:
         try:
-            return open(self._join_path(path), "rb")
+            return open(self._read_path(path), "rb")
         except FileNotFoundError:
             raise StorageItemDoesNotExist
 
     def put_text(self, path: StoragePath, text: str) -> None:
-        self._ensure_path(path)
-
-        with open(self._join_path(path), "w") as f:
-            return f.write(text)
+        self._write(path, lambda f: f.write(text), binary=False)
 
     def get_text(self, path: StoragePath) -> str:
         try:
-            with open(self._join_path(path), "r") as f:
+            with open(self._read_path(path), "r") as f:
                 return f.read()
         except IOError:
             raise StorageItemDoesNotExist
 
+    def get_text_with_version(self, path: StoragePath) -> Tuple[str, Any]:
+        text = self.get_text(path)
+        return text, hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get_version(self, path: StoragePath) -> Any:
+        try:
+            stat = os.stat(self._read_path(path))
+        except FileNotFoundError:
+            raise StorageItemDoesNotExist
+
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def exists(self, path: StoragePath) -> bool:
+        return os.path.exists(self._read_path(path))
+
+    def get_local_path(self, path: StoragePath) -> Optional[str]:
+        local_path = self._read_path(path)
+        if not os.path.isfile(local_path):
+            raise StorageItemDoesNotExist
+
+        return local_path
+
+    def put_text_if_match(self, path: StoragePath, text: str, version: Any) -> bool:
+        self._ensure_path(path)
+
+        with self._lock(path):
+            try:
+                current = self.get_text_with_version(path)[1]
+            except StorageItemDoesNotExist:
+                current = None
+
+            if current != version:
+                return False
+
+            # Readers of manifests and catalogs must never see them torn
+            self._write(
+                path,
+                lambda f: f.write(text),
+                binary=False,
+                write_mode="durable" if self.write_mode == "durable" else "atomic",
+            )
+
+        return True
+
+    @contextmanager
+    def _lock(self, path: StoragePath, stale_after: float = 30.0):
+        """
+        Holds an exclusive lock file next to path, naming the host and pid of
+        its holder. A lock left behind by a writer that died is broken, right
+        away when the writer ran on this host, otherwise once it is older than
+        stale_after seconds.
+        """
+        lock_path = self._join_path(path) + ".lock"
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, f"{socket.gethostname()} {os.getpid()}".encode("utf-8"))
+                break
+            except FileExistsError:
+                try:
+                    if self._lock_is_stale(lock_path, stale_after):
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.005)
+
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    @staticmethod
+    def _lock_is_stale(lock_path: str, stale_after: float) -> bool:
+        with open(lock_path, "r") as f:
+            holder = f.read().split()
+        age = time.time() - os.stat(lock_path).st_mtime
+
+        # Only processes of this host can be checked, and signalling one on
+        # Windows would terminate it
+        if len(holder) == 2 and holder[0] == socket.gethostname() and os.name != "nt":
+            try:
+                os.kill(int(holder[1]), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+            return False
+
+        return age > stale_after
+
     def list_keys(self, path: StoragePath) -> List[str]:
-        joined_path = self._join_path(path)
+        joined_path = self._flat_path(path)
         if not os.path.exists(joined_path):
             return []
 
         if not os.path.isdir(joined_path):
             return []
 
-        return os.listdir(joined_path)
+        if not self._is_sharded(path + [""]):
+            return [k for k in os.listdir(joined_path) if not _TEMP_NAME.search(k)]
 
-    def put_metadata(self, path: StoragePath, metadata: Dict):
-        self._ensure_path(path)
+        # Files in the flat folder are the ones not migrated yet. Subfolders
+        # are hash prefixes, also in a layout 1 storage that has not noticed
+        # a migration yet.
+        keys = []
+        with os.scandir(joined_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    keys.extend(os.listdir(entry.path))
+                else:
+                    keys.append(entry.name)
 
-        with open(self._join_path(path), "w") as f:
-            return f.write(json.dumps(metadata))
+        return list(dict.fromkeys(k for k in keys if not _TEMP_NAME.search(k)))
 
-    def remove_metadata(self, path: StoragePath):
-        self._ensure_path(path)
+    def put_metadata(self, path: StoragePath, metadata: Dict):
+        self._write(path, lambda f: f.write(json.dumps(metadata)), binary=False)
 
-        try:
-            os.remove(self._join_path(path))
-        except FileNotFoundError:
-            raise StorageItemDoesNotExist
+    def remove_metadata(self, path: StoragePath):
+        self._remove(path)
 
     def get_metadata(self, path: StoragePath, root_key: str) -> Dict:
-        data = {root_key: {k: [] for k in DATA_TYPES}}
-
-        def dict_from_path(path: StoragePath, dirname: str):
-            dirpath = path.copy()
-            dirpath.append(dirname)
-            if os.path.exists(self._join_path(dirpath)):
-                entries = os.listdir(self._join_path(dirpath))
-                for i in entries:
-                    entry_path = dirpath.copy()
-                    entry_path.append(i)
-                    with open(self._join_path(entry_path), "r") as f:
-                        data[root_key][dirname].append(json.loads(f.read()))
-
-        for d in data[root_key]:
-            dict_from_path(path, d)
+        def read(key_path: StoragePath) -> Optional[Dict]:
+            try:
+                with open(self._read_path(key_path), "r") as f:
+                    return json.loads(f.read())
+            except FileNotFoundError:
+                return None
+
+        return self._gather_metadata(path, root_key, read)
+
+    def _scan_files(self, dirpath: str, dirs: bool = False) -> Iterator[os.DirEntry]:
+        """
+        Yields the entries of every file below dirpath, and of every folder
+        when dirs is True. Directory entries are told apart with the type
+        cached by scandir, so no file is stat'ed.
+        """
+        stack = [dirpath]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            with entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                        if dirs:
+                            yield entry
+                    elif not _TEMP_NAME.search(entry.name):
+                        yield entry
+
+    def _scan_top_level(
+        self, path: StoragePath, scan: Callable, dirs: bool = False
+    ) -> Iterator:
+        """
+        Yields what scan returns for the entry of every file below path, and
+        of every folder when dirs is True. The folders directly under path are
+        scanned in parallel on the storage's thread pool, each one's results
+        yielded as soon as it is done. Reserved folders at the root, like
+        _cache, are skipped.
+        """
+        at_root = not any(path)
+        try:
+            entries = list(os.scandir(self._join_path(path)))
+        except (FileNotFoundError, NotADirectoryError):
+            return
 
-        return data
+        folders = []
+        for entry in entries:
+            if at_root and entry.name.startswith("_"):
+                continue
+            if entry.is_dir():
+                folders.append(entry)
+            elif not _TEMP_NAME.search(entry.name):
+                yield scan(entry)
 
-    def list_key_paths(self, path: StoragePath) -> List[str]:
-        paths = []
-        joined_path = self._join_path(path)
-        subs = os.listdir(joined_path)
+        def scan_folder(folder: os.DirEntry) -> List:
+            scanned = [scan(e) for e in self._scan_files(folder.path, dirs)]
+            return [scan(folder)] + scanned if dirs else scanned
 
-        if subs:
-            for sub in subs:
-                copy = path.copy()
-                copy.append(sub)
-                sub_path = self._join_path(copy)
-                if os.path.isdir(sub_path):
-                    paths.extend(self.list_key_paths(copy))
-                else:
-                    paths.append(sub_path)
+        for results in self._map_concurrent_unordered(scan_folder, folders):
+            yield from results
 
-        return paths
+    def list_key_paths(self, path: StoragePath) -> Iterator[str]:
+        return self._scan_top_level(path, lambda entry: entry.path)
 
     def put_tags(self, path: StoragePath, tags: Dict) -> None:
-        self._ensure_path(path)
-
-        with open(self._join_path(path), "w") as f:
-            return f.write(json.dumps(tags))
+        self._write(path, lambda f: f.write(json.dumps(tags)), binary=False)
 
     def get_tags(self, path: StoragePath) -> Dict:
         try:
@@ -232,29 +1083,36 @@ class FileStorage(Storage):
         for key in tag_keys:
             return self.get_tags(key.split("/")[-3:])
 
-    def get_all_relic_data(self) -> List[Dict]:
-        relic_types = os.listdir(self._join_path([""]))
-        relic_data = []
-        for relic_type in relic_types:
-            if os.path.isdir(self._join_path([relic_type])):
-                names = os.listdir(self._join_path([relic_type]))
-
-                if names:
-                    for name in names:
-                        relic_data.append(
-                            {
-                                "relic_name": name,
-                                "relic_type": relic_type,
-                                "storage_name": self.name,
-                            }
-                        )
-        return relic_data
+    def _crawl_relic_data(self) -> List[Dict]:
+        """
+        Atomic and durable writes rename files into place, which moves the
+        mtime of their folder, so only folders are stat'ed. Fast writes
+        rewrite files in place and need the mtime of every file.
+        """
+        root = os.path.join(self.root, "")
+        stat_files = self.write_mode == "fast"
+
+        def key_and_version(entry: os.DirEntry) -> Optional[Tuple[str, Any]]:
+            key = entry.path[len(root) :].replace(os.sep, "/")
+            is_dir = entry.is_dir()
+            if not (is_dir or stat_files):
+                return key, ""
+
+            try:
+                mtime = entry.stat().st_mtime_ns
+            except FileNotFoundError:
+                return None
+
+            # Folders keep a trailing slash, so a relic's own folder is
+            # grouped with its objects
+            return (key + "/" if is_dir else key), mtime
+
+        return self._relic_data_from_listing(
+            item for item in self._scan_top_level([], key_and_version, True) if item
+        )
 
     def remove_obj(self, path: StoragePath) -> None:
-        try:
-            os.remove(self._join_path(path))
-        except FileNotFoundError:
-            raise StorageItemDoesNotExist
+        self._remove(path)
 
     def remove_relic(self, path: StoragePath) -> None:
         try:
@@ -273,6 +1131,12 @@ def _get_s3_client(signed) -> S3Client:
         return boto3.client("s3", config=Config(signature_version=UNSIGNED))
 
 
+def _supports_conditional_writes(client: S3Client) -> bool:
+    # PutObject only takes IfMatch and IfNoneMatch in recent botocore releases
+    put_object = client.meta.service_model.operation_model("PutObject")
+    return {"IfMatch", "IfNoneMatch"} <= set(put_object.input_shape.members)
+
+
 class S3Storage(Storage):
     def __init__(
         self,
@@ -287,6 +1151,7 @@ class S3Storage(Storage):
         self.signed = s3_signed
 
         self.s3 = _get_s3_client(self.signed)
+        self.conditional_writes = _supports_conditional_writes(self.s3)
 
     def _join_path(self, path: StoragePath) -> str:
         return "/".join([self.prefix] + path)
@@ -320,6 +1185,52 @@ class S3Storage(Storage):
 
         return obj["Body"].read().decode(encoding)
 
+    def get_text_with_version(
+        self, path: StoragePath, encoding: str = "utf-8"
+    ) -> Tuple[str, Any]:
+        try:
+            obj = self.s3.get_object(Key=self._join_path(path), Bucket=self.s3_bucket)
+        except self.s3.exceptions.NoSuchKey:
+            raise StorageItemDoesNotExist
+
+        return obj["Body"].read().decode(encoding), obj["ETag"]
+
+    def get_version(self, path: StoragePath) -> Any:
+        try:
+            head = self.s3.head_object(Key=self._join_path(path), Bucket=self.s3_bucket)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                raise StorageItemDoesNotExist
+            raise
+
+        return head["ETag"]
+
+    def put_text_if_match(
+        self, path: StoragePath, text: str, version: Any, encoding: str = "utf-8"
+    ) -> bool:
+        if not self.conditional_writes:
+            # Too old a botocore to send the condition, the last writer wins
+            self.put_text(path, text, encoding)
+            return True
+
+        condition = {"IfNoneMatch": "*"} if version is None else {"IfMatch": version}
+        try:
+            self.s3.put_object(
+                Key=self._join_path(path),
+                Bucket=self.s3_bucket,
+                Body=text.encode(encoding),
+                **condition,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in (
+                "PreconditionFailed",
+                "ConditionalRequestConflict",
+            ):
+                return False
+            raise
+
+        return True
+
     def list_keys(self, path: StoragePath) -> List[str]:
         prefix = self._join_path(path)
 
@@ -357,33 +1268,18 @@ class S3Storage(Storage):
             raise StorageItemDoesNotExist
 
     def get_metadata(self, path: StoragePath, root_key: str) -> Dict:
-        data = {root_key: {k: [] for k in DATA_TYPES}}
-
-        def dict_from_path(path: StoragePath, dirname: str) -> None:
-            dirpath = path.copy()
-            dirpath.append(dirname)
-            dir_keys = self.list_keys(dirpath.copy())
-
-            for key in dir_keys:
-                key_path = dirpath.copy()
-                key_path.append(key)
-
-                try:
-                    obj = self.s3.get_object(
-                        Key=self._join_path(key_path),
-                        Bucket=self.s3_bucket,
-                    )
-                except self.s3.exceptions.NoSuchKey:
-                    raise StorageItemDoesNotExist
-
-                data[root_key][dirname].append(
-                    json.loads(obj["Body"].read().decode("utf-8"))
+        def read(key_path: StoragePath) -> Dict:
+            try:
+                obj = self.s3.get_object(
+                    Key=self._join_path(key_path),
+                    Bucket=self.s3_bucket,
                 )
+            except self.s3.exceptions.NoSuchKey:
+                raise StorageItemDoesNotExist
 
-        for d in data[root_key]:
-            dict_from_path(path, d)
+            return json.loads(obj["Body"].read().decode("utf-8"))
 
-        return data
+        return self._gather_metadata(path, root_key, read)
 
     def list_key_paths(self, path: StoragePath) -> List[str]:
         prefix = self._join_path(path)
@@ -429,22 +1325,26 @@ class S3Storage(Storage):
 
         return tags
 
-    def get_all_relic_data(self) -> List[Dict]:
-        relic_types = {path.split("/")[0] for path in self.list_key_paths([""])}
-        relic_data = []
+    def _list_objects(self, prefix: str) -> Iterable[Dict]:
+        kwargs = {}
+        while True:
+            response = self.s3.list_objects_v2(
+                Bucket=self.s3_bucket, Prefix=prefix, **kwargs
+            )
 
-        for relic_type in relic_types:
-            names = {path.split("/")[1] for path in self.list_key_paths([relic_type])}
-            if names:
-                for name in names:
-                    relic_data.append(
-                        {
-                            "relic_name": name,
-                            "relic_type": relic_type,
-                            "storage_name": self.name,
-                        }
-                    )
-            return relic_data
+            yield from response.get("Contents", [])
+
+            if not response["IsTruncated"]:
+                break
+            kwargs = dict(ContinuationToken=response["NextContinuationToken"])
+
+    def _crawl_relic_data(self) -> List[Dict]:
+        prefix = self._join_path([""])
+
+        return self._relic_data_from_listing(
+            (obj["Key"][len(prefix) :], obj["ETag"])
+            for obj in self._list_objects(prefix)
+        )
 
     def remove_obj(self, path: StoragePath) -> None:
         try:
@@ -452,6 +1352,33 @@ class S3Storage(Storage):
         except self.s3.exceptions.NoSuchKey:
             raise StorageItemDoesNotExist
 
+    def remove_many(self, paths: List[StoragePath]) -> List:
+        """
+        Removes objects with DeleteObjects, up to 1000 keys per request.
+        """
+        keys = [self._join_path(path) for path in paths]
+        chunks = [keys[i : i + 1000] for i in range(0, len(keys), 1000)]
+
+        def delete(chunk: List[str]) -> Dict:
+            try:
+                response = self.s3.delete_objects(
+                    Bucket=self.s3_bucket,
+                    Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True},
+                )
+            except Exception as e:
+                return {k: e for k in chunk}
+
+            return {
+                error["Key"]: Exception(f"{error['Code']}: {error['Message']}")
+                for error in response.get("Errors", [])
+            }
+
+        errors = {}
+        for chunk_errors in self._map_concurrent(delete, chunks):
+            errors.update(chunk_errors)
+
+        return [errors.get(k) for k in keys]
+
     def remove_relic(self, path: StoragePath) -> None:
         name = path[1]
         _type = path[0]
@@ -502,7 +1429,43 @@ class DropboxStorage(Storage):
         except ApiError:
             raise StorageItemDoesNotExist
 
-    def list_keys(self, path: StoragePath) -> List[str]:
+    def get_text_with_version(self, path: StoragePath) -> Tuple[str, Any]:
+        try:
+            metadata, response = self.dbx.files_download(self._join_path(path))
+        except ApiError:
+            raise StorageItemDoesNotExist
+
+        return response.text, metadata.rev
+
+    def get_version(self, path: StoragePath) -> Any:
+        try:
+            return self.dbx.files_get_metadata(self._join_path(path)).rev
+        except ApiError:
+            raise StorageItemDoesNotExist
+
+    def put_text_if_match(
+        self, path: StoragePath, text: str, version: Any, encoding: str = "utf-8"
+    ) -> bool:
+        if version is None:
+            mode = dropbox.files.WriteMode.add
+        else:
+            mode = dropbox.files.WriteMode.update(version)
+
+        try:
+            self.dbx.files_upload(
+                bytes(text, encoding),
+                self._join_path(path),
+                mode=mode,
+                autorename=False,
+            )
+        except ApiError as e:
+            if e.error.is_path() and e.error.get_path().reason.is_conflict():
+                return False
+            raise
+
+        return True
+
+    def list_keys(self, path: StoragePath) -> List[str]:
         try:
             return [
                 i.name
@@ -526,24 +1489,10 @@ class DropboxStorage(Storage):
             raise StorageItemDoesNotExist
 
     def get_metadata(self, path: StoragePath, root_key: str) -> Dict:
-        data = {root_key: {k: [] for k in DATA_TYPES}}
-
-        def dict_from_path(path: StoragePath, dirname: str):
-            dirpath = path.copy()
-            dirpath.append(dirname)
-            entries = self.list_keys(dirpath)
-
-            for i in entries:
-                entry_path = dirpath.copy()
-                entry_path.append(i)
-                data[root_key][dirname].append(
-                    self.dbx.files_download(self._join_path(entry_path))[-1].json()
-                )
-
-        for d in data[root_key]:
-            dict_from_path(path, d)
+        def read(entry_path: StoragePath) -> Dict:
+            return self.dbx.files_download(self._join_path(entry_path))[-1].json()
 
-        return data
+        return self._gather_metadata(path, root_key, read)
 
     def list_key_paths(self, path: StoragePath) -> List[str]:
         paths = []
@@ -580,22 +1529,22 @@ class DropboxStorage(Storage):
         for key in tag_keys:
             return self.get_tags(key.split("/")[-3:])
 
-    def get_all_relic_data(self) -> List[Dict]:
-        relic_types = {path.split("/")[2] for path in self.list_key_paths([])}
-        relic_data = []
+    def _crawl_relic_data(self) -> List[Dict]:
+        try:
+            result = self.dbx.files_list_folder(self.prefix, recursive=True)
+        except ApiError:
+            return []
 
-        for relic_type in relic_types:
-            names = {path.split("/")[3] for path in self.list_key_paths([relic_type])}
-            if names:
-                for name in names:
-                    relic_data.append(
-                        {
-                            "relic_name": name,
-                            "relic_type": relic_type,
-                            "storage_name": self.name,
-                        }
-                    )
-        return relic_data
+        entries = list(result.entries)
+        while result.has_more:
+            result = self.dbx.files_list_folder_continue(result.cursor)
+            entries.extend(result.entries)
+
+        return self._relic_data_from_listing(
+            (entry.path_display[len(self.prefix) + 1 :], entry.rev)
+            for entry in entries
+            if isinstance(entry, dropbox.files.FileMetadata)
+        )
 
     def remove_obj(self, path: StoragePath) -> None:
         path = self._join_path(path)
@@ -626,15 +1575,16 @@ class GoogleDriveStorage(Storage):
         self.token_file = token_file
         self.SCOPES = SCOPES
         self.shared_folder_id = shared_folder_id
+        self._local = threading.local()
+        self._creds = None
 
         if service is None:
-            creds = None
             if os.path.exists(token_file):
-                creds = service_account.Credentials.from_service_account_file(
+                self._creds = service_account.Credentials.from_service_account_file(
                     token_file, scopes=SCOPES
                 )
             try:
-                self.service = build("drive", "v3", credentials=creds)
+                self.service = build("drive", "v3", credentials=self._creds)
             except IOError:
                 raise StorageItemDoesNotExist
         else:
@@ -664,6 +1614,29 @@ class GoogleDriveStorage(Storage):
             prefix_folder = self._create_folder(self.prefix, self.shared_folder_id)
             self.root_id = prefix_folder["id"]
 
+    @property
+    def thread_safe(self) -> bool:
+        # The http client of a Drive service is not thread safe, so requests
+        # only run concurrently when each pool thread can build its own service
+        return self._creds is not None
+
+    @property
+    def service(self):
+        """
+        The Drive service of the calling thread. Threads of the storage's pool
+        build their own, every other thread shares the one made at construction.
+        """
+        if self._creds is None or not getattr(_pool_worker, "active", False):
+            return self._service
+
+        if getattr(self._local, "service", None) is None:
+            self._local.service = build("drive", "v3", credentials=self._creds)
+        return self._local.service
+
+    @service.setter
+    def service(self, service) -> None:
+        self._service = service
+
     def _join_path(self, path: StoragePath) -> str:
         return "/".join([self.prefix] + path)
 
@@ -935,6 +1908,14 @@ class GoogleDriveStorage(Storage):
                 .decode(encoding)
             )
 
+    def get_text_with_version(self, path: StoragePath) -> Tuple[str, Any]:
+        return self.get_text(path), None
+
+    def put_text_if_match(self, path: StoragePath, text: str, version: Any) -> bool:
+        # Drive has no conditional writes, the last writer wins
+        self.put_text(path, text)
+        return True
+
     def list_keys(self, path: StoragePath) -> List[str]:
         # Go to the deepest part of the path and save the id of that folder
         curr_root = self.root_id
@@ -1001,38 +1982,21 @@ class GoogleDriveStorage(Storage):
     def get_metadata(
         self, path: StoragePath, root_key: str, encoding: str = "utf-8"
     ) -> Dict:
-        data = {root_key: {k: [] for k in DATA_TYPES}}
-
-        def dict_from_path(path: StoragePath, dirname: str):
-            dirpath = path.copy()
-            dirpath.append(dirname)
-            entries = self.list_keys(dirpath)
-
-            for i in entries:
-                entry_path = dirpath.copy()
-                entry_path.append(i)
-
-                file_id = ""
-                curr_root = self.root_id
-                parents = self._create_path(curr_root, entry_path[:-1])
-                try:
-                    file_id = self._find_id_in_folder(parents[-1], entry_path[-1])
-                except StorageItemDoesNotExist:
-                    return []
-
-                data[root_key][dirname].append(
-                    json.loads(
-                        self.service.files()
-                        .get_media(fileId=file_id)
-                        .execute()
-                        .decode(encoding)
-                    )
-                )
+        def read(entry_path: StoragePath) -> Optional[Dict]:
+            parents = self._create_path(self.root_id, entry_path[:-1])
+            try:
+                file_id = self._find_id_in_folder(parents[-1], entry_path[-1])
+            except StorageItemDoesNotExist:
+                return None
 
-        for d in data[root_key]:
-            dict_from_path(path, d)
+            return json.loads(
+                self.service.files()
+                .get_media(fileId=file_id)
+                .execute()
+                .decode(encoding)
+            )
 
-        return data
+        return self._gather_metadata(path, root_key, read)
 
     def put_tags(self, path: StoragePath, tags: Dict, encoding="utf-8") -> None:
         self._create_path(self.root_id, path[:-1])
@@ -1046,8 +2010,12 @@ class GoogleDriveStorage(Storage):
 
         return json.loads(tags)
 
-    def get_all_relic_data(self) -> List[Dict]:
-        relic_types = [path.split("/")[1] for path in self.list_key_paths([])]
+    def _crawl_relic_data(self) -> List[Dict]:
+        relic_types = [
+            path.split("/")[1]
+            for path in self.list_key_paths([])
+            if not path.split("/")[1].startswith("_")
+        ]
         relic_data = []
 
         for relic_type in relic_types:
@@ -1139,6 +2107,49 @@ class GoogleCloudStorage(Storage):
         except NotFound:
             raise StorageItemDoesNotExist
 
+    def get_text_with_version(self, path: StoragePath) -> Tuple[str, Any]:
+        bucket = self.storage_client.bucket(self.bucket_id)
+        while True:
+            blob = bucket.get_blob(self._join_path(path))
+            if blob is None:
+                raise StorageItemDoesNotExist
+
+            try:
+                text = blob.download_as_text(if_generation_match=blob.generation)
+            except (NotFound, PreconditionFailed):
+                # Rewritten or removed between the two requests, read it again
+                continue
+
+            return text, blob.generation
+
+    def get_version(self, path: StoragePath) -> Any:
+        blob = self.storage_client.bucket(self.bucket_id).get_blob(
+            self._join_path(path)
+        )
+        if blob is None:
+            raise StorageItemDoesNotExist
+
+        return blob.generation
+
+    def exists(self, path: StoragePath) -> bool:
+        return (
+            self.storage_client.bucket(self.bucket_id)
+            .blob(self._join_path(path))
+            .exists()
+        )
+
+    def put_text_if_match(self, path: StoragePath, text: str, version: Any) -> bool:
+        bucket = self.storage_client.bucket(self.bucket_id)
+        blob = bucket.blob(self._join_path(path))
+        try:
+            blob.upload_from_string(
+                text, if_generation_match=version if version is not None else 0
+            )
+        except PreconditionFailed:
+            return False
+
+        return True
+
     def list_keys(self, path: StoragePath) -> List[str]:
         key_list = []
         bucket = self.storage_client.get_bucket(self.bucket_id)
@@ -1184,24 +2195,13 @@ class GoogleCloudStorage(Storage):
             raise StorageItemDoesNotExist
 
     def get_metadata(self, path: StoragePath, root_key: str) -> Dict:
-        data = {root_key: {k: [] for k in DATA_TYPES}}
-
-        def dict_from_path(path: StoragePath, dirname: str):
-            dirpath = path.copy()
-            dirpath.append(dirname)
-            entries = self.list_keys(dirpath)
-
-            for i in entries:
-                entry_path = dirpath.copy()
-                entry_path.append(i)
-                bucket = self.storage_client.bucket(self.bucket_id)
-                blob = bucket.blob(self._join_path(entry_path))
-                data[root_key][dirname].append(json.loads(blob.download_as_text()))
+        bucket = self.storage_client.bucket(self.bucket_id)
 
-        for d in data[root_key]:
-            dict_from_path(path, d)
+        def read(entry_path: StoragePath) -> Dict:
+            blob = bucket.blob(self._join_path(entry_path))
+            return json.loads(blob.download_as_text())
 
-        return data
+        return self._gather_metadata(path, root_key, read)
 
     def put_tags(self, path: StoragePath, tags: Dict) -> None:
         self.put_text(path, json.dumps(tags))
@@ -1214,28 +2214,14 @@ class GoogleCloudStorage(Storage):
 
         return json.loads(tags)
 
-    def get_all_relic_data(self) -> List[Dict]:
+    def _crawl_relic_data(self) -> List[Dict]:
         bucket = self.storage_client.get_bucket(self.bucket_id)
-        relic_types = {
-            path.id.split("/")[2] for path in self.storage_client.list_blobs(bucket)
-        }
-        relic_data = []
+        prefix = self._join_path([""])
 
-        for relic_type in relic_types:
-            prefix = self._join_path([relic_type])
-            names = {path.id for path in self.storage_client.list_blobs(bucket)}
-            for name in names:
-                if prefix in name:
-                    if "metadata" in name:
-                        name = name.split("/")[3]
-                        relic_data.append(
-                            {
-                                "relic_name": name,
-                                "relic_type": relic_type,
-                                "storage_name": self.name,
-                            }
-                        )
-        return relic_data
+        return self._relic_data_from_listing(
+            (blob.name[len(prefix) :], blob.generation)
+            for blob in self.storage_client.list_blobs(bucket, prefix=prefix)
+        )
 
     def remove_obj(self, path: StoragePath) -> None:
         path = self._join_path(path)
@@ -1261,6 +2247,815 @@ class GoogleCloudStorage(Storage):
             blob.delete()
 
 
+class StorageWrapper(Storage):
+    """
+    Storage passing every request through to the wrapped storage. Subclasses
+    override the requests they change. Attributes the wrapper does not define
+    are read from the wrapped storage.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.name = storage.name
+
+    def __getattr__(self, attr: str) -> Any:
+        if attr == "storage":
+            raise AttributeError(attr)
+
+        return getattr(self.storage, attr)
+
+    @property
+    def thread_safe(self) -> bool:
+        return self.storage.thread_safe
+
+    @property
+    def max_workers(self) -> int:
+        return self.storage.max_workers
+
+    def _executor(self) -> ThreadPoolExecutor:
+        return self.storage._executor()
+
+    def put_file(self, path: StoragePath, file_path: str) -> None:
+        self.storage.put_file(path, file_path)
+
+    def put_binary_obj(self, path: StoragePath, buffer: BytesIO):
+        self.storage.put_binary_obj(path, buffer)
+
+    def get_binary_obj(self, path: StoragePath) -> BytesIO:
+        return self.storage.get_binary_obj(path)
+
+    def put_text(self, path: StoragePath, text: str) -> None:
+        self.storage.put_text(path, text)
+
+    def get_text(self, path: StoragePath) -> str:
+        return self.storage.get_text(path)
+
+    def list_keys(self, path: StoragePath) -> List[str]:
+        return self.storage.list_keys(path)
+
+    def get_text_with_version(self, path: StoragePath) -> Tuple[str, Any]:
+        return self.storage.get_text_with_version(path)
+
+    def put_text_if_match(self, path: StoragePath, text: str, version: Any) -> bool:
+        return self.storage.put_text_if_match(path, text, version)
+
+    def get_version(self, path: StoragePath) -> Any:
+        return self.storage.get_version(path)
+
+    def get_local_path(self, path: StoragePath) -> Optional[str]:
+        return self.storage.get_local_path(path)
+
+    def exists(self, path: StoragePath) -> bool:
+        return self.storage.exists(path)
+
+    def put_metadata(self, path: StoragePath, metadata: Dict):
+        self.storage.put_metadata(path, metadata)
+
+    def remove_metadata(self, path: StoragePath):
+        self.storage.remove_metadata(path)
+
+    def get_metadata(self, path: StoragePath, root_key: str) -> Dict:
+        return self.storage.get_metadata(path, root_key)
+
+    def put_tags(self, path: StoragePath, tags: Dict) -> None:
+        self.storage.put_tags(path, tags)
+
+    def get_tags(self, path: StoragePath) -> Dict:
+        return self.storage.get_tags(path)
+
+    def get_all_relic_tags(self) -> List[Dict]:
+        return self.storage.get_all_relic_tags()
+
+    def get_all_relic_data(self) -> List[Dict]:
+        return self.storage.get_all_relic_data()
+
+    def _crawl_relic_data(self) -> List[Dict]:
+        return self.storage._crawl_relic_data()
+
+    def touch_catalog(
+        self, relic_type: str, relic_name: str, removed: bool = False
+    ) -> None:
+        self.storage.touch_catalog(relic_type, relic_name, removed)
+
+    def rebuild_catalog(self) -> Dict:
+        return self.storage.rebuild_catalog()
+
+    def remove_obj(self, path: StoragePath) -> None:
+        self.storage.remove_obj(path)
+
+    def remove_relic(self, path: StoragePath) -> None:
+        self.storage.remove_relic(path)
+
+    def remove_many(self, paths: List[StoragePath]) -> List:
+        return self.storage.remove_many(paths)
+
+
+class CachedStorage(StorageWrapper):
+    """
+    Read-through cache of the artifacts of a remote storage in a local
+    directory. Entries are validated against the version of the remote object
+    (ETag, generation or revision) once they are older than max_age seconds,
+    and the least recently read are evicted beyond max_bytes. Artifacts are
+    written to the remote storage and dropped from the cache.
+
+    By default every read is validated, which costs a metadata request but
+    never serves a stale copy. A positive max_age opts in to serving copies
+    up to that many seconds old without asking the remote storage.
+
+    Only artifacts are cached: manifests, catalogs, tags and metadata change
+    too often to be worth it.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        root: str,
+        max_bytes: int = 10 * 2**30,
+        max_age: float = 0.0,
+    ):
+        super().__init__(storage)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.objects_dir = os.path.join(root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        self._index_lock = threading.Lock()
+        self._index = sqlite3.connect(
+            os.path.join(root, "index.db"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._index.execute("PRAGMA journal_mode=WAL")
+        self._index.execute("PRAGMA busy_timeout=30000")
+        self._index.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key text PRIMARY KEY,
+                version text,
+                size integer,
+                validated_at real,
+                accessed_at real
+            )
+            """
+        )
+        self._index.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed_idx ON entries (accessed_at)"
+        )
+
+    @staticmethod
+    def _cacheable(path: StoragePath) -> bool:
+        return len(path) == 4 and path[2] in DATA_TYPES
+
+    @staticmethod
+    def _key(path: StoragePath) -> str:
+        return "/".join(path)
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(
+            self.objects_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()
+        )
+
+    def _remote_version(self, path: StoragePath) -> Optional[str]:
+        try:
+            return str(self.storage.get_version(path))
+        except NotImplementedError:
+            return None
+
+    def _evict(self, keep: str) -> None:
+        with self._index_lock:
+            total = self._index.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+            if not total or total <= self.max_bytes:
+                return
+
+            evicted = []
+            for key, size in self._index.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                if key != keep:
+                    evicted.append(key)
+                    total -= size
+
+            self._index.executemany(
+                "DELETE FROM entries WHERE key = ?", [(key,) for key in evicted]
+            )
+
+        for key in evicted:
+            try:
+                os.remove(self._object_path(key))
+            except FileNotFoundError:
+                pass
+
+    def _download(self, path: StoragePath, key: str) -> str:
+        version = self._remote_version(path)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, self.storage.get_binary_obj(path) as obj:
+                shutil.copyfileobj(obj, f)
+            os.replace(tmp_path, self._object_path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        now = time.time()
+        with self._index_lock:
+            self._index.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, version, os.path.getsize(self._object_path(key)), now, now),
+            )
+        self._evict(keep=key)
+
+        return self._object_path(key)
+
+    def get_local_path(self, path: StoragePath) -> Optional[str]:
+        """
+        Returns the path of the cached copy of the object, downloading it
+        first if it is missing or stale.
+        """
+        if not self._cacheable(path):
+            return self.storage.get_local_path(path)
+
+        key = self._key(path)
+        object_path = self._object_path(key)
+        with self._index_lock:
+            entry = self._index.execute(
+                "SELECT version, validated_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+        if entry is None or not os.path.exists(object_path):
+            return self._download(path, key)
+
+        version, validated_at = entry
+        now = time.time()
+        if now - validated_at >= self.max_age:
+            try:
+                current = None if version is None else self._remote_version(path)
+            except StorageItemDoesNotExist:
+                self.invalidate(path)
+                raise
+
+            if current is None or current != version:
+                return self._download(path, key)
+
+            validated_at = now
+
+        with self._index_lock:
+            self._index.execute(
+                "UPDATE entries SET validated_at = ?, accessed_at = ? WHERE key = ?",
+                (validated_at, now, key),
+            )
+
+        return object_path
+
+    def get_binary_obj(self, path: StoragePath) -> BytesIO:
+        if not self._cacheable(path):
+            return self.storage.get_binary_obj(path)
+
+        try:
+            return open(self.get_local_path(path), "rb")
+        except FileNotFoundError:
+            # Evicted by another reader in the meantime
+            return self.storage.get_binary_obj(path)
+
+    def get_text(self, path: StoragePath) -> str:
+        if not self._cacheable(path):
+            return self.storage.get_text(path)
+
+        with self.get_binary_obj(path) as f:
+            return f.read().decode("utf-8")
+
+    def invalidate(self, path: StoragePath) -> None:
+        """
+        Drops the cached copies of the object at path and of every object
+        below it.
+        """
+        key = self._key(path)
+        with self._index_lock:
+            keys = [
+                row[0]
+                for row in self._index.execute(
+                    "SELECT key FROM entries WHERE key = ? OR substr(key, 1, ?) = ?",
+                    (key, len(key) + 1, key + "/"),
+                ).fetchall()
+            ]
+            self._index.executemany(
+                "DELETE FROM entries WHERE key = ?", [(k,) for k in keys]
+            )
+
+        for k in keys:
+            try:
+                os.remove(self._object_path(k))
+            except FileNotFoundError:
+                pass
+
+    def put_file(self, path: StoragePath, file_path: str) -> None:
+        self.invalidate(path)
+        self.storage.put_file(path, file_path)
+
+    def put_binary_obj(self, path: StoragePath, buffer: BytesIO):
+        self.invalidate(path)
+        self.storage.put_binary_obj(path, buffer)
+
+    def put_text(self, path: StoragePath, text: str) -> None:
+        self.invalidate(path)
+        self.storage.put_text(path, text)
+
+    def remove_obj(self, path: StoragePath) -> None:
+        self.invalidate(path)
+        self.storage.remove_obj(path)
+
+    def remove_relic(self, path: StoragePath) -> None:
+        self.invalidate(path)
+        self.storage.remove_relic(path)
+
+    def remove_many(self, paths: List[StoragePath]) -> List:
+        for path in paths:
+            self.invalidate(path)
+
+        return self.storage.remove_many(paths)
+
+
+class MemoryCachedStorage(StorageWrapper):
+    """
+    In-process TTL and LRU cache of the small objects read on every relic
+    access: exists markers, manifests, tags and metadata. Entries expire after
+    ttl seconds and the least recently read are dropped beyond max_entries or
+    max_bytes. Writes through this storage update or drop the entries they
+    affect; writes by other processes are seen once entries expire. A read
+    racing a write through this storage is not cached.
+
+    hits and misses count the reads served from and past the cache.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        max_entries: int = 4096,
+        max_bytes: int = 64 * 2**20,
+        ttl: float = 10.0,
+    ):
+        super().__init__(storage)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Invalidation generations, striped by a hash of the path
+        self._generations = [0] * 1024
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _get(self, key: Tuple) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+
+        return None
+
+    def _slots(self, path: Tuple) -> List[int]:
+        # Moved by invalidating path or an object below it, or a path above it
+        slots = [hash(("below", path))]
+        slots.extend(hash(("at", path[:i])) for i in range(len(path) + 1))
+        return [slot % len(self._generations) for slot in slots]
+
+    def _generation(self, key: Tuple) -> Tuple:
+        """
+        Taken before reading key from the storage and passed to _set, which
+        skips caching the value if an invalidation of key ran in between.
+        """
+        with self._lock:
+            return tuple(self._generations[slot] for slot in self._slots(key[1]))
+
+    def _set(
+        self, key: Tuple, value: Any, size: int, generation: Optional[Tuple] = None
+    ) -> None:
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation is not None and generation != tuple(
+                self._generations[slot] for slot in self._slots(key[1])
+            ):
+                return
+
+            if key in self._entries:
+                self._drop(key)
+
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: Tuple) -> None:
+        self._bytes -= self._entries.pop(key)[2]
+
+    def invalidate(self, path: StoragePath) -> None:
+        """
+        Drops the entries of the object at path, of the objects below it and
+        of the metadata listings above it.
+        """
+        path = tuple(path)
+        with self._lock:
+            for i in range(len(path) + 1):
+                slot = hash(("below", path[:i])) % len(self._generations)
+                self._generations[slot] += 1
+            self._generations[hash(("at", path)) % len(self._generations)] += 1
+
+            for key in list(self._entries):
+                cached = key[1]
+                n = min(len(cached), len(path))
+                if cached[:n] == path[:n]:
+                    self._drop(key)
+
+    def get_text(self, path: StoragePath) -> str:
+        if CachedStorage._cacheable(path):
+            return self.storage.get_text(path)
+
+        key = ("text", tuple(path))
+        text = self._get(key)
+        if text is None:
+            generation = self._generation(key)
+            text = self.storage.get_text(path)
+            self._set(key, text, len(text), generation)
+
+        return text
+
+    def exists(self, path: StoragePath) -> bool:
+        key = ("exists", tuple(path))
+        if self._get(key):
+            return True
+
+        generation = self._generation(key)
+        exists = self.storage.exists(path)
+        if exists:
+            self._set(key, True, 1, generation)
+
+        return exists
+
+    def get_tags(self, path: StoragePath) -> Dict:
+        key = ("tags", tuple(path))
+        tags = self._get(key)
+        if tags is None:
+            generation = self._generation(key)
+            tags = self.storage.get_tags(path)
+            self._set(key, copy.deepcopy(tags), len(json.dumps(tags)), generation)
+
+        return tags
+
+    def get_metadata(self, path: StoragePath, root_key: str) -> Dict:
+        key = ("metadata", tuple(path), root_key)
+        metadata = self._get(key)
+        if metadata is None:
+            generation = self._generation(key)
+            metadata = self.storage.get_metadata(path, root_key)
+            self._set(
+                key, copy.deepcopy(metadata), len(json.dumps(metadata)), generation
+            )
+
+        return metadata
+
+    @contextmanager
+    def _invalidating(self, *paths: StoragePath) -> Iterator[None]:
+        # After the write, so reads it raced with are not cached either
+        try:
+            yield
+        finally:
+            for path in paths:
+                self.invalidate(path)
+
+    def put_file(self, path: StoragePath, file_path: str) -> None:
+        with self._invalidating(path):
+            self.storage.put_file(path, file_path)
+
+    def put_binary_obj(self, path: StoragePath, buffer: BytesIO):
+        with self._invalidating(path):
+            self.storage.put_binary_obj(path, buffer)
+
+    def put_text(self, path: StoragePath, text: str) -> None:
+        with self._invalidating(path):
+            self.storage.put_text(path, text)
+
+    def put_text_if_match(self, path: StoragePath, text: str, version: Any) -> bool:
+        with self._invalidating(path):
+            return self.storage.put_text_if_match(path, text, version)
+
+    def put_metadata(self, path: StoragePath, metadata: Dict):
+        with self._invalidating(path):
+            self.storage.put_metadata(path, metadata)
+
+    def remove_metadata(self, path: StoragePath):
+        with self._invalidating(path):
+            self.storage.remove_metadata(path)
+
+    def put_tags(self, path: StoragePath, tags: Dict) -> None:
+        with self._invalidating(path):
+            self.storage.put_tags(path, tags)
+        self._set(("tags", tuple(path)), copy.deepcopy(tags), len(json.dumps(tags)))
+
+    def remove_obj(self, path: StoragePath) -> None:
+        with self._invalidating(path):
+            self.storage.remove_obj(path)
+
+    def remove_relic(self, path: StoragePath) -> None:
+        with self._invalidating(path):
+            self.storage.remove_relic(path)
+
+    def remove_many(self, paths: List[StoragePath]) -> List:
+        with self._invalidating(*paths):
+            return self.storage.remove_many(paths)
+
+
+class WriteBehindError(Exception):
+    """
+    Raised by WriteBehindStorage.flush with the (path, exception) pairs of the
+    writes that failed since the previous flush.
+    """
+
+    def __init__(self, errors: List[Tuple[StoragePath, Exception]]):
+        path, error = errors[0]
+        super().__init__(
+            f"{len(errors)} deferred writes failed, first {'/'.join(path)}: {error!r}"
+        )
+        self.errors = errors
+
+
+class WriteBehindStorage(StorageWrapper):
+    """
+    Queues writes and uploads them from a background thread pool. A write to
+    a path that is still queued replaces it, and manifest and catalog updates
+    are held until flush, then applied once per object.
+    Writers block while max_pending writes or max_pending_bytes are queued.
+
+    Reads of queued objects, tags and manifests see the queued state. flush
+    waits for every queued write and raises a WriteBehindError if any failed.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        workers: int = 8,
+        max_pending: int = 1000,
+        max_pending_bytes: int = 64 * 2**20,
+    ):
+        super().__init__(storage)
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+
+        # Not the storage's pool, a writer blocked on backpressure from one
+        # of its threads would keep the queue from draining
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._inflight = {}
+        # Keys with a drain running, which alone writes them until it finds
+        # nothing left to write
+        self._owned = set()
+        self._bytes = 0
+        self._errors = []
+        self._manifest_updates = {}
+        self._catalog_touches = {}
+
+    def _write(self, kind: str, path: StoragePath, payload: Any) -> None:
+        if kind == "text":
+            self.storage.put_text(path, payload)
+        elif kind == "binary":
+            self.storage.put_binary_obj(path, BytesIO(payload))
+        elif kind == "metadata":
+            self.storage.put_metadata(path, payload)
+        else:
+            self.storage.put_tags(path, payload)
+
+    def _full(self, size: int) -> bool:
+        queued = len(self._pending) + len(self._inflight)
+        return queued > 0 and (
+            queued >= self.max_pending or self._bytes + size > self.max_pending_bytes
+        )
+
+    def _enqueue(self, kind: str, path: StoragePath, payload: Any, size: int) -> None:
+        key = tuple(path)
+        with self._cond:
+            while key not in self._pending and self._full(size):
+                self._cond.wait()
+
+            previous = self._pending.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[3]
+
+            self._pending[key] = (kind, list(path), payload, size)
+            self._bytes += size
+            # The drain owning the key picks the new write up when it is done
+            if key not in self._owned:
+                self._owned.add(key)
+                self._pool.submit(self._drain, key)
+
+    def _drain(self, key: Tuple) -> None:
+        while True:
+            with self._cond:
+                entry = self._pending.pop(key, None)
+                if entry is None:
+                    self._owned.discard(key)
+                    self._cond.notify_all()
+                    return
+                self._inflight[key] = entry
+
+            kind, path, payload, size = entry
+            try:
+                self._write(kind, path, payload)
+            except Exception as e:
+                with self._cond:
+                    self._errors.append((path, e))
+            finally:
+                with self._cond:
+                    self._inflight.pop(key, None)
+                    self._bytes -= size
+                    self._cond.notify_all()
+
+    def _queued(self, path: StoragePath) -> Optional[Tuple]:
+        key = tuple(path)
+        with self._cond:
+            return self._pending.get(key) or self._inflight.get(key)
+
+    def _wait_idle(self) -> None:
+        with self._cond:
+            while self._owned:
+                self._cond.wait()
+
+    def _apply_deferred(self) -> None:
+        with self._cond:
+            manifest_updates, self._manifest_updates = self._manifest_updates, {}
+            catalog_touches, self._catalog_touches = self._catalog_touches, {}
+
+        def apply(item: Tuple[StoragePath, List[Callable]]) -> None:
+            path, updates = item
+
+            def update(manifest: Optional[Dict]) -> Dict:
+                for u in updates:
+                    manifest = u(manifest)
+                return manifest
+
+            try:
+                self.storage.update_manifest(path, update)
+            except Exception as e:
+                with self._cond:
+                    self._errors.append((path, e))
+
+        self._map_concurrent(apply, manifest_updates.values())
+
+        for (relic_type, relic_name), removed in catalog_touches.items():
+            try:
+                self.storage.touch_catalog(relic_type, relic_name, removed)
+            except Exception as e:
+                with self._cond:
+                    self._errors.append(([relic_type, relic_name], e))
+
+    def flush(self) -> None:
+        """
+        Waits for every queued write, applies the deferred manifest and
+        catalog updates and raises a WriteBehindError if any of them failed.
+        """
+        self._wait_idle()
+        self._apply_deferred()
+
+        with self._cond:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise WriteBehindError(errors)
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+
+    def put_file(self, path: StoragePath, file_path: str) -> None:
+        with open(file_path, "rb") as f:
+            content = f.read()
+        self._enqueue("binary", path, content, len(content))
+
+    def put_binary_obj(self, path: StoragePath, buffer: BytesIO):
+        content = buffer.read()
+        self._enqueue("binary", path, content, len(content))
+
+    def put_text(self, path: StoragePath, text: str) -> None:
+        self._enqueue("text", path, text, len(text))
+
+    def put_metadata(self, path: StoragePath, metadata: Dict):
+        metadata = copy.deepcopy(metadata)
+        self._enqueue("metadata", path, metadata, len(json.dumps(metadata)))
+
+    def put_tags(self, path: StoragePath, tags: Dict) -> None:
+        tags = copy.deepcopy(tags)
+        self._enqueue("tags", path, tags, len(json.dumps(tags)))
+
+    def update_manifest(
+        self,
+        path: StoragePath,
+        update: Callable[[Optional[Dict]], Dict],
+        retries: int = 10,
+    ) -> Optional[Dict]:
+        """
+        Deferred until flush, returns None.
+        """
+        with self._cond:
+            self._manifest_updates.setdefault(tuple(path), (list(path), []))[1].append(
+                update
+            )
+
+    def touch_catalog(
+        self, relic_type: str, relic_name: str, removed: bool = False
+    ) -> None:
+        with self._cond:
+            self._catalog_touches[(relic_type, relic_name)] = removed
+
+    def get_binary_obj(self, path: StoragePath) -> BytesIO:
+        queued = self._queued(path)
+        if queued is None:
+            return self.storage.get_binary_obj(path)
+
+        kind, _, payload, _ = queued
+        if kind == "binary":
+            return BytesIO(payload)
+
+        return BytesIO(self.get_text(path).encode("utf-8"))
+
+    def get_text(self, path: StoragePath) -> str:
+        queued = self._queued(path)
+        if queued is not None:
+            kind, _, payload, _ = queued
+            if kind == "text":
+                return payload
+            if kind == "binary":
+                return payload.decode("utf-8")
+            return json.dumps(payload)
+
+        with self._cond:
+            updates = list(self._manifest_updates.get(tuple(path), (None, []))[1])
+        if not updates:
+            return self.storage.get_text(path)
+
+        try:
+            manifest = json.loads(self.storage.get_text(path))
+        except StorageItemDoesNotExist:
+            manifest = None
+        for update in updates:
+            manifest = update(manifest)
+
+        return json.dumps(manifest)
+
+    def get_tags(self, path: StoragePath) -> Dict:
+        queued = self._queued(path)
+        if queued is not None and queued[0] == "tags":
+            return copy.deepcopy(queued[2])
+
+        return self.storage.get_tags(path)
+
+    def exists(self, path: StoragePath) -> bool:
+        with self._cond:
+            if tuple(path) in self._manifest_updates:
+                return True
+
+        return self._queued(path) is not None or self.storage.exists(path)
+
+    def remove_obj(self, path: StoragePath) -> None:
+        self._wait_idle()
+        self.storage.remove_obj(path)
+
+    def remove_metadata(self, path: StoragePath):
+        self._wait_idle()
+        self.storage.remove_metadata(path)
+
+    def remove_relic(self, path: StoragePath) -> None:
+        self._wait_idle()
+        self._apply_deferred()
+        self.storage.remove_relic(path)
+
+    def remove_many(self, paths: List[StoragePath]) -> List:
+        self._wait_idle()
+        return self.storage.remove_many(paths)
+
+
 def get_storage_by_name(name: str, root: str = os.path.expanduser("~")) -> Storage:
     reliquery_dir = os.path.join(root, "reliquery")
     config = settings.get_config(reliquery_dir)
@@ -1281,6 +3076,20 @@ def get_all_available_storages(root: str = os.path.expanduser("~")) -> List[Stor
 
 
 def get_storage(name: str, root: str, config: Dict) -> Storage:
+    storage = _get_backend_storage(name, root, config)
+
+    if "cache" in config:
+        cache_args = dict(config["cache"])
+        cache_args.setdefault("root", os.path.join(root, "_cache", name))
+        storage = CachedStorage(storage, **cache_args)
+
+    if "memory_cache" in config:
+        storage = MemoryCachedStorage(storage, **config["memory_cache"])
+
+    return storage
+
+
+def _get_backend_storage(name: str, root: str, config: Dict) -> Storage:
     if config["storage"]["type"] == "S3":
         if not s3_supported:
             raise MissingDepsException("Please pip install reliquery[S3]")
@@ -0,0 +1,116 @@
+import asyncio
+import gc
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from ..aio import AsyncRelic, AsyncStorage, S3AsyncStorage
+from ..storage import FileStorage, S3Storage, StorageItemDoesNotExist
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def test_storage(tmp_path):
+    return FileStorage(str(tmp_path), "test-aio")
+
+
+def test_async_relic_reads_and_writes(test_storage):
+    async def scenario():
+        relic = await AsyncRelic.open("test", "test", storage=test_storage)
+        await asyncio.gather(
+            *[relic.aadd_text(f"text{i}", f"content {i}") for i in range(20)]
+        )
+        await relic.aadd_array("ones", np.ones((2, 2)))
+        await relic.aadd_json("params", {"lr": 0.1})
+
+        texts = await asyncio.gather(*[relic.aget_text(f"text{i}") for i in range(20)])
+        return (
+            texts,
+            await relic.aget_array("ones"),
+            await relic.aget_json("params"),
+            await relic.alist_text(),
+            await relic.adescribe(),
+        )
+
+    texts, array, params, listed, described = run(scenario())
+
+    assert texts == [f"content {i}" for i in range(20)]
+    np.testing.assert_array_equal(array, np.ones((2, 2)))
+    assert params == {"lr": 0.1}
+    assert sorted(listed) == sorted(f"text{i}" for i in range(20))
+    assert len(described["test"]["text"]) == 20
+
+
+def test_async_storage_raises_missing_items(test_storage):
+    with pytest.raises(StorageItemDoesNotExist):
+        run(AsyncStorage(test_storage).aget_text(["test", "test", "missing"]))
+
+
+def test_async_storage_bounds_requests_in_flight(test_storage):
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def get_text(path):
+        with lock:
+            running.append(path)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(path)
+        return path[-1]
+
+    test_storage.get_text = get_text
+    storage = AsyncStorage(test_storage, max_concurrency=3)
+
+    async def scenario():
+        return await asyncio.gather(
+            *[storage.aget_text(["a", "b", str(i)]) for i in range(30)]
+        )
+
+    assert run(scenario()) == [str(i) for i in range(30)]
+    assert 1 < max(peak) <= 3
+
+
+def test_s3_async_storage_closes_the_client_of_a_collected_loop():
+    storage = S3AsyncStorage(S3Storage("bucket", "rel", "s3"))
+    contexts = []
+
+    async def open_client():
+        closed = []
+
+        async def aexit(*args):
+            closed.append(args)
+
+        contexts.append(closed)
+        return mock.Mock(__aexit__=aexit), mock.Mock()
+
+    storage._open_client = open_client
+
+    async def scenario():
+        return await storage._client() is await storage._client()
+
+    assert run(scenario())
+    assert len(contexts) == 1
+
+    gc.collect()
+    assert len(storage._clients) == 0
+    assert len(contexts[0]) == 1
+
+    async def closed():
+        await storage._client()
+        await storage.aclose()
+
+    run(closed())
+    gc.collect()
+    assert len(contexts[1]) == 1
@@ -1,7 +1,16 @@
 import pytest
 import os
+import threading
 from .. import Relic
-from ..storage import FileStorage
+from ..storage import FileStorage, StorageItemDoesNotExist
+from ..metadata import (
+    Metadata,
+    MetadataDB,
+    RelicData,
+    RelicTag,
+    to_epoch_us,
+    typed_tag_value,
+)
 from unittest.mock import patch
 import datetime as dt
 
@@ -75,6 +84,7 @@ def test_metadata_when_adding_html(test_storage):
 @patch("reliquery.storage.S3Storage")
 def test_relic_s3_storage_syncs_on_init(storage):
     storage().put_text.return_value = "exists"
+    storage().get_text.side_effect = StorageItemDoesNotExist
     storage().get_metadata.return_value = {
         "test": {
             "arrays": [
@@ -155,3 +165,216 @@ def test_no_array_metadata_when_removing_arrays(test_storage):
 
     rq.remove_array("test-array")
     assert len(rq.describe()["test"]["arrays"]) == 0
+
+
+def test_metadata_db_rebuilds_tables_on_schema_change(tmp_path):
+    db_path = str(tmp_path.joinpath("metadata.db"))
+
+    db = MetadataDB(db_path)
+    db.sync_relic_data(RelicData("test", "test", "tests"))
+    db.conn.close()
+
+    assert len(MetadataDB(db_path).get_all_relic_names()) == 1
+
+    with patch.object(MetadataDB, "schema_version", MetadataDB.schema_version + 1):
+        db = MetadataDB(db_path)
+
+    assert len(db.get_all_relic_names()) == 0
+
+
+def test_metadata_db_upserts_relics_tags_and_metadata():
+    db = MetadataDB()
+
+    relic = db.sync_relic_data(RelicData("test", "test", "tests"))
+    assert db.sync_relic_data(RelicData("test", "test", "tests")).id == relic.id
+    assert len(db.get_all_relic_names()) == 1
+
+    db.add_relic_tag(RelicTag(relic, {"color": "red"}))
+    db.add_relic_tag(RelicTag(relic, {"color": "red"}))
+    assert len(db.get_all_tags_from_relic(relic)) == 1
+
+    db.add_metadata(Metadata("array", "arrays", relic, size=1.0))
+    db.add_metadata(Metadata("array", "arrays", relic, size=2.0))
+    assert db.query("SELECT size FROM metadata") == [(2.0,)]
+
+
+def test_metadata_db_lookups_use_indexes():
+    db = MetadataDB()
+
+    plans = [
+        db.query(
+            "EXPLAIN QUERY PLAN SELECT * FROM relics "
+            "WHERE relic_name = 'a' AND relic_type = 'b' AND storage_name = 'c'"
+        ),
+        db.query(
+            "EXPLAIN QUERY PLAN SELECT * FROM relic_tags "
+            "WHERE key = 'a' AND value = 'b' AND relic_id = 1"
+        ),
+        db.query(
+            "EXPLAIN QUERY PLAN SELECT * FROM metadata "
+            "WHERE name = 'a' AND data_type = 'b' AND relic_id = 1"
+        ),
+    ]
+
+    for plan in plans:
+        assert "INDEX" in plan[0][-1]
+
+
+def test_metadata_db_bulk_sync():
+    db = MetadataDB()
+    relics = [RelicData(f"relic-{i}", "test", "tests") for i in range(20000)]
+
+    synced = db.bulk_sync_relics(relics)
+    assert [r.relic_name for r in synced] == [r.relic_name for r in relics]
+    assert len({r.id for r in synced}) == 20000
+    assert [r.id for r in db.bulk_sync_relics(relics[:10])] == [
+        r.id for r in synced[:10]
+    ]
+
+    db.bulk_sync_tags([RelicTag(r, {"index": str(i)}) for i, r in enumerate(synced)])
+    db.bulk_sync_tags([RelicTag(synced[0], {"tags": {"color": "red"}})])
+    assert len(db.get_relics_by_tag("index", "1")) == 1
+    assert len(db.get_relics_by_tag("index", "0")) == 0
+    assert len(db.get_relics_by_tag("color", "red")) == 1
+
+    other = db.bulk_sync_relics([RelicData("relic-0", "test", "other")])
+    assert db.remove_old_relic_data([r.id for r in synced[:100]], ["tests"]) == 19900
+    assert len(db.get_all_relic_names()) == 101
+    assert db.get_relic_data_by_id(other[0].id) is not None
+    assert db.query("SELECT COUNT(*) FROM relic_tags") == [(100,)]
+
+
+def test_get_all_metadata_streams_with_filters():
+    db = MetadataDB()
+    one, two = db.bulk_sync_relics(
+        [RelicData("one", "test", "tests"), RelicData("two", "other", "remote")]
+    )
+
+    for i in range(5):
+        db.add_metadata(Metadata(f"array-{i}", "arrays", one, size=float(i)))
+    db.add_metadata(Metadata("text", "text", one))
+    db.add_metadata(Metadata("text", "text", two))
+
+    metadata = list(db.get_all_metadata(batch_size=2))
+    assert len(metadata) == 7
+    assert {m.relic.relic_name for m in metadata} == {"one", "two"}
+    assert all(m.relic.id == one.id for m in metadata if m.relic.relic_name == "one")
+
+    assert len(list(db.get_all_metadata(storage="tests"))) == 6
+    assert len(list(db.get_all_metadata(relic_type="other"))) == 1
+    assert len(list(db.get_all_metadata(data_type="text"))) == 2
+    assert [
+        m.relic.relic_name
+        for m in db.get_all_metadata(storage="remote", data_type="text")
+    ] == ["two"]
+    assert list(db.get_all_metadata(storage="remote", data_type="arrays")) == []
+
+
+def test_typed_tag_values():
+    assert typed_tag_value(3) == (3.0, None)
+    assert typed_tag_value("0.5") == (0.5, None)
+    assert typed_tag_value(True) == (None, None)
+    assert typed_tag_value("nan") == (None, None)
+    assert typed_tag_value("red") == (None, None)
+    assert typed_tag_value("1970-01-02") == (None, 86400 * 10**6)
+    assert typed_tag_value("1970-01-01T00:00:01.5") == (None, 1500000)
+    assert typed_tag_value(
+        dt.datetime(1970, 1, 1, 1, tzinfo=dt.timezone(dt.timedelta(hours=1)))
+    ) == (None, 0)
+
+
+def test_file_metadata_db_reads_from_threads_during_sync(tmp_path):
+    db = MetadataDB(str(tmp_path.joinpath("metadata.db")))
+    db.bulk_sync_relics([RelicData(f"r{i}", "test", "stor") for i in range(100)])
+
+    errors = []
+    counts = []
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                with db.snapshot() as cur:
+                    first = cur.execute("SELECT COUNT(*) FROM relics").fetchone()[0]
+                    second = cur.execute("SELECT COUNT(*) FROM relics").fetchone()[0]
+                assert first == second
+                counts.append(first)
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+
+    for batch in range(1, 10):
+        db.bulk_sync_relics(
+            [RelicData(f"r{batch}-{i}", "test", "stor") for i in range(100)]
+        )
+
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
+    assert counts and all(count % 100 == 0 for count in counts)
+    assert db.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    db.close()
+
+
+def test_file_metadata_db_closes_connections_of_finished_threads(tmp_path):
+    db = MetadataDB(str(tmp_path.joinpath("metadata.db")))
+
+    def read():
+        db.conn.execute("SELECT COUNT(*) FROM relics").fetchone()
+
+    for _ in range(20):
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+
+    assert len(db._connections) == 1
+    db.close()
+
+
+def test_memory_metadata_db_is_shared_between_threads():
+    db = MetadataDB()
+
+    def write():
+        db.bulk_sync_relics([RelicData("threaded", "test", "stor")])
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join()
+
+    assert db.get_relic_data_by_name("threaded", "test", "stor") is not None
+
+
+def test_records_are_slotted_with_epoch_timestamps():
+    relic = RelicData("r", "test", "stor", last_modified="01/02/2021 03:04:05")
+    metadata = Metadata.parse_dict(
+        {"name": "a", "data_type": "text", "last_modified": "01/02/2021 03:04:05"},
+        relic,
+    )
+
+    for record in [relic, metadata, RelicTag(relic, {"k": "v"})]:
+        assert not hasattr(record, "__dict__")
+
+    expected = to_epoch_us(dt.datetime(2021, 1, 2, 3, 4, 5))
+    assert relic.last_modified == expected
+    assert metadata.last_modified == expected
+    assert metadata.get_dict()["last_modified"] == "01/02/2021 03:04:05"
+
+
+def test_sync_metadata_keeps_newest_timestamp():
+    db = MetadataDB()
+    relic = db.sync_relic_data(RelicData("r", "test", "stor"))
+
+    db.sync_metadata(Metadata("a", "text", relic, size=1, last_modified=2000))
+    db.sync_metadata(Metadata("a", "text", relic, size=2, last_modified=1000))
+    assert db.get_metadata_by_name("a", "text", relic).size == 1
+
+    db.sync_metadata(Metadata("a", "text", relic, size=3, last_modified=3000))
+    stored = db.get_metadata_by_name("a", "text", relic)
+    assert stored.size == 3
+    assert stored.last_modified == 3000
+    assert db.query("SELECT typeof(last_modified) FROM metadata") == [("integer",)]
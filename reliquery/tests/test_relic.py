@@ -1,7 +1,16 @@
 import pytest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
 from .. import Relic
-from ..storage import FileStorage
+from ..storage import (
+    FileStorage,
+    StorageItemDoesNotExist,
+    WriteBehindError,
+    WriteBehindStorage,
+)
 
 import numpy as np
 
@@ -12,9 +21,12 @@ def test_storage(tmp_path):
 
 
 def test_relic(test_storage):
-    Relic("test", "test", storage=test_storage)
+    Relic("test", "test", storage=test_storage, lazy=False)
     assert Relic.relic_exists("test", "test", storage=test_storage)
 
+    Relic("opened", "test", storage=test_storage)
+    assert not Relic.relic_exists("opened", "test", storage=test_storage)
+
 
 def test_array(test_storage):
     e = Relic("test", "test", storage=test_storage)
@@ -26,3 +38,210 @@ def test_array(test_storage):
     np.testing.assert_array_equal(e.get_array("test"), orig)
 
     assert Relic.relic_exists("test", "test", storage=test_storage)
+
+
+def test_describe_and_list_read_the_manifest(test_storage):
+    e = Relic("test", "test", storage=test_storage)
+    e.add_text("a", "first")
+    e.add_text("b", "second")
+    e.remove_text("a")
+
+    with patch.object(test_storage, "get_metadata") as get_metadata, patch.object(
+        test_storage, "list_keys"
+    ) as list_keys:
+        described = e.describe()
+        assert e.list_text() == ["b"]
+
+    assert get_metadata.call_count == 0
+    assert list_keys.call_count == 0
+    assert [m["name"] for m in described["test"]["text"]] == ["b"]
+
+
+def test_manifest_seeded_from_relic_written_without_one(test_storage):
+    e = Relic("test", "test", storage=test_storage)
+    e.add_text("a", "first")
+    test_storage.remove_obj(["test", "test", "manifest"])
+
+    assert e.list_text() == ["a"]
+
+    e.add_text("b", "second")
+    assert sorted(e.list_text()) == ["a", "b"]
+    assert test_storage.get_text(["test", "test", "manifest"])
+
+
+def test_concurrent_writers_keep_every_manifest_entry(test_storage):
+    e = Relic("test", "test", storage=test_storage)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: e.add_text(f"text{i}", "content"), range(32)))
+
+    assert sorted(e.list_text()) == sorted(f"text{i}" for i in range(32))
+
+
+def test_bulk_helpers_return_values_and_errors_by_name(test_storage):
+    e = Relic("test", "test", storage=test_storage)
+
+    assert e.add_texts({"a": "first", "b": "second"}) == {"a": None, "b": None}
+    e.add_jsons({"params": {"lr": 0.1}})
+    e.add_arrays({"ones": np.ones((2, 2)), "zeros": np.zeros(3)})
+    e.add_text("broken", "not json")
+    test_storage.put_text(["test", "test", "json", "broken"], "{")
+
+    texts = e.get_texts(["a", "b", "missing"])
+    jsons = e.get_jsons(["params", "broken"])
+    arrays = e.get_arrays(["ones", "zeros"])
+
+    assert texts["a"] == "first" and texts["b"] == "second"
+    assert isinstance(texts["missing"], StorageItemDoesNotExist)
+    assert jsons["params"] == {"lr": 0.1}
+    assert isinstance(jsons["broken"], ValueError)
+    np.testing.assert_array_equal(arrays["ones"], np.ones((2, 2)))
+    np.testing.assert_array_equal(arrays["zeros"], np.zeros(3))
+    assert sorted(e.list_text()) == ["a", "b", "broken"]
+    assert sorted(e.list_arrays()) == ["ones", "zeros"]
+
+
+def test_bulk_add_updates_the_manifest_once(test_storage):
+    e = Relic("test", "test", storage=test_storage)
+
+    with patch.object(
+        test_storage, "update_manifest", wraps=test_storage.update_manifest
+    ) as update_manifest:
+        e.add_texts({f"text{i}": "content" for i in range(10)})
+
+    manifest_updates = [
+        c for c in update_manifest.call_args_list if c[0][0] == e._manifest_path()
+    ]
+    assert len(manifest_updates) == 1
+    assert len(e.describe()["test"]["text"]) == 10
+
+
+def test_lazy_relic_is_created_on_first_write(test_storage):
+    with patch.object(test_storage, "exists", wraps=test_storage.exists) as exists:
+        e = Relic("lazy", "test", storage=test_storage, lazy=True)
+        assert exists.call_count == 0
+        assert not Relic.relic_exists("lazy", "test", storage=test_storage)
+
+        e.add_text("a", "first")
+        e.add_text("b", "second")
+
+    # One check from relic_exists, one before the first write only
+    assert exists.call_count == 2
+    assert Relic.relic_exists("lazy", "test", storage=test_storage)
+
+
+def test_batch_coalesces_writes_and_manifest_updates(test_storage):
+    e = Relic("test", "test", storage=test_storage)
+
+    with patch.object(
+        test_storage, "update_manifest", wraps=test_storage.update_manifest
+    ) as update_manifest:
+        with e.batch():
+            for i in range(20):
+                e.add_text("loss", f"{i}")
+                e.add_text(f"step{i}", "done")
+            assert e.get_text("loss") == "19"
+            assert "step3" in e.list_text()
+
+    manifest_updates = [
+        c for c in update_manifest.call_args_list if c[0][0] == e._manifest_path()
+    ]
+    assert len(manifest_updates) == 1
+    assert test_storage.get_text(["test", "test", "text", "loss"]) == "19"
+    assert len(Relic("test", "test", storage=test_storage).list_text()) == 21
+
+
+def test_write_behind_raises_deferred_errors_on_flush(test_storage):
+    e = Relic("test", "test", storage=test_storage, write_behind=True)
+    put_text = test_storage.put_text
+
+    def failing_put_text(path, text):
+        if path[-1] == "bad":
+            raise IOError("disk full")
+        put_text(path, text)
+
+    with patch.object(test_storage, "put_text", side_effect=failing_put_text):
+        e.add_text("good", "kept")
+        e.add_text("bad", "lost")
+        with pytest.raises(WriteBehindError) as error:
+            e.flush()
+
+    assert [path[-1] for path, _ in error.value.errors] == ["bad"]
+    assert test_storage.get_text(["test", "test", "text", "good"]) == "kept"
+    e.flush()
+
+
+def test_write_behind_applies_backpressure(test_storage):
+    lock = threading.Lock()
+    queued = []
+
+    storage = WriteBehindStorage(test_storage, workers=4, max_pending=3)
+    put_text = test_storage.put_text
+
+    def slow_put_text(path, text):
+        time.sleep(0.005)
+        put_text(path, text)
+
+    with patch.object(test_storage, "put_text", side_effect=slow_put_text):
+        for i in range(30):
+            storage.put_text(["t", "r", "text", str(i)], "x")
+            with lock:
+                queued.append(len(storage._pending) + len(storage._inflight))
+        storage.close()
+
+    assert max(queued) <= 3
+    assert len(test_storage.list_keys(["t", "r", "text"])) == 30
+
+
+def test_write_behind_never_writes_one_key_concurrently(test_storage):
+    storage = WriteBehindStorage(test_storage, workers=4)
+    path = ["t", "r", "text", "loss"]
+    first_written = threading.Event()
+    resume = threading.Event()
+    paused = threading.Event()
+    lock = threading.Lock()
+    writing = []
+    overlaps = []
+    put_text = test_storage.put_text
+
+    class PausingCondition(type(storage._cond)):
+        drain_thread = None
+
+        def __exit__(self, *exc):
+            result = super().__exit__(*exc)
+            # Hold the first drain right after it marked its write done
+            if threading.current_thread() is self.drain_thread:
+                self.drain_thread = None
+                paused.set()
+                resume.wait(5)
+            return result
+
+    storage._cond = PausingCondition()
+
+    def tracked_put_text(p, text):
+        with lock:
+            if writing:
+                overlaps.append(text)
+            writing.append(text)
+        if text == "A":
+            storage._cond.drain_thread = threading.current_thread()
+            first_written.set()
+        else:
+            time.sleep(0.05)
+        put_text(p, text)
+        with lock:
+            writing.remove(text)
+
+    with patch.object(test_storage, "put_text", side_effect=tracked_put_text):
+        storage.put_text(path, "A")
+        assert paused.wait(5)
+        storage.put_text(path, "B")
+        time.sleep(0.01)
+        storage.put_text(path, "C")
+        resume.set()
+        storage.close()
+
+    assert first_written.is_set()
+    assert overlaps == []
+    assert test_storage.get_text(path) == "C"
+    assert storage._bytes == 0
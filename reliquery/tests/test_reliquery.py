@@ -1,8 +1,13 @@
 import os
+import datetime as dt
+import sqlite3
+import threading
 import pytest
+from unittest.mock import patch
 from reliquery.relic import Relic
 from ..storage import FileStorage
 from .. import Reliquery
+from ..metadata import MetadataDB
 from .test_util import init_reliquery_test_data
 
 
@@ -25,6 +30,12 @@ def test_query_relics_by_tag(tmp_path):
     r = rel.get_relics_by_tag("go-no-go", "go")
     assert len(r) == 1
 
+    with patch.object(FileStorage, "exists") as exists, patch.object(
+        FileStorage, "get_text"
+    ) as get_text:
+        r = rel.get_relics_by_tag("go-no-go", "go")
+    assert exists.call_count == 0 and get_text.call_count == 0
+
     rq = r[0]
 
     assert isinstance(rq.storage, FileStorage)
@@ -41,7 +52,7 @@ def test_remove_relic_given_relic(tmp_path):
     # test storage & relic
     storage = FileStorage(tmp_path.joinpath("three"), "stor3")
     storages.append(storage)
-    relic = Relic(name="test3", relic_type="test", storage=storage)
+    relic = Relic(name="test3", relic_type="test", storage=storage, lazy=False)
 
     rel = Reliquery(storages=storages)
     assert len(rel.get_relic_names()) == 3
@@ -60,7 +71,7 @@ def test_relic_removed_after_syncing_reliquery(tmp_path):
     # test storage & relic
     storage = FileStorage(tmp_path.joinpath("three"), "stor3")
     storages.append(storage)
-    relic = Relic(name="test3", relic_type="test", storage=storage)
+    relic = Relic(name="test3", relic_type="test", storage=storage, lazy=False)
 
     rel = Reliquery(storages=storages)
     rel2 = Reliquery(storages=storages)
@@ -73,3 +84,401 @@ def test_relic_removed_after_syncing_reliquery(tmp_path):
 
     rel2.sync_reliquery()
     assert len(rel2.get_relic_names()) == 2
+
+
+def test_removed_relic_leaves_the_catalog(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+    rel = Reliquery(storages=storages)
+
+    rel.remove_relic(Relic("test1", "test", storage=storages[0]))
+
+    assert storages[0].get_all_relic_data() == []
+    assert rel.get_relic_names() == [
+        {"storage": "stor2", "type": "test", "name": "test2"}
+    ]
+
+
+def test_search_relic_content(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+    relic = Relic("test1", "test", storage=storages[0])
+    relic.add_html_string(
+        "page", "<html><style>.x {}</style><p>Gradient descent notes</p></html>"
+    )
+    relic.add_json("params", {"optimizer": "adam"})
+
+    rel = Reliquery(storages=storages, index_content=True)
+
+    results = rel.search("first relic")
+    assert len(results) == 1
+    assert results[0]["name"] == "test1"
+    assert results[0]["storage"] == "stor1"
+    assert results[0]["data_type"] == "text"
+    assert results[0]["artifact"] == "rq1"
+
+    results = rel.search("gradient")
+    assert len(results) == 1
+    assert results[0]["data_type"] == "html"
+    assert len(rel.search("style")) == 0
+
+    assert rel.search("adam")[0]["artifact"] == "params"
+    assert len(rel.search("relic")) == 2
+
+
+def test_search_reindexes_only_changed_content(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+
+    rel = Reliquery(storages=storages, index_content=True)
+    assert len(rel.search("second")) == 1
+
+    relic = Relic("test2", "test", storage=storages[1])
+    relic.add_text("rq2", "replaced content")
+    relic.add_text("rq3", "another note")
+
+    with patch.object(
+        rel.metadata_db, "index_content", wraps=rel.metadata_db.index_content
+    ) as index_content:
+        rel.sync_reliquery()
+
+    assert index_content.call_count == 2
+    assert len(rel.search("second")) == 0
+    assert len(rel.search("replaced")) == 1
+
+    relic.remove_text("rq3")
+    rel.sync_reliquery()
+    assert len(rel.search("another")) == 0
+
+
+def test_search_reads_only_changed_content(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+
+    rel = Reliquery(storages=storages, index_content=True)
+
+    relic = Relic("test2", "test", storage=storages[1])
+    relic.add_text("rq3", "another note")
+
+    with patch.object(
+        FileStorage, "get_text", autospec=True, side_effect=FileStorage.get_text
+    ) as get_text:
+        rel.sync_reliquery()
+
+    paths = [call[0][1] for call in get_text.call_args_list]
+    assert ["test", "test2", "text", "rq2"] not in paths
+    assert ["test", "test2", "text", "rq3"] in paths
+    assert len(rel.search("another")) == 1
+
+
+def test_search_skips_relics_that_fail_to_index(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+
+    with patch.object(
+        FileStorage, "list_keys", side_effect=OSError("offline")
+    ), patch.object(Relic, "_read_manifest", return_value=None):
+        rel = Reliquery(storages=storages, index_content=True)
+    assert rel.search("first") == []
+
+    rel.sync_reliquery()
+    assert len(rel.search("first")) == 1
+
+
+def test_search_without_content_index(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+
+    rel = Reliquery(storages=storages)
+
+    assert rel.search("first") == []
+
+
+def test_persistent_metadata_db_reconciles_changes(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+    db_path = str(tmp_path.joinpath("cache", "metadata.db"))
+
+    rel = Reliquery(storages=storages, db_path=db_path)
+    assert len(rel.get_relic_names()) == 2
+    rel.metadata_db.conn.close()
+
+    relic = Relic("test1", "test", storage=storages[0])
+    relic.add_tag({"go-no-go": "no-go"})
+    Relic("test3", "test", storage=storages[1], lazy=False)
+
+    cached = MetadataDB(db_path)
+    assert len(cached.get_all_relic_names()) == 2
+    cached.conn.close()
+
+    rel = Reliquery(storages=storages, db_path=db_path)
+    assert len(rel.get_relic_names()) == 3
+    assert len(rel.get_relics_by_tag("go-no-go", "go")) == 0
+    assert len(rel.get_relics_by_tag("go-no-go", "no-go")) == 2
+
+
+def test_persistent_metadata_db_keeps_relics_of_other_storages(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+    db_path = str(tmp_path.joinpath("metadata.db"))
+
+    Reliquery(storages=storages, db_path=db_path).metadata_db.conn.close()
+    rel = Reliquery(storages=storages[:1], db_path=db_path)
+
+    assert len(rel.get_relic_names()) == 2
+
+
+def test_persistent_metadata_db_reindexes_when_options_change(tmp_path):
+    storage = FileStorage(str(tmp_path.joinpath("stor")), "stor")
+    Relic("notes", "test", storage=storage).add_text("note", "gradient descent")
+    db_path = str(tmp_path.joinpath("metadata.db"))
+
+    rel = Reliquery(storages=[storage], db_path=db_path)
+    assert list(rel.metadata_db.get_all_metadata(data_type="text")) == []
+    rel.metadata_db.close()
+
+    rel = Reliquery(storages=[storage], db_path=db_path, index_metadata=True)
+    assert [m.name for m in rel.metadata_db.get_all_metadata(data_type="text")] == [
+        "note"
+    ]
+    rel.metadata_db.close()
+
+    rel = Reliquery(storages=[storage], db_path=db_path)
+    assert list(rel.metadata_db.get_all_metadata(data_type="text")) == []
+    rel.metadata_db.close()
+
+
+def test_sync_only_reads_relics_with_moved_markers(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+
+    rel = Reliquery(storages=storages)
+
+    relic = Relic("test2", "test", storage=storages[1])
+    relic.add_tag({"go-no-go": "go"})
+
+    with patch.object(
+        storages[0], "get_tags", wraps=storages[0].get_tags
+    ) as unchanged, patch.object(
+        storages[1], "get_tags", wraps=storages[1].get_tags
+    ) as changed:
+        rel.sync_reliquery()
+
+    assert unchanged.call_count == 0
+    assert changed.call_count == 1
+    assert len(rel.get_relics_by_tag("go-no-go", "go")) == 2
+
+
+def test_sync_indexes_artifact_metadata(tmp_path):
+    storage = FileStorage(tmp_path, "stor")
+    relic = Relic("meta", "test", storage=storage)
+    relic.add_text("notes", "some notes")
+    relic.add_json("params", {"lr": 0.1})
+
+    rel = Reliquery(storages=[storage], index_metadata=True)
+    texts = list(rel.metadata_db.get_all_metadata(data_type="text"))
+    assert [m.name for m in texts] == ["notes"]
+    assert texts[0].relic.relic_name == "meta"
+
+    relic.remove_text("notes")
+    relic.add_text("summary", "a summary")
+    rel.sync_reliquery()
+
+    texts = list(rel.metadata_db.get_all_metadata(data_type="text"))
+    assert [m.name for m in texts] == ["summary"]
+    assert len(list(rel.metadata_db.get_all_metadata(data_type="json"))) == 1
+
+
+def test_sync_retries_relics_that_fail_to_read(tmp_path):
+    storage = FileStorage(tmp_path, "stor")
+    Relic("broken", "test", storage=storage).add_tag({"state": "ok"})
+
+    with patch.object(storage, "get_tags", side_effect=OSError("unavailable")):
+        rel = Reliquery(storages=[storage])
+    assert len(rel.get_relics_by_tag("state", "ok")) == 0
+
+    rel.sync_reliquery()
+    assert len(rel.get_relics_by_tag("state", "ok")) == 1
+
+
+def test_sync_reads_storages_that_are_not_thread_safe_on_one_thread(tmp_path):
+    storage = FileStorage(tmp_path, "stor")
+    storage.thread_safe = False
+    for i in range(4):
+        Relic(f"r{i}", "test", storage=storage).add_tag({"i": str(i)})
+
+    threads = set()
+    get_tags = storage.get_tags
+
+    def record_thread(path):
+        threads.add(threading.get_ident())
+        return get_tags(path)
+
+    with patch.object(storage, "get_tags", side_effect=record_thread):
+        rel = Reliquery(storages=[storage])
+
+    assert threads == {threading.get_ident()}
+    assert len(rel.get_relics_by_tag("i", "2")) == 1
+
+
+def test_query_relics_by_multiple_tags(tmp_path):
+    storage = FileStorage(tmp_path, "stor")
+    tags = [
+        {"model": "resnet", "stage": "train", "status": "ok"},
+        {"model": "resnet", "stage": "eval", "status": "ok"},
+        {"model": "resnet", "stage": "eval", "status": "failed"},
+        {"model": "vit", "stage": "eval", "status": "ok"},
+    ]
+    for i, tag in enumerate(tags):
+        Relic(f"relic{i}", "test", storage=storage).add_tag(tag)
+
+    rel = Reliquery(storages=[storage])
+
+    def names(**kwargs):
+        return sorted(
+            relic.name for page in rel.get_relics_by_tags(**kwargs) for relic in page
+        )
+
+    assert names(all={"model": "resnet", "stage": "eval"}) == ["relic1", "relic2"]
+    assert names(any={"model": "vit", "stage": "train"}) == ["relic0", "relic3"]
+    assert names(all={"stage": "eval"}, none={"status": "failed"}) == [
+        "relic1",
+        "relic3",
+    ]
+    assert names(
+        all={"model": "resnet"}, any={"stage": "train", "status": "failed"}
+    ) == ["relic0", "relic2"]
+    assert names(all={"model": "resnet", "stage": "missing"}) == []
+    assert names(any={"model": ["vit", "resnet"]}, none={"stage": "eval"}) == ["relic0"]
+    assert names(none={"status": ["ok", "failed"]}) == []
+    assert names(all={"model": ["vit", "resnet"], "stage": "eval"}) == [
+        "relic1",
+        "relic2",
+        "relic3",
+    ]
+    assert names(all={"model": [], "stage": "eval"}) == []
+
+    pages = list(rel.get_relics_by_tags(all={"status": "ok"}, page_size=2))
+    assert [len(page) for page in pages] == [2, 1]
+    assert {relic.name for page in pages for relic in page} == {
+        "relic0",
+        "relic1",
+        "relic3",
+    }
+
+
+def test_query_relics_by_tag_range(tmp_path):
+    storage = FileStorage(tmp_path, "stor")
+    accuracies = [0.71, 0.93, "0.95", 0.88, "n/a"]
+    for i, accuracy in enumerate(accuracies):
+        Relic(f"relic{i}", "test", storage=storage).add_tag(
+            {"accuracy": accuracy, "date": f"2021-0{i + 1}-15"}
+        )
+
+    rel = Reliquery(storages=[storage])
+
+    relics = rel.get_relics_by_tag_range("accuracy", lo=0.9)
+    assert [r.name for r in relics] == ["relic1", "relic2"]
+
+    relics = rel.get_relics_by_tag_range("accuracy", lo=0.8, hi=0.93)
+    assert [r.name for r in relics] == ["relic3", "relic1"]
+
+    relics = rel.get_relics_by_tag_range("accuracy", limit=2, descending=True)
+    assert [r.name for r in relics] == ["relic2", "relic1"]
+
+    relics = rel.get_relics_by_tag_range(
+        "date", lo=dt.datetime(2021, 2, 1), hi=dt.datetime(2021, 4, 1)
+    )
+    assert [r.name for r in relics] == ["relic1", "relic2"]
+
+    relics = rel.get_relics_by_tag_range("date", limit=1, descending=True)
+    assert [r.name for r in relics] == ["relic4"]
+
+    relics = rel.get_relics_by_tag_range("date", lo="2021-02-01", hi="2021-04-01")
+    assert [r.name for r in relics] == ["relic1", "relic2"]
+
+    relics = rel.get_relics_by_tag_range(
+        "date", lo=dt.date(2021, 2, 1), hi=dt.date(2021, 4, 1)
+    )
+    assert [r.name for r in relics] == ["relic1", "relic2"]
+
+    relics = rel.get_relics_by_tag_range("accuracy", lo="0.9")
+    assert [r.name for r in relics] == ["relic1", "relic2"]
+
+    with pytest.raises(ValueError):
+        rel.get_relics_by_tag_range("date", lo=0.9, hi=dt.date(2021, 4, 1))
+
+
+def test_iter_query_streams_bound_rows(tmp_path):
+    storages = init_reliquery_test_data(tmp_path)
+    rel = Reliquery(storages=storages)
+
+    rows = rel.iter_query(
+        "SELECT relic_name FROM relics WHERE storage_name = ?", ("stor1",), 1
+    )
+    assert next(rows) == ("test1",)
+    assert list(rows) == []
+
+    with pytest.raises(sqlite3.OperationalError):
+        list(rel.iter_query("SELECT * FROM missing_table"))
+
+
+def test_query_page_keyset_pagination(tmp_path):
+    storage = FileStorage(tmp_path, "stor")
+    for i in range(5):
+        Relic(f"relic{i}", "test", storage=storage, lazy=False)
+    rel = Reliquery(storages=[storage])
+
+    names = []
+    after = None
+    while True:
+        rows, after = rel.query_page(
+            "SELECT id, relic_name FROM relics WHERE relic_type = ?",
+            ("test",),
+            after=after,
+            limit=2,
+        )
+        names.extend(row[1] for row in rows)
+        if after is None:
+            break
+
+    assert sorted(names) == [f"relic{i}" for i in range(5)]
+    assert len(names) == 5
+
+    with pytest.raises(ValueError):
+        rel.query_page("SELECT id FROM relics", key="id; DROP TABLE relics")
+
+
+def test_usage_rollups_follow_stored_bytes(tmp_path):
+    storage = FileStorage(tmp_path, "stor")
+    first = Relic("first", "model", storage=storage)
+    first.add_text("notes", "12345")
+    first.add_json("params", {"a": 1})
+    Relic("second", "data", storage=storage).add_text("notes", "123")
+
+    rel = Reliquery(storages=[storage], index_metadata=True)
+
+    assert rel.usage() == [{"storage": "stor", "artifacts": 3, "bytes": 16.0}]
+    assert rel.usage(["relic_type", "data_type"]) == [
+        {"relic_type": "model", "data_type": "json", "artifacts": 1, "bytes": 8.0},
+        {"relic_type": "model", "data_type": "text", "artifacts": 1, "bytes": 5.0},
+        {"relic_type": "data", "data_type": "text", "artifacts": 1, "bytes": 3.0},
+    ]
+
+    first.remove_json("params")
+    first.add_text("notes", "1234567890")
+    rel.sync_reliquery()
+
+    assert rel.usage("relic") == [
+        {
+            "storage": "stor",
+            "relic_type": "model",
+            "relic_name": "first",
+            "artifacts": 1,
+            "bytes": 10.0,
+        },
+        {
+            "storage": "stor",
+            "relic_type": "data",
+            "relic_name": "second",
+            "artifacts": 1,
+            "bytes": 3.0,
+        },
+    ]
+
+    rel.remove_relic(first)
+    assert rel.usage() == [{"storage": "stor", "artifacts": 1, "bytes": 3.0}]
+
+    with pytest.raises(ValueError):
+        rel.usage("owner")
@@ -1,10 +1,18 @@
+import io
 import json
 import os
+import socket
+import subprocess
+import sys
+import threading
+import time
 
+import numpy as np
 import pytest
 from unittest import mock
 from unittest.mock import Mock
 
+from reliquery import Relic
 from reliquery.storage import (
     S3Storage,
     get_storage_by_name,
@@ -12,6 +20,9 @@ from reliquery.storage import (
     get_all_available_storages,
     DropboxStorage,
     GoogleDriveStorage,
+    StorageItemDoesNotExist,
+    CachedStorage,
+    MemoryCachedStorage,
 )
 
 raw_config = """
@@ -271,3 +282,597 @@ def test_find_deepest_folder_with_list_items_in_folder(_list_items_in_folder):
     ]
     deepest_id = google._find_deepest_folder_id("relics", ["test", "google_test"])
     assert deepest_id == 2
+
+
+def test_s3_relic_data_from_single_listing():
+    storage = S3Storage("bucket", "rel", "s3")
+    storage.s3 = Mock()
+    storage.s3.list_objects_v2.side_effect = [
+        {
+            "IsTruncated": True,
+            "NextContinuationToken": "next",
+            "Contents": [
+                {"Key": "rel/test/one/exists", "ETag": "a"},
+                {"Key": "rel/test/one/tags", "ETag": "b"},
+            ],
+        },
+        {
+            "IsTruncated": False,
+            "Contents": [{"Key": "rel/other/two/exists", "ETag": "c"}],
+        },
+    ]
+
+    relic_data = sorted(storage._crawl_relic_data(), key=lambda d: d["relic_name"])
+
+    assert storage.s3.list_objects_v2.call_count == 2
+    assert [(d["relic_type"], d["relic_name"]) for d in relic_data] == [
+        ("test", "one"),
+        ("other", "two"),
+    ]
+    assert all(d["storage_name"] == "s3" for d in relic_data)
+
+    storage.s3.list_objects_v2.side_effect = [
+        {
+            "IsTruncated": False,
+            "Contents": [
+                {"Key": "rel/test/one/exists", "ETag": "a"},
+                {"Key": "rel/test/one/tags", "ETag": "changed"},
+                {"Key": "rel/other/two/exists", "ETag": "c"},
+            ],
+        },
+    ]
+    markers = {d["relic_name"]: d["marker"] for d in storage._crawl_relic_data()}
+
+    assert markers["one"] != relic_data[0]["marker"]
+    assert markers["two"] == relic_data[1]["marker"]
+
+
+def test_file_storage_marker_moves_when_relic_changes(tmpdir):
+    storage = FileStorage(str(tmpdir), "file")
+    storage.put_text(["test", "one", "exists"], "exists")
+    storage.put_text(["test", "two", "exists"], "exists")
+
+    before = {d["relic_name"]: d["marker"] for d in storage._crawl_relic_data()}
+    storage.put_text(["test", "one", "text", "note"], "note")
+    after = {d["relic_name"]: d["marker"] for d in storage._crawl_relic_data()}
+
+    assert before["one"] != after["one"]
+    assert before["two"] == after["two"]
+
+
+@pytest.mark.parametrize("write_mode", ["fast", "atomic"])
+def test_file_storage_marker_moves_when_an_artifact_is_rewritten(tmpdir, write_mode):
+    storage = FileStorage(str(tmpdir), "file", write_mode=write_mode)
+    storage.put_text(["test", "one", "text", "note"], "note")
+
+    before = storage._crawl_relic_data()[0]["marker"]
+    time.sleep(0.05)
+    storage.put_text(["test", "one", "text", "note"], "rewritten")
+
+    assert storage._crawl_relic_data()[0]["marker"] != before
+
+
+def test_s3_manifest_update_retries_on_etag_conflict():
+    from botocore.exceptions import ClientError
+
+    storage = S3Storage("bucket", "rel", "s3")
+    storage.s3 = Mock()
+    storage.s3.get_object.side_effect = [
+        {"Body": io.BytesIO(b'{"count": 1}'), "ETag": "v1"},
+        {"Body": io.BytesIO(b'{"count": 2}'), "ETag": "v2"},
+    ]
+    storage.s3.put_object.side_effect = [
+        ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject"),
+        {},
+    ]
+
+    manifest = storage.update_manifest(
+        ["test", "one", "manifest"], lambda m: {"count": m["count"] + 1}
+    )
+
+    assert manifest == {"count": 3}
+    calls = storage.s3.put_object.call_args_list
+    assert [c[1]["IfMatch"] for c in calls] == ["v1", "v2"]
+    assert json.loads(calls[-1][1]["Body"]) == {"count": 3}
+
+
+def test_s3_manifest_update_without_conditional_writes_is_unconditional():
+    storage = S3Storage("bucket", "rel", "s3")
+    storage.conditional_writes = False
+    storage.s3 = Mock()
+    storage.s3.get_object.return_value = {
+        "Body": io.BytesIO(b'{"count": 1}'),
+        "ETag": "v1",
+    }
+
+    manifest = storage.update_manifest(
+        ["test", "one", "manifest"], lambda m: {"count": m["count"] + 1}
+    )
+
+    assert manifest == {"count": 2}
+    assert "IfMatch" not in storage.s3.put_object.call_args[1]
+
+
+def test_file_storage_breaks_locks_of_dead_writers_only(tmpdir):
+    storage = FileStorage(str(tmpdir), "test")
+    path = ["test", "one", "manifest"]
+    lock_path = os.path.join(str(tmpdir), "test", "one", "manifest.lock")
+    os.makedirs(os.path.dirname(lock_path))
+
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    with open(lock_path, "w") as f:
+        f.write(f"{socket.gethostname()} {dead.pid}")
+    assert storage.put_text_if_match(path, "{}", None)
+
+    # A live writer keeps its lock however old it is
+    with open(lock_path, "w") as f:
+        f.write(f"{socket.gethostname()} {os.getpid()}")
+    os.utime(lock_path, (0, 0))
+    assert not FileStorage._lock_is_stale(lock_path, 30.0)
+
+    with open(lock_path, "w") as f:
+        f.write("elsewhere 1")
+    assert not FileStorage._lock_is_stale(lock_path, 30.0)
+    os.utime(lock_path, (0, 0))
+    assert FileStorage._lock_is_stale(lock_path, 30.0)
+
+
+def test_s3_get_metadata_fetches_entries_concurrently():
+    storage = S3Storage("bucket", "rel", "s3")
+    storage.s3 = Mock()
+    storage.s3.list_objects_v2.side_effect = lambda Bucket, Prefix: {
+        "IsTruncated": False,
+        "Contents": [
+            {"Key": f"{Prefix}/{i}"} for i in range(10) if Prefix.endswith("text")
+        ],
+    }
+
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def get_object(Key, Bucket):
+        with lock:
+            running.append(Key)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(Key)
+        name = Key.split("/")[-1]
+        return {"Body": io.BytesIO(json.dumps({"name": name}).encode("utf-8"))}
+
+    storage.s3.get_object.side_effect = get_object
+
+    described = storage.get_metadata(["test", "one", "metadata"], "one")
+
+    assert [m["name"] for m in described["one"]["text"]] == [str(i) for i in range(10)]
+    assert described["one"]["arrays"] == []
+    assert max(peak) > 1
+
+
+def test_file_storage_discovery_reads_the_catalog(tmpdir):
+    storage = FileStorage(str(tmpdir), "file")
+    one = Relic("one", "test", storage=storage, lazy=False)
+    Relic("two", "test", storage=storage, lazy=False)
+    storage.get_all_relic_data()
+
+    with mock.patch.object(storage, "_crawl_relic_data") as crawl, mock.patch.object(
+        storage, "get_text", wraps=storage.get_text
+    ) as get_text:
+        before = {d["relic_name"]: d["marker"] for d in storage.get_all_relic_data()}
+        assert get_text.call_count == 1
+        one.add_text("note", "note")
+        one.add_tag({"state": "ok"})
+        after = {d["relic_name"]: d["marker"] for d in storage.get_all_relic_data()}
+
+    assert crawl.call_count == 0
+    assert sorted(before) == ["one", "two"]
+    assert before["one"] != after["one"]
+    assert before["two"] == after["two"]
+
+
+def test_creating_a_relic_never_crawls_the_storage(tmpdir):
+    storage = FileStorage(str(tmpdir), "file")
+    storage.put_text(["test", "untracked", "exists"], "exists")
+
+    with mock.patch.object(storage, "_crawl_relic_data") as crawl:
+        Relic("one", "test", storage=storage, lazy=False)
+    assert crawl.call_count == 0
+
+    # The first discovery crawls and completes the catalog
+    assert sorted(d["relic_name"] for d in storage.get_all_relic_data()) == [
+        "one",
+        "untracked",
+    ]
+    assert "partial" not in storage._read_catalog()
+
+
+def test_catalog_survives_update_conflicts(tmpdir):
+    storage = FileStorage(str(tmpdir), "file")
+    Relic("one", "test", storage=storage, lazy=False)
+    storage.get_all_relic_data()
+
+    with mock.patch.object(
+        storage, "put_text_if_match", return_value=False
+    ), mock.patch("reliquery.storage.time.sleep"):
+        Relic("two", "test", storage=storage, lazy=False)
+
+    assert list(storage._read_catalog()["relics"]["test"]) == ["one"]
+
+
+def test_file_storage_catalog_rebuild_finds_untracked_relics(tmpdir):
+    storage = FileStorage(str(tmpdir), "file")
+    Relic("one", "test", storage=storage, lazy=False)
+    storage.get_all_relic_data()
+    storage.put_text(["test", "untracked", "exists"], "exists")
+    storage.put_text(["_reserved", "name", "object"], "not a relic")
+
+    assert [d["relic_name"] for d in storage.get_all_relic_data()] == ["one"]
+
+    storage.rebuild_catalog()
+
+    assert sorted(d["relic_name"] for d in storage.get_all_relic_data()) == [
+        "one",
+        "untracked",
+    ]
+
+
+def test_file_storage_get_and_put_many_report_errors_per_item(tmpdir):
+    storage = FileStorage(str(tmpdir), "test")
+
+    errors = storage.put_many(
+        [(["a", "b", "text"], "hello"), (["a", "b", "bin"], b"\x00\x01")]
+    )
+    texts = storage.get_many([["a", "b", "text"], ["a", "b", "missing"]])
+    binaries = storage.get_many([["a", "b", "bin"]], binary=True)
+
+    assert errors == [None, None]
+    assert texts[0] == "hello"
+    assert isinstance(texts[1], StorageItemDoesNotExist)
+    assert binaries[0].read() == b"\x00\x01"
+
+
+def test_file_storage_put_metadata_many_reports_errors_per_item(tmpdir):
+    storage = FileStorage(str(tmpdir), "test")
+
+    errors = storage.put_metadata_many(
+        [
+            (["a", "b", "metadata", "text", "x"], {"name": "x"}),
+            (["a", "b", "metadata", "text", "y"], {"name": object()}),
+        ]
+    )
+
+    assert errors[0] is None
+    assert isinstance(errors[1], TypeError)
+    assert json.loads(storage.get_text(["a", "b", "metadata", "text", "x"])) == {
+        "name": "x"
+    }
+
+
+def test_s3_remove_many_batches_delete_requests():
+    storage = S3Storage("bucket", "rel", "s3")
+    storage.s3 = Mock()
+    storage.s3.delete_objects.return_value = {
+        "Errors": [{"Key": "rel/a/b/2", "Code": "AccessDenied", "Message": "no"}]
+    }
+
+    errors = storage.remove_many([["a", "b", str(i)] for i in range(1500)])
+
+    assert storage.s3.delete_objects.call_count == 2
+    assert [i for i, error in enumerate(errors) if error is not None] == [2]
+
+
+def test_cached_storage_serves_warm_reads_locally(tmpdir):
+    remote = FileStorage(os.path.join(tmpdir, "remote"), "remote")
+    storage = CachedStorage(remote, os.path.join(tmpdir, "cache"))
+    storage.put_text(["t", "r", "text", "a"], "hello")
+
+    with mock.patch.object(
+        remote, "get_binary_obj", wraps=remote.get_binary_obj
+    ) as get_binary_obj:
+        assert storage.get_text(["t", "r", "text", "a"]) == "hello"
+        assert storage.get_text(["t", "r", "text", "a"]) == "hello"
+
+    assert get_binary_obj.call_count == 1
+
+
+def test_cached_storage_revalidates_against_remote_version(tmpdir):
+    remote = FileStorage(os.path.join(tmpdir, "remote"), "remote")
+    storage = CachedStorage(remote, os.path.join(tmpdir, "cache"), max_age=0)
+    remote.put_text(["t", "r", "text", "a"], "first")
+    assert storage.get_text(["t", "r", "text", "a"]) == "first"
+
+    remote.put_text(["t", "r", "text", "a"], "second version")
+    assert storage.get_text(["t", "r", "text", "a"]) == "second version"
+
+    remote.remove_obj(["t", "r", "text", "a"])
+    with pytest.raises(StorageItemDoesNotExist):
+        storage.get_text(["t", "r", "text", "a"])
+
+
+def test_cached_storage_skips_validation_within_max_age_only(tmpdir):
+    remote = FileStorage(os.path.join(tmpdir, "remote"), "remote")
+    remote.put_text(["t", "r", "text", "a"], "first")
+    fresh = CachedStorage(remote, os.path.join(tmpdir, "fresh"))
+    aged = CachedStorage(remote, os.path.join(tmpdir, "aged"), max_age=60)
+    fresh.get_text(["t", "r", "text", "a"])
+    aged.get_text(["t", "r", "text", "a"])
+
+    remote.put_text(["t", "r", "text", "a"], "second")
+
+    assert fresh.get_text(["t", "r", "text", "a"]) == "second"
+    assert aged.get_text(["t", "r", "text", "a"]) == "first"
+
+
+def test_cached_storage_evicts_least_recently_read(tmpdir):
+    remote = FileStorage(os.path.join(tmpdir, "remote"), "remote")
+    storage = CachedStorage(remote, os.path.join(tmpdir, "cache"), max_bytes=250)
+    for name in ["a", "b", "c"]:
+        remote.put_text(["t", "r", "text", name], name * 100)
+
+    for name in ["a", "b", "a", "c"]:
+        storage.get_text(["t", "r", "text", name])
+
+    cached = sorted(os.listdir(storage.objects_dir))
+    assert len(cached) == 2
+    assert storage._object_path("t/r/text/b") not in [
+        os.path.join(storage.objects_dir, c) for c in cached
+    ]
+
+
+def test_cache_config_wraps_storage_and_maps_arrays(tmpdir):
+    reliquery_dir = os.path.join(tmpdir, "reliquery")
+    os.makedirs(reliquery_dir)
+    with open(os.path.join(reliquery_dir, "config"), mode="w+") as config_file:
+        config = {
+            "file": {
+                "storage": {"type": "File", "args": {}},
+                "cache": {"max_bytes": 2**20},
+            }
+        }
+        config_file.write(json.dumps(config))
+
+    storage = get_storage_by_name("file", tmpdir)
+    relic = Relic("r", "t", storage=storage)
+    relic.add_array("ones", np.ones((4, 4)))
+    array = relic.get_array("ones", mmap_mode="r")
+
+    assert isinstance(storage, CachedStorage)
+    assert storage.root == os.path.join(reliquery_dir, "_cache", "file")
+    assert isinstance(array, np.memmap)
+    np.testing.assert_array_equal(array, np.ones((4, 4)))
+
+
+def test_memory_cache_counts_hits_and_invalidates_on_write(tmpdir):
+    remote = FileStorage(str(tmpdir), "remote")
+    storage = MemoryCachedStorage(remote)
+    relic = Relic("r", "t", storage=storage)
+    relic.add_text("a", "hello")
+
+    with mock.patch.object(remote, "get_metadata", wraps=remote.get_metadata) as get:
+        first = storage.get_metadata(["t", "r", "metadata"], "r")
+        assert storage.get_metadata(["t", "r", "metadata"], "r") == first
+        relic.add_text("b", "world")
+        second = storage.get_metadata(["t", "r", "metadata"], "r")
+
+    # The first listing was cached while seeding the manifest of the relic
+    assert get.call_count == 1
+    assert sorted(m["name"] for m in second["r"]["text"]) == ["a", "b"]
+
+    relic.add_tag({"stage": "train"})
+    Relic("r", "t", storage=storage).add_tag({"model": "vit"})
+    assert relic.list_tags() == {"stage": "train", "model": "vit"}
+    assert storage.stats()["hits"] >= 3
+
+
+def test_memory_cache_expires_and_bounds_entries(tmpdir):
+    remote = FileStorage(str(tmpdir), "remote")
+    storage = MemoryCachedStorage(remote, max_entries=2, ttl=0.05)
+    for name in ["a", "b", "c"]:
+        remote.put_text(["t", name], name)
+        storage.get_text(["t", name])
+
+    assert storage.stats()["entries"] == 2
+
+    storage.get_text(["t", "c"])
+    remote.put_text(["t", "c"], "changed")
+    assert storage.get_text(["t", "c"]) == "c"
+    time.sleep(0.06)
+    assert storage.get_text(["t", "c"]) == "changed"
+    assert storage.hits == 2 and storage.misses == 4
+
+
+def test_memory_cache_skips_reads_that_raced_an_invalidation(tmpdir):
+    remote = FileStorage(str(tmpdir), "remote")
+    storage = MemoryCachedStorage(remote)
+    tags_path = ["t", "r", "tags"]
+    storage.put_tags(tags_path, {"state": "old"})
+    storage.invalidate(tags_path)
+    get_tags = remote.get_tags
+
+    def read_then_rewrite(path):
+        # The write lands after the remote read returned the old tags
+        tags = get_tags(path)
+        storage.put_tags(path, {"state": "new"})
+        return tags
+
+    with mock.patch.object(remote, "get_tags", side_effect=read_then_rewrite):
+        assert storage.get_tags(tags_path) == {"state": "old"}
+
+    assert storage.get_tags(tags_path) == {"state": "new"}
+
+    # Writes to other objects leave the entry alone
+    storage.put_text(["t", "other", "text", "x"], "x")
+    storage.put_text(["t", "r", "text", "a"], "a")
+    hits = storage.hits
+    storage.get_tags(tags_path)
+    assert storage.hits == hits + 1
+
+
+def test_s3_exists_uses_a_head_request():
+    from botocore.exceptions import ClientError
+
+    storage = S3Storage("bucket", "rel", "s3")
+    storage.s3 = Mock()
+    storage.s3.head_object.side_effect = [
+        {"ETag": "v1"},
+        ClientError({"Error": {"Code": "404"}}, "HeadObject"),
+    ]
+
+    assert storage.exists(["t", "r", "exists"])
+    assert not storage.exists(["t", "r", "missing"])
+    assert storage.s3.get_object.call_count == 0
+
+
+def test_file_storage_rejects_unknown_write_mode(tmpdir):
+    with pytest.raises(ValueError):
+        FileStorage(str(tmpdir), "test", write_mode="reckless")
+
+
+def test_file_storage_atomic_write_keeps_old_content_on_failure(tmpdir):
+    storage = FileStorage(str(tmpdir), "test")
+    storage.put_text(["t", "r", "files", "a"], "old")
+    source = os.path.join(tmpdir, "source")
+    with open(source, "w") as f:
+        f.write("new")
+
+    def torn_copy(src, dst):
+        dst.write(b"ne")
+        raise IOError("disk full")
+
+    with mock.patch("reliquery.storage.shutil.copyfileobj", side_effect=torn_copy):
+        with pytest.raises(IOError):
+            storage.put_file(["t", "r", "files", "a"], source)
+
+    assert storage.get_text(["t", "r", "files", "a"]) == "old"
+    assert storage.list_keys(["t", "r", "files"]) == ["a"]
+    assert os.listdir(os.path.join(tmpdir, "t", "r", "files")) == ["a"]
+
+
+def test_file_storage_durable_writes_share_directory_fsyncs(tmpdir):
+    storage = FileStorage(str(tmpdir), "test", write_mode="durable", sync_delay=0.05)
+    storage.put_text(["t", "r", "text", "first"], "creates the directory")
+
+    with mock.patch("reliquery.storage.os.fsync", wraps=os.fsync) as fsync:
+        threads = [
+            threading.Thread(
+                target=storage.put_text, args=(["t", "r", "text", str(i)], "x")
+            )
+            for i in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    # One fsync per file, the directory fsyncs are batched
+    assert 8 < fsync.call_count <= 10
+    assert len(storage.list_keys(["t", "r", "text"])) == 9
+
+
+def test_file_storage_scans_types_in_parallel_and_skips_temp_files(tmpdir):
+    storage = FileStorage(str(tmpdir), "test")
+    for relic_type in ["a", "b", "c"]:
+        storage.put_text([relic_type, "r", "text", "x"], "x")
+    with open(os.path.join(tmpdir, "a", "r", "text", "y.12.34.tmp"), "w") as f:
+        f.write("partial")
+
+    storage.put_text(["_cache", "r", "text", "x"], "cached copy")
+
+    with mock.patch.object(
+        storage,
+        "_map_concurrent_unordered",
+        wraps=storage._map_concurrent_unordered,
+    ) as map_concurrent:
+        paths = storage.list_key_paths([])
+        assert not isinstance(paths, list)
+        paths = sorted(paths)
+
+    assert paths == [os.path.join(tmpdir, t, "r", "text", "x") for t in ["a", "b", "c"]]
+    assert len(map_concurrent.call_args[0][1]) == 3
+    assert sorted(r["relic_type"] for r in storage._crawl_relic_data()) == [
+        "a",
+        "b",
+        "c",
+    ]
+
+
+def test_file_storage_layout_2_shards_artifacts_by_hash_prefix(tmpdir):
+    storage = FileStorage(str(tmpdir), "test", layout=2)
+    relic = Relic("r", "t", storage=storage)
+    relic.add_texts({f"text{i}": str(i) for i in range(50)})
+
+    text_dir = os.path.join(tmpdir, "t", "r", "text")
+    assert all(len(d) == 2 for d in os.listdir(text_dir))
+    assert len(os.listdir(text_dir)) < 50
+    assert sorted(storage.list_keys(["t", "r", "text"])) == sorted(
+        f"text{i}" for i in range(50)
+    )
+    assert relic.get_text("text7") == "7"
+    assert len(relic.describe()["r"]["text"]) == 50
+
+    assert FileStorage(str(tmpdir), "test").layout == 2
+    with pytest.raises(ValueError):
+        FileStorage(os.path.join(tmpdir, "t"), "test", layout=2)
+
+
+def test_file_storage_migrates_layout_while_in_use(tmpdir):
+    old = FileStorage(str(tmpdir), "test")
+    relic = Relic("r", "t", storage=old)
+    for i in range(10):
+        relic.add_text(f"text{i}", str(i))
+
+    storage = FileStorage(str(tmpdir), "test")
+    storage._write_layout(2)
+    # Not moved yet, read from the flat folders
+    assert storage.get_text(["t", "r", "text", "text3"]) == "3"
+    storage.put_text(["t", "r", "text", "text3"], "rewritten")
+
+    assert storage.migrate_layout() == 19
+    assert storage.migrate_layout() == 0
+
+    relic = Relic("r", "t", storage=storage)
+    assert relic.get_text("text3") == "rewritten"
+    assert relic.get_text("text4") == "4"
+    assert sorted(storage.list_keys(["t", "r", "metadata", "text"])) == sorted(
+        f"text{i}" for i in range(10)
+    )
+    assert all(
+        entry.is_dir()
+        for entry in os.scandir(os.path.join(tmpdir, "t", "r", "metadata", "text"))
+    )
+
+
+def test_file_storage_opened_before_migration_follows_it(tmpdir, monkeypatch):
+    monkeypatch.setattr(FileStorage, "layout_check_interval", 0.01)
+    a = FileStorage(str(tmpdir), "test")
+    relic = Relic("r", "t", storage=a)
+    relic.add_texts({f"text{i}": str(i) for i in range(5)})
+
+    b = FileStorage(str(tmpdir), "test")
+    assert b.migrate_layout() == 10
+
+    assert sorted(a.list_keys(["t", "r", "text"])) == [f"text{i}" for i in range(5)]
+    assert a.get_text(["t", "r", "text", "text3"]) == "3"
+    assert a.layout == 2
+
+    a.put_text(["t", "r", "text", "text3"], "rewritten")
+    assert b.get_text(["t", "r", "text", "text3"]) == "rewritten"
+    assert not os.path.exists(os.path.join(tmpdir, "t", "r", "text", "text3"))
+
+
+def test_file_storage_layout_1_reads_files_moved_to_shards(tmpdir):
+    a = FileStorage(str(tmpdir), "test")
+    a.layout_check_interval = 60
+    a.put_text(["t", "r", "text", "moved"], "x")
+
+    b = FileStorage(str(tmpdir), "test")
+    b._write_layout(2)
+    b.migrate_layout()
+
+    assert a.layout == 1
+    assert a.list_keys(["t", "r", "text"]) == ["moved"]
+    assert a.get_text(["t", "r", "text", "moved"]) == "x"
+    a.remove_obj(["t", "r", "text", "moved"])
+    assert b.list_keys(["t", "r", "text"]) == []
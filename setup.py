@@ -26,6 +26,7 @@ setup(
     extras_require={
         "S3": ["boto3 >= 1.17"],
         "Dropbox": ["dropbox"],
+        "Async": ["aiobotocore"],
         "Google": [
             "google-api-python-client",
             "google-cloud-storage",